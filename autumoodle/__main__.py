@@ -1,6 +1,4 @@
-
 if __name__ == "__main__":
-    from .cli import run
-    from asyncio import run as asyncio_run
+    from .cli import main
 
-    asyncio_run(run())
+    main()
@@ -0,0 +1,157 @@
+'''
+Author: Uyanide pywang0608@foxmail.com
+Date: 2026-10-19 01:51:00
+LastEditTime: 2026-10-19 01:51:00
+Description: Writing downloads to files on a pool of writer threads, without blocking the event loop
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO
+import asyncio
+import os
+
+from .log import Logger
+
+
+# Data is written in buffers of this size, so that all writes but the last start at a multiple of it,
+# i.e. are aligned to the blocks of the file system
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+_threads = 4
+_preallocate = False
+_executor: ThreadPoolExecutor | None = None
+
+
+def configure(threads: int, preallocate: bool) -> None:
+    '''Set the number of writer threads shared by all downloads, and whether to preallocate files of known size.'''
+    global _threads, _preallocate
+    _threads = threads
+    _preallocate = preallocate
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=_threads, thread_name_prefix="writer")
+    return _executor
+
+
+def shutdown() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+def _write_all(f: BinaryIO, data: bytearray) -> None:
+    # Unbuffered files may write less than asked for
+    view = memoryview(data)
+    while view:
+        written = f.write(view)
+        view = view[written:] if written is not None else view[len(view):]
+
+
+def _try_preallocate(f: BinaryIO, size: int) -> bool:
+    if not hasattr(os, "posix_fallocate"):
+        return False
+    try:
+        os.posix_fallocate(f.fileno(), 0, size)
+        return True
+    except OSError as e:
+        # Not supported by every file system
+        Logger.d("AsyncFileWriter", f"Failed to preallocate {size} bytes: {e}")
+        return False
+
+
+class AsyncFileWriter:
+    '''
+    Writes data received by the event loop to a file on the writer threads. Chunks are collected into
+    large buffers, and at most one buffer per file is being written at a time, so a reader faster than
+    the disk waits in write() instead of buffering more and more data in memory.
+
+        async with AsyncFileWriter(path, size_hint=total_size) as f:
+            async for chunk in response.aiter_bytes():
+                await f.write(chunk)
+    '''
+    _path: Path
+    _append: bool
+    _size_hint: int
+    _file: BinaryIO | None
+    _buffer: bytearray
+    # the buffer being written by a writer thread
+    _pending: asyncio.Future | None
+    _preallocated: bool
+    # bytes in the file that have actually been written
+    _written: int
+
+    def __init__(self, path: Path, append: bool = False, size_hint: int = 0):
+        self._path = path
+        self._append = append
+        self._size_hint = size_hint
+        self._file = None
+        self._buffer = bytearray()
+        self._pending = None
+        self._preallocated = False
+        self._written = 0
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(_get_executor(), func, *args)
+
+    def _open(self) -> None:
+        self._file = open(self._path, "ab" if self._append else "wb", buffering=0)
+        self._written = self._file.seek(0, os.SEEK_END)
+        # Appended files are resumed downloads, whose size on disk must stay what has actually been written
+        if _preallocate and not self._append and self._size_hint > 0:
+            self._preallocated = _try_preallocate(self._file, self._size_hint)
+
+    async def open(self) -> None:
+        await self._run(self._open)
+
+    def _write(self, data: bytearray) -> None:
+        _write_all(self._file, data)  # type: ignore
+        self._written += len(data)
+
+    async def _submit(self) -> None:
+        if self._pending:
+            # Backpressure, the previous buffer has to be written first
+            await self._pending
+        assert self._file
+        data, self._buffer = self._buffer, bytearray()
+        self._pending = asyncio.ensure_future(self._run(self._write, data))
+
+    async def write(self, data: bytes) -> None:
+        self._buffer += data
+        if len(self._buffer) >= WRITE_BUFFER_SIZE:
+            await self._submit()
+
+    def _close(self) -> None:
+        assert self._file
+        try:
+            if self._preallocated:
+                # Less may have been written than announced, e.g. when the download broke off
+                self._file.truncate(self._written)
+        finally:
+            self._file.close()
+            self._file = None
+
+    async def close(self) -> None:
+        if not self._file:
+            return
+        try:
+            if self._buffer:
+                await self._submit()
+            if self._pending:
+                await self._pending
+        finally:
+            self._pending = None
+            self._buffer = bytearray()
+            await self._run(self._close)
+
+    async def __aenter__(self) -> "AsyncFileWriter":
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        # Data received before an error is still written, so that the download can be resumed from there
+        await self.close()
@@ -1,19 +1,21 @@
 '''
 Author: Uyanide pywang0608@foxmail.com
 Date: 2025-10-29 22:08:19
-LastEditTime: 2026-01-13 06:06:37
+LastEditTime: 2026-10-19 02:25:30
 Description: CLI entry point for autumoodle
 '''
 
-from argparse import ArgumentParser, Action
+from argparse import ArgumentParser, Action, SUPPRESS
 from pathlib import Path
 import json
 import sys
 import os
 import getpass
+import re
+import time
 
-from autumoodle.downloader import TUMMoodleDownloader
-
+# Only lightweight modules are imported here, heavy ones (downloader, session implementations,
+# httpx, bs4, playwright, ...) are imported when the chosen command actually needs them.
 from .log import Logger
 from .config_mgr import Config
 from .utils import PatternMatcher
@@ -47,13 +49,39 @@ def get_argparser():
         help="Match course title against the given literal string (can be given multiple times)."
     )
     parser.add_argument(
-        "-S", "--session", dest="session_type", choices=["playwright", "requests"],
-        help="Override session type set in configuration file (playwright or requests)."
+        "-S", "--session", dest="session_type", choices=["playwright", "requests", "webservice"],
+        help="Override session type set in configuration file (playwright, requests or webservice)."
     )
     parser.add_argument(
         "-B", "--browser", dest="browser",
         help="Override Playwright browser type set in configuration file."
     )
+    parser.add_argument(
+        "-P", "--plan", dest="plan", action="store_true",
+        help="Only print what would be synced, without downloading anything."
+    )
+
+    subparsers = parser.add_subparsers(dest="command", metavar="COMMAND")
+    history_parser = subparsers.add_parser(
+        "history", help="Query the sync history (requires history.enabled to be true)."
+    )
+    history_parser.add_argument("-c", "--config", dest="config_path", default=SUPPRESS, help="Path to configuration file (json)")
+    history_parser.add_argument("--course", help="Only show files of courses whose title starts with the given prefix.")
+    history_parser.add_argument("--entry", help="Only show files of entries whose title starts with the given prefix.")
+    history_parser.add_argument("--path", help="Only show files whose stored path starts with the given prefix.")
+    history_parser.add_argument("--status", choices=["added", "overwritten", "renamed", "versioned"], help="Only show files with the given status.")
+    history_parser.add_argument("--days", type=float, help="Only show files synced within the given number of days.")
+    history_parser.add_argument("-n", "--limit", type=int, default=100, help="Maximum number of records to show, 0 for unlimited (default: 100).")
+
+    versions_parser = subparsers.add_parser(
+        "versions", help="List or restore previous versions of files (kept with the \"version\" update type)."
+    )
+    versions_parser.add_argument("-c", "--config", dest="config_path", default=SUPPRESS, help="Path to configuration file (json)")
+    versions_parser.add_argument("--path", help="Only show versions of files whose path contains the given substring.")
+    versions_parser.add_argument("-n", "--limit", type=int, default=100, help="Maximum number of versions to show, 0 for unlimited (default: 100).")
+    versions_parser.add_argument("--restore", type=int, metavar="ID", help="Restore the version with the given id instead of listing versions.")
+    versions_parser.add_argument(
+        "-o", "--output", help="Where to restore the version to (default: next to the file, e.g. \"slides.v12.pdf\" for version 12).")
     return parser
 
 
@@ -77,30 +105,95 @@ def get_additional_matchers(args):
     return matchers
 
 
-def get_credentials(credential_path: Path | None = None):
+def get_account_env_suffix(account_name: str) -> str:
+    return "_" + re.sub(r"[^A-Z0-9]", "_", account_name.upper())
+
+
+def _lookup_credentials(credential_path: Path | None, account_name: str | None) -> tuple[str, str]:
+    env_suffix = get_account_env_suffix(account_name) if account_name is not None else ""
+
     # First try envs
-    username: str = os.environ.get(ENV_USERNAME, "")
-    password: str = os.environ.get(ENV_PASSWORD, "")
+    username: str = os.environ.get(ENV_USERNAME + env_suffix, "")
+    password: str = os.environ.get(ENV_PASSWORD + env_suffix, "")
 
     # Then try credential file
     if credential_path is not None and credential_path.exists() and credential_path.is_file():
         try:
             cred_dict = json.loads(credential_path.read_text())
+            if account_name is not None:
+                cred_dict = cred_dict.get("accounts", {}).get(account_name, {})
             username = username if username else cred_dict.get("username", "")
             password = password if password else cred_dict.get("password", "")
         except json.JSONDecodeError:
             pass
+    return username, password
+
+
+def get_credentials(credential_path: Path | None = None, account_name: str | None = None):
+    '''
+    Get credentials of the given account, or of the unnamed default account if account_name is None.
+    Credentials of named accounts are looked up in e.g. TUM_USERNAME_ALICE and in the
+    "accounts" object of the credential file, falling back to the plain ones only if neither
+    the username nor the password of the account is found, so that the two are never mixed.
+    '''
+    username, password = _lookup_credentials(credential_path, account_name)
+    if account_name is not None and not username and not password:
+        username, password = _lookup_credentials(credential_path, None)
 
     # Finally ask user if in interactive shell
     if sys.stdin.isatty():
+        prompt_suffix = f" ({account_name})" if account_name is not None else ""
         if not username:
-            username = input("TUM Username: ")
+            username = input(f"TUM Username{prompt_suffix}: ")
         if not password:
-            password = getpass.getpass("TUM Password: ")
+            password = getpass.getpass(f"TUM Password{prompt_suffix}: ")
     return username, password
 
 
-async def run():
+def run_history(args, config: Config):
+    from .history import HistoryStore, HISTORY_FILENAME, format_record
+
+    history_path = config.summary_dir / HISTORY_FILENAME
+    if not history_path.exists():
+        raise FileNotFoundError(
+            f"History database not found: {history_path}. "
+            "Set \"history\": {\"enabled\": true} to record the sync history.")
+    with HistoryStore(history_path) as store:
+        records = store.query(
+            course=args.course,
+            entry=args.entry,
+            path=args.path,
+            status=args.status,
+            since=time.time() - args.days * 86400 if args.days is not None else None,
+            limit=args.limit,
+        )
+    for record in records:
+        print(format_record(record))
+
+
+def run_versions(args, config: Config):
+    from .versions import VersionStore, VERSIONS_FILENAME, default_restore_path, format_version
+
+    versions_path = config.cache_dir / VERSIONS_FILENAME
+    if not versions_path.exists():
+        raise FileNotFoundError(
+            f"Version store not found: {versions_path}. "
+            "Use the \"version\" update type to keep previous versions of files.")
+    with VersionStore(versions_path) as store:
+        if args.restore is not None:
+            version = store.get(args.restore)
+            if version is None:
+                raise ValueError(f"No version with id {args.restore}")
+            output = Path(args.output).expanduser() if args.output else default_restore_path(version)
+            print(f"Restored version #{version.id} of {version.path} to {store.restore(version.id, output)}")
+            return
+        for version in store.query(path=args.path, limit=args.limit):
+            print(format_version(version))
+        count, total, stored = store.stats()
+        print(f"{count} versions, {total} B in total, {stored} B stored")
+
+
+def main():
     arg_parser = get_argparser()
     args = arg_parser.parse_args()
 
@@ -108,17 +201,44 @@ async def run():
     config = load_config(config_path)
     Logger.set_level(config.log_level)
 
-    additional_matchers = get_additional_matchers(args)
+    if args.command == "history":
+        run_history(args, config)
+        return
+    if args.command == "versions":
+        run_versions(args, config)
+        return
 
-    username, password = get_credentials(Path(args.secret_path) if args.secret_path else None)
-    if not username or not password:
-        raise ValueError(
-            "Username or password are missing. "
-            "Either provide a secret file (via -s/--secret), "
-            f"or set the {ENV_USERNAME} and {ENV_PASSWORD} environment variables.")
-    config.set_credentials(username, password)
+    import asyncio
+    asyncio.run(run(args, config))
+
+
+async def run(args, config: Config):
+    from .downloader import TUMMoodleDownloader
+
+    additional_matchers = get_additional_matchers(args)
 
-    if args.session_type and args.session_type in ["playwright", "requests"]:
+    secret_path = Path(args.secret_path) if args.secret_path else None
+    for account in config.accounts:
+        if account.implicit:
+            # No "accounts" configured, only the plain credentials apply
+            username, password = get_credentials(secret_path)
+            if not username or not password:
+                raise ValueError(
+                    "Username or password are missing. "
+                    "Either provide a secret file (via -s/--secret), "
+                    f"or set the {ENV_USERNAME} and {ENV_PASSWORD} environment variables.")
+        else:
+            username, password = get_credentials(secret_path, account.name)
+            if not username or not password:
+                env_suffix = get_account_env_suffix(account.name)
+                raise ValueError(
+                    f"Username or password are missing for account '{account.name}'. "
+                    "Either provide them under \"accounts\" in the secret file (via -s/--secret), "
+                    f"or set the {ENV_USERNAME}{env_suffix} and {ENV_PASSWORD}{env_suffix} environment variables "
+                    f"(or {ENV_USERNAME} and {ENV_PASSWORD} for all accounts).")
+        config.set_credentials(username, password, account)
+
+    if args.session_type and args.session_type in ["playwright", "requests", "webservice"]:
         Logger.i("CLI", f"Overriding session type to: {args.session_type}")
         config.session_type = args.session_type
 
@@ -126,4 +246,4 @@ async def run():
         Logger.i("CLI", f"Overriding Playwright browser to: {args.browser}")
         config.playwright_browser = args.browser
 
-    await TUMMoodleDownloader(config, additional_matchers).do_magic()
+    await TUMMoodleDownloader(config, additional_matchers, plan_only=args.plan).do_magic()
@@ -1,15 +1,18 @@
 '''
 Author: Uyanide pywang0608@foxmail.com
 Date: 2025-10-26 21:59:22
-LastEditTime: 2025-11-03 13:35:25
+LastEditTime: 2026-10-19 02:29:44
 Description: Data classes representing configurations from json config files
 '''
 
 from dataclasses import dataclass, field
 from pathlib import Path
 from enum import Enum
+import os
 
 from .utils import PatternMatcher, parse_semester
+from .retry import RetryPolicy
+from .throttle import ThrottleWindow
 
 
 # Action to take when file exists & needs to be updated
@@ -17,6 +20,7 @@ class UpdateType(Enum):
     RENAME = "rename"        # like $filename.ext -> $filename_1.ext
     OVERWRITE = "overwrite"  # overwrite existing files (replace)
     SKIP = "skip"            # skip if file exists
+    VERSION = "version"      # overwrite, keeping the previous content in the version store
 
 
 class CourseConfigType(Enum):
@@ -33,16 +37,48 @@ def get_default_config():
         "cache_dir": Path.home() / ".cache" / "autumoodle",
         "session_type": "requests",
         "session_save": False,
-        "session_save_path": Path.home() / ".cache" / "autumoodle" / "session.dat",
+        "session_save_path": Path.home() / ".cache" / "autumoodle" / "session.json",
         "destination_base": Path.home() / "Documents" / "AuTUMoodle",
         "log_level": "INFO",
         "update_type": UpdateType.RENAME,
         "course_config_type": CourseConfigType.CATEGORY_AUTO,
         "playwright_browser": "firefox",
         "playwright_headless": True,
+        "webservice_url": "https://www.moodle.tum.de",
+        "webservice_token": None,
+        "webservice_concurrency": 4,
         "summary_enabled": False,
         "summary_dir": Path.home() / "Documents" / "AuTUMoodle" / "summaries",
         "summary_expire_days": 7,
+        "summary_format": "csv",
+        "history_enabled": False,
+        "history_expire_days": None,
+        "versions_max_versions": 10,
+        "versions_expire_days": None,
+        "account_name": "default",
+        "max_concurrent_courses": 0,
+        "download_batch_size": 0,
+        "download_batch_concurrency": 2,
+        "download_mode": "archive",
+        "download_file_concurrency": 4,
+        "download_writer_threads": 4,
+        "download_preallocate": False,
+        "extract_zero_copy": True,
+        "extract_workers": 1,
+        "parse_cache_enabled": True,
+        "parse_cache_max_size": 16384,
+        "retry_pages": RetryPolicy(attempts=3, base_delay=2, max_delay=30),
+        "retry_downloads": RetryPolicy(attempts=3, base_delay=10, max_delay=120),
+        "circuit_breaker_threshold": 5,
+        "circuit_breaker_cooldown": 300,
+        "throttle_bandwidth": 0,
+        "throttle_requests_per_second": 0,
+        "progress_display": "auto",
+        "progress_jsonl": None,
+        "progress_interval": 2,
+        "progress_stall_timeout": 120,
+        "metrics_listen": None,
+        "metrics_textfile": None,
     }
 
 
@@ -192,12 +228,64 @@ class CourseConfig:
         return cm
 
 
+@dataclass(slots=True)
+class AccountConfig:
+    name: str = field(default_factory=lambda: get_default_config()["account_name"])
+    username: str = field(default="")
+    password: str = field(default="")
+    destination_base: Path = field(default_factory=lambda: get_default_config()["destination_base"])
+    session_save_path: Path = field(default_factory=lambda: get_default_config()["session_save_path"])
+    webservice_token: str | None = field(default_factory=lambda: get_default_config()["webservice_token"])
+    courses_config: list[CourseConfig] = field(default_factory=list)
+    # the single account made up from the top level when no "accounts" are configured
+    implicit: bool = field(default=False)
+
+    @classmethod
+    def from_dict(cls, config_data: dict, global_config: "Config"):
+        cm = cls()
+
+        if "name" not in config_data:
+            raise ValueError("account config requires 'name' field")
+        cm.name = config_data["name"]
+
+        # Each account gets its own destination root, relative to the global one if not absolute
+        destination_base = Path(config_data.get("destination_base", cm.name)).expanduser()
+        if not destination_base.is_absolute():
+            destination_base = global_config.destination_base / destination_base
+        cm.destination_base = destination_base
+
+        # ... and its own session file
+        session_cfg = config_data.get("session", {})
+        cm.session_save_path = Path(session_cfg.get(
+            "save_path", str(global_config.cache_dir / f"session_{cm.name}.json"))).expanduser()
+        cm.webservice_token = config_data.get("webservice", {}).get("token", global_config.webservice_token)
+
+        # Fall back to the globally configured courses
+        if "courses" in config_data:
+            for course_cfg in config_data["courses"]:
+                cm.courses_config.append(CourseConfig.from_dict(course_cfg))
+        else:
+            cm.courses_config = global_config.courses_config
+
+        return cm
+
+    @classmethod
+    def from_global(cls, global_config: "Config"):
+        '''The implicit single account when no "accounts" are configured'''
+        cm = cls()
+        cm.implicit = True
+        cm.destination_base = global_config.destination_base
+        cm.session_save_path = global_config.session_save_path
+        cm.webservice_token = global_config.webservice_token
+        cm.courses_config = global_config.courses_config
+        return cm
+
+
 @dataclass(slots=True)
 class Config:
     courses_config: list[CourseConfig] = field(default_factory=list)
+    accounts: list[AccountConfig] = field(default_factory=list)
     ignored_files: list[PatternMatcher] = field(default_factory=list)
-    username: str = field(default="")
-    password: str = field(default="")
     show_hidden_courses: bool = field(default_factory=lambda: get_default_config()["show_hidden_courses"])
     cache_dir: Path = field(default_factory=lambda: get_default_config()["cache_dir"])
     session_type: str = field(default_factory=lambda: get_default_config()["session_type"])
@@ -208,8 +296,42 @@ class Config:
     summary_enabled: bool = field(default_factory=lambda: get_default_config()["summary_enabled"])
     summary_dir: Path = field(default_factory=lambda: get_default_config()["summary_dir"])
     summary_expire_days: int = field(default_factory=lambda: get_default_config()["summary_expire_days"])
+    history_enabled: bool = field(default_factory=lambda: get_default_config()["history_enabled"])
+    # None to keep the sync history forever
+    history_expire_days: int | None = field(default_factory=lambda: get_default_config()["history_expire_days"])
+    # None for no limit on the number or age of kept versions respectively
+    versions_max_versions: int | None = field(default_factory=lambda: get_default_config()["versions_max_versions"])
+    versions_expire_days: int | None = field(default_factory=lambda: get_default_config()["versions_expire_days"])
+    summary_format: str = field(default_factory=lambda: get_default_config()["summary_format"])
     playwright_browser: str = field(default_factory=lambda: get_default_config()["playwright_browser"])
     playwright_headless: bool = field(default_factory=lambda: get_default_config()["playwright_headless"])
+    webservice_url: str = field(default_factory=lambda: get_default_config()["webservice_url"])
+    webservice_token: str | None = field(default_factory=lambda: get_default_config()["webservice_token"])
+    webservice_concurrency: int = field(default_factory=lambda: get_default_config()["webservice_concurrency"])
+    max_concurrent_courses: int = field(default_factory=lambda: get_default_config()["max_concurrent_courses"])
+    download_batch_size: int = field(default_factory=lambda: get_default_config()["download_batch_size"])
+    download_batch_concurrency: int = field(default_factory=lambda: get_default_config()["download_batch_concurrency"])
+    download_mode: str = field(default_factory=lambda: get_default_config()["download_mode"])
+    download_file_concurrency: int = field(default_factory=lambda: get_default_config()["download_file_concurrency"])
+    download_writer_threads: int = field(default_factory=lambda: get_default_config()["download_writer_threads"])
+    download_preallocate: bool = field(default_factory=lambda: get_default_config()["download_preallocate"])
+    extract_zero_copy: bool = field(default_factory=lambda: get_default_config()["extract_zero_copy"])
+    extract_workers: int = field(default_factory=lambda: get_default_config()["extract_workers"])
+    parse_cache_enabled: bool = field(default_factory=lambda: get_default_config()["parse_cache_enabled"])
+    parse_cache_max_size: int = field(default_factory=lambda: get_default_config()["parse_cache_max_size"])
+    retry_pages: RetryPolicy = field(default_factory=lambda: get_default_config()["retry_pages"])
+    retry_downloads: RetryPolicy = field(default_factory=lambda: get_default_config()["retry_downloads"])
+    circuit_breaker_threshold: int = field(default_factory=lambda: get_default_config()["circuit_breaker_threshold"])
+    circuit_breaker_cooldown: float = field(default_factory=lambda: get_default_config()["circuit_breaker_cooldown"])
+    throttle_bandwidth: float = field(default_factory=lambda: get_default_config()["throttle_bandwidth"])
+    throttle_requests_per_second: float = field(default_factory=lambda: get_default_config()["throttle_requests_per_second"])
+    throttle_schedule: list[ThrottleWindow] = field(default_factory=list)
+    progress_display: str = field(default_factory=lambda: get_default_config()["progress_display"])
+    progress_jsonl: str | None = field(default_factory=lambda: get_default_config()["progress_jsonl"])
+    progress_interval: float = field(default_factory=lambda: get_default_config()["progress_interval"])
+    progress_stall_timeout: float = field(default_factory=lambda: get_default_config()["progress_stall_timeout"])
+    metrics_listen: tuple[str, int] | None = field(default_factory=lambda: get_default_config()["metrics_listen"])
+    metrics_textfile: Path | None = field(default_factory=lambda: get_default_config()["metrics_textfile"])
 
     @classmethod
     def from_dict(cls, config_data: dict):
@@ -222,7 +344,7 @@ class Config:
                 session_cfg = config_data["session"]
                 cm.session_save = session_cfg.get("save", cm.session_save)
                 cm.session_save_path = Path(session_cfg.get(
-                    "save_path", str(cm.cache_dir / "session.dat"))).expanduser()
+                    "save_path", str(cm.cache_dir / "session.json"))).expanduser()
 
             if "log_level" in config_data:
                 cm.log_level = config_data["log_level"]
@@ -239,6 +361,25 @@ class Config:
                 cm.summary_enabled = summary_cfg.get("enabled", cm.summary_enabled)
                 cm.summary_dir = Path(summary_cfg.get("path", str(cm.destination_base / "summaries"))).expanduser()
                 cm.summary_expire_days = summary_cfg.get("expire_days", cm.summary_expire_days)
+                cm.summary_format = summary_cfg.get("format", cm.summary_format).lower()
+                if cm.summary_format not in ["csv", "jsonl", "sqlite"]:
+                    raise ValueError(f"Invalid summary format: {cm.summary_format}, must be one of csv, jsonl, sqlite")
+
+            if "history" in config_data:
+                history_cfg = config_data["history"]
+                cm.history_enabled = history_cfg.get("enabled", cm.history_enabled)
+                cm.history_expire_days = history_cfg.get("expire_days", cm.history_expire_days)
+                if cm.history_expire_days is not None and cm.history_expire_days < 1:
+                    raise ValueError("history.expire_days must be at least 1, or null to keep the history forever")
+
+            if "versions" in config_data:
+                versions_cfg = config_data["versions"]
+                cm.versions_max_versions = versions_cfg.get("max_versions", cm.versions_max_versions)
+                if cm.versions_max_versions is not None and cm.versions_max_versions < 1:
+                    raise ValueError("versions.max_versions must be at least 1, or null to keep any number of versions")
+                cm.versions_expire_days = versions_cfg.get("expire_days", cm.versions_expire_days)
+                if cm.versions_expire_days is not None and cm.versions_expire_days < 1:
+                    raise ValueError("versions.expire_days must be at least 1, or null to keep versions forever")
 
             cm.session_type = config_data.get("session_type", cm.session_type).lower()
 
@@ -247,6 +388,14 @@ class Config:
                 cm.playwright_browser = pw_cfg.get("browser", cm.playwright_browser)
                 cm.playwright_headless = pw_cfg.get("headless", cm.playwright_headless)
 
+            if "webservice" in config_data:
+                ws_cfg = config_data["webservice"]
+                cm.webservice_url = ws_cfg.get("url", cm.webservice_url)
+                cm.webservice_token = ws_cfg.get("token", cm.webservice_token)
+                cm.webservice_concurrency = ws_cfg.get("concurrency", cm.webservice_concurrency)
+                if cm.webservice_concurrency < 1:
+                    raise ValueError("webservice.concurrency must be at least 1")
+
             if "courses" in config_data:
                 for course_cfg in config_data["courses"]:
                     cm.courses_config.append(CourseConfig.from_dict(course_cfg))
@@ -260,11 +409,131 @@ class Config:
                     )
                     cm.ignored_files.append(pm)
 
+            cm.max_concurrent_courses = config_data.get("max_concurrent_courses", cm.max_concurrent_courses)
+            if cm.max_concurrent_courses < 0:
+                raise ValueError("max_concurrent_courses must not be negative")
+
+            if "download" in config_data:
+                download_cfg = config_data["download"]
+                cm.download_batch_size = download_cfg.get("batch_size", cm.download_batch_size)
+                cm.download_batch_concurrency = download_cfg.get("batch_concurrency", cm.download_batch_concurrency)
+                if cm.download_batch_size < 0:
+                    raise ValueError("download.batch_size must not be negative")
+                if cm.download_batch_concurrency < 1:
+                    raise ValueError("download.batch_concurrency must be at least 1")
+                cm.download_mode = download_cfg.get("mode", cm.download_mode).lower()
+                if cm.download_mode not in ["archive", "files"]:
+                    raise ValueError(f"Invalid download mode: {cm.download_mode}, must be one of archive, files")
+                cm.download_file_concurrency = download_cfg.get("file_concurrency", cm.download_file_concurrency)
+                if cm.download_file_concurrency < 1:
+                    raise ValueError("download.file_concurrency must be at least 1")
+                cm.download_writer_threads = download_cfg.get("writer_threads", cm.download_writer_threads)
+                if cm.download_writer_threads < 1:
+                    raise ValueError("download.writer_threads must be at least 1")
+                cm.download_preallocate = download_cfg.get("preallocate", cm.download_preallocate)
+
+            if "extract" in config_data:
+                extract_cfg = config_data["extract"]
+                cm.extract_zero_copy = extract_cfg.get("zero_copy", cm.extract_zero_copy)
+                cm.extract_workers = extract_cfg.get("workers", cm.extract_workers)
+                if cm.extract_workers < 0:
+                    raise ValueError("extract.workers must not be negative")
+                if cm.extract_workers == 0:
+                    cm.extract_workers = os.cpu_count() or 1
+
+            if "parse_cache" in config_data:
+                parse_cache_cfg = config_data["parse_cache"]
+                cm.parse_cache_enabled = parse_cache_cfg.get("enabled", cm.parse_cache_enabled)
+                cm.parse_cache_max_size = parse_cache_cfg.get("max_size", cm.parse_cache_max_size)
+                if cm.parse_cache_max_size < 1:
+                    raise ValueError("parse_cache.max_size must be at least 1")
+
+            if "retry" in config_data:
+                retry_cfg = config_data["retry"]
+                cm.retry_pages = RetryPolicy.from_dict(retry_cfg.get("pages", {}), cm.retry_pages)
+                cm.retry_downloads = RetryPolicy.from_dict(retry_cfg.get("downloads", {}), cm.retry_downloads)
+                breaker_cfg = retry_cfg.get("circuit_breaker", {})
+                cm.circuit_breaker_threshold = breaker_cfg.get("threshold", cm.circuit_breaker_threshold)
+                cm.circuit_breaker_cooldown = breaker_cfg.get("cooldown", cm.circuit_breaker_cooldown)
+                if cm.circuit_breaker_threshold < 0 or cm.circuit_breaker_cooldown < 0:
+                    raise ValueError("retry.circuit_breaker.threshold and cooldown must not be negative")
+
+            if "throttle" in config_data:
+                throttle_cfg = config_data["throttle"]
+                cm.throttle_bandwidth = throttle_cfg.get("bandwidth", cm.throttle_bandwidth)
+                cm.throttle_requests_per_second = throttle_cfg.get("requests_per_second", cm.throttle_requests_per_second)
+                for window_cfg in throttle_cfg.get("schedule", []):
+                    cm.throttle_schedule.append(ThrottleWindow.from_dict(window_cfg))
+                for value in [cm.throttle_bandwidth, cm.throttle_requests_per_second,
+                              *[w.bandwidth for w in cm.throttle_schedule], *[w.requests_per_second for w in cm.throttle_schedule]]:
+                    if value is not None and value < 0:
+                        raise ValueError("throttle limits must not be negative")
+
+            if "progress" in config_data:
+                progress_cfg = config_data["progress"]
+                cm.progress_display = progress_cfg.get("display", cm.progress_display).lower()
+                if cm.progress_display not in ["auto", "terminal", "none"]:
+                    raise ValueError(f"Invalid progress display: {cm.progress_display}, must be one of auto, terminal, none")
+                cm.progress_jsonl = progress_cfg.get("jsonl", cm.progress_jsonl)
+                cm.progress_interval = progress_cfg.get("interval", cm.progress_interval)
+                if cm.progress_interval <= 0:
+                    raise ValueError("progress.interval must be positive")
+                cm.progress_stall_timeout = progress_cfg.get("stall_timeout", cm.progress_stall_timeout)
+                if cm.progress_stall_timeout < 0:
+                    raise ValueError("progress.stall_timeout must not be negative")
+
+            if "metrics" in config_data:
+                metrics_cfg = config_data["metrics"]
+                if metrics_cfg.get("listen"):
+                    host, _, port = str(metrics_cfg["listen"]).rpartition(":")
+                    if not port.isdigit():
+                        raise ValueError(f"Invalid metrics.listen: {metrics_cfg['listen']}, expected HOST:PORT")
+                    cm.metrics_listen = (host or "127.0.0.1", int(port))
+                if metrics_cfg.get("textfile"):
+                    cm.metrics_textfile = Path(metrics_cfg["textfile"]).expanduser()
+
+            if "accounts" in config_data:
+                names = set()
+                for account_cfg in config_data["accounts"]:
+                    account = AccountConfig.from_dict(account_cfg, cm)
+                    if account.name in names:
+                        raise ValueError(f"Duplicate account name: {account.name}")
+                    names.add(account.name)
+                    cm.accounts.append(account)
+                if not cm.accounts:
+                    raise ValueError("'accounts' must not be empty if given")
+            else:
+                cm.accounts.append(AccountConfig.from_global(cm))
+
             return cm
 
         except Exception as e:
             raise ValueError(f"Error parsing configuration: {e}") from e
 
-    def set_credentials(self, username: str, password: str):
-        self.username = username
-        self.password = password
+    def _default_account(self) -> AccountConfig:
+        # The account the top-level credentials belong to, e.g. for configs built in code rather than loaded
+        if not self.accounts:
+            self.accounts.append(AccountConfig.from_global(self))
+        return self.accounts[0]
+
+    @property
+    def username(self) -> str:
+        return self.accounts[0].username if self.accounts else ""
+
+    @username.setter
+    def username(self, username: str):
+        self._default_account().username = username
+
+    @property
+    def password(self) -> str:
+        return self.accounts[0].password if self.accounts else ""
+
+    @password.setter
+    def password(self, password: str):
+        self._default_account().password = password
+
+    def set_credentials(self, username: str, password: str, account: AccountConfig | None = None):
+        if account is None:
+            account = self._default_account()
+        account.username = username
+        account.password = password
@@ -0,0 +1,52 @@
+'''
+Author: Uyanide pywang0608@foxmail.com
+Date: 2026-10-19 01:23:07
+LastEditTime: 2026-10-19 02:25:05
+Description: Selects the courses to be processed by semester and title
+'''
+
+from .config_mgr import CourseConfig
+from .utils import PatternMatcher
+
+
+class CourseSelector:
+    '''
+    Built once per account from its course configs and the additional matchers given via CLI,
+    so that sessions can skip non-matching courses while parsing the course list.
+    '''
+    # course configs indexed by (is_ws, start_year), in their original order
+    _by_semester: dict[tuple[bool, int], list[CourseConfig]]
+    _additional_matchers: list[PatternMatcher]
+
+    def __init__(self, courses_config: list[CourseConfig], additional_matchers: list[PatternMatcher] | None = None):
+        self._by_semester = {}
+        for config in courses_config:
+            # No matcher (should not happen)
+            if not config.title_matcher:
+                continue
+            self._by_semester.setdefault((config.is_ws, config.start_year), []).append(config)
+        self._additional_matchers = additional_matchers if additional_matchers else []
+
+    def _check_additional_matchers(self, title: str) -> bool:
+        # if not provided, always match
+        if not self._additional_matchers:
+            return True
+        for matcher in self._additional_matchers:
+            if matcher.match(title):
+                return True
+        return False
+
+    def matches_title(self, title: str) -> bool:
+        '''Whether the course would be processed in some semester, e.g. to report courses whose semester is uncertain.'''
+        return any(config.title_matcher.match(title) for configs in self._by_semester.values() for config in configs) \
+            and self._check_additional_matchers(title)
+
+    def select(self, title: str, is_ws: bool, start_year: int) -> CourseConfig | None:
+        '''Return the first course config matching the course, or None if the course is not to be processed.'''
+        configs = self._by_semester.get((is_ws, start_year))
+        if not configs:
+            return None
+        for config in configs:
+            if config.title_matcher.match(title):
+                return config if self._check_additional_matchers(title) else None
+        return None
@@ -1,21 +1,36 @@
 '''
 Author: Uyanide pywang0608@foxmail.com
 Date: 2025-10-29 22:08:19
-LastEditTime: 2025-11-06 20:44:01
+LastEditTime: 2026-10-19 02:29:54
 Description: Main logic for downloading courses based on configuration
 '''
 
 from pathlib import Path
+from contextlib import nullcontext
 import asyncio
+import shutil
+import threading
+import time
 
 
-from .session_mgr import TUMMoodleSessionBuilder
-from .session_intf import TUMMoodleSession, CourseInfo, CategoryInfo
-from .config_mgr import Config, CourseConfig, CourseConfigType
-from .utils import create_temp_file, PatternMatcher, sanitize_filename
+from .session_mgr import TUMMoodleSessionBuilder, TUMMoodleSessionBackend
+from .session_intf import TUMMoodleSession, TUMMoodleFileSession, CourseInfo, CategoryInfo, BatchOptions, RemoteFile
+from .config_mgr import Config, AccountConfig, CourseConfig, CourseConfigType
+from .utils import PatternMatcher, sanitize_filename
 from .log import Logger
-from .zip_extract import EntryDownloadConfig, extract_files
+from .zip_extract import EntryDownloadConfig, ExtractOptions, FileRoute, extract_files, route_file, is_up_to_date, store_file, \
+    shutdown_process_pool
 from .summary import SummaryManager, SummaryWriter
+from .journal import JOURNAL_DIRNAME, Journal, recover
+from .fs_index import FSIndex, shutdown_scan_pool
+from .versions import VERSIONS_FILENAME, VersionStore
+from .retry import CircuitBreaker
+from .throttle import Throttle
+from .progress import ProgressTracker, CourseProgress
+from . import metrics
+from . import aio_writer
+from .course_selector import CourseSelector
+from .plan import PlanEntry, PLAN_IGNORE, LocalTree, evaluate_entry, evaluate_file, entry_file_prefix, file_entry_prefixes, format_plan
 
 
 class _CourseProcess():
@@ -26,6 +41,15 @@ class _CourseProcess():
     _entry_download_configs: list[EntryDownloadConfig]
     _ignored_files_list: list[PatternMatcher]
     _summary_writer: SummaryWriter | None
+    _batch_options: BatchOptions
+    _extract_options: ExtractOptions
+    _progress: CourseProgress | None
+    _journal: Journal | None
+    _index: FSIndex | None
+    _versions: VersionStore | None
+    # lists the destination while the resources are being listed and downloaded
+    _scan_task: asyncio.Task | None
+    _scan_stop: threading.Event
 
     def __init__(self,
                  session: TUMMoodleSession,
@@ -33,13 +57,27 @@ class _CourseProcess():
                  course: CourseInfo,
                  global_destination_base: Path,
                  ignored_files_list: list[PatternMatcher],
-                 summary_writer: SummaryWriter | None = None):
+                 summary_writer: SummaryWriter | None = None,
+                 batch_options: BatchOptions = BatchOptions(),
+                 extract_options: ExtractOptions = ExtractOptions(),
+                 progress: CourseProgress | None = None,
+                 journal: Journal | None = None,
+                 index: FSIndex | None = None,
+                 versions: VersionStore | None = None):
         self._session = session
         self._course_config = course_config
         self._course = course
         self._entry_download_configs = []
         self._ignored_files_list = ignored_files_list.copy()
         self._summary_writer = summary_writer
+        self._batch_options = batch_options
+        self._extract_options = extract_options
+        self._progress = progress
+        self._journal = journal
+        self._index = index
+        self._versions = versions
+        self._scan_task = None
+        self._scan_stop = threading.Event()
 
         if course_config.destination_base:
             if course_config.destination_base.is_absolute():
@@ -207,7 +245,7 @@ class _CourseProcess():
     ########
     # Main download logic
 
-    async def proc(self):
+    def _get_filter_func(self):
         get_filter_func_func = None
         if self._course_config.config_type == CourseConfigType.CATEGORY_AUTO:
             get_filter_func_func = self._get_filter_func_category_auto
@@ -221,106 +259,332 @@ class _CourseProcess():
         if not get_filter_func_func:
             raise ValueError(f"Unsupported course config type: {self._course_config.config_type}")
 
-        filter_func = get_filter_func_func(self._course_config)
-        temp_zip_path = create_temp_file(".zip")
+        return get_filter_func_func(self._course_config)
+
+    async def plan(self) -> list[PlanEntry]:
+        '''
+        Compute what proc() would do with each entry, without downloading anything. Sessions that can list
+        the single files of a course report the files with their modification times, which are routed and
+        compared like downloaded ones. Entries whose files are not known are routed by their titles.
+        '''
+        filter_func = self._get_filter_func()
+        all_entries: list[tuple[str, str]] = []
+        kept: set[tuple[str, str]] = set()
+
+        def recording_filter_func(resource: list[CategoryInfo]) -> list[CategoryInfo]:
+            # Remember the entries before filtering, so that filtered out ones can be listed as well
+            for category in resource:
+                all_entries.extend((category.title, entry.title) for entry in category.entries)
+            filtered = filter_func(resource)
+            kept.update((category.title, entry.title) for category in filtered for entry in category.entries)
+            return filtered
+
+        files: list[RemoteFile] = []
+        # Files are only known if proc() would download them one by one as well
+        if isinstance(self._session, TUMMoodleFileSession) and self._session.prefers_files():
+            def want(file: RemoteFile) -> bool:
+                files.append(file)
+                return False
+
+            async def on_file(file: RemoteFile, path: Path):
+                pass
+
+            # Nothing is wanted, and without on_archive no archive is requested either
+            await self._session.download_files(self._course.id, want, on_file, recording_filter_func)
+        else:
+            await self._session.get_categories(self._course.id, recording_filter_func)
+
+        files_by_entry: dict[str, list[RemoteFile]] = {}
+        for file in files:
+            for prefix in file_entry_prefixes(file.name):
+                files_by_entry.setdefault(prefix, []).append(file)
+        local_tree = LocalTree()
+        plan = []
+        for category_name, entry_name in all_entries:
+            if (category_name, entry_name) not in kept:
+                plan.append(PlanEntry(self._course.title, category_name, entry_name, None, None, None, PLAN_IGNORE))
+                continue
+            prefix = entry_file_prefix(category_name, entry_name)
+            entry_files = files_by_entry.get(prefix)
+            if entry_files:
+                plan.extend(evaluate_file(self._course.title, category_name, entry_name, file, self._route_file(file))
+                            for file in entry_files)
+            else:
+                plan.append(evaluate_entry(self._course.title, category_name, entry_name,
+                                           self._route_file(RemoteFile(prefix, "", 0, 0)), local_tree))
+        return plan
+
+    def _route_file(self, file: RemoteFile) -> FileRoute | None:
+        return route_file(file.name, self._destination_base, self._entry_download_configs,
+                          self._ignored_files_list, self._course_config.files)
+
+    def _start_scan(self):
+        if self._index:
+            self._scan_task = asyncio.create_task(asyncio.to_thread(self._index.scan, [self._destination_base], self._scan_stop))
+
+    async def _wait_scan(self):
+        if self._scan_task:
+            try:
+                await self._scan_task
+            except Exception as e:
+                # Unscanned directories are listed on first use instead
+                Logger.w("Downloader", f"Failed to scan '{self._destination_base}': {e}")
+            self._scan_task = None
+
+    async def _proc_files(self, session: TUMMoodleFileSession):
+        filter_func = self._get_filter_func()
+        # Files are checked against the index before the first one is downloaded
+        await self._wait_scan()
+
+        def want(file: RemoteFile) -> bool:
+            route = self._route_file(file)
+            return route is not None and not is_up_to_date(route, file.time_modified, self._index)
+
+        # Each file is stored as soon as it is downloaded
+        async def on_file(file: RemoteFile, path: Path):
+            route = self._route_file(file)
+            if route is None:
+                return
+            # Off the event loop, moving across file systems copies the whole file
+            await asyncio.to_thread(store_file, route, file.time_modified, lambda dest: shutil.move(path, dest),
+                                    self._course.title, self._summary_writer, self._journal, self._index, self._versions)
+
+        Logger.d("Downloader", f"Downloading files of course '{self._course.title}'...")
+        await session.download_files(
+            self._course.id,
+            want,
+            on_file,
+            filter_func,
+            self._progress,
+            self._on_archive
+        )
+
+    # Each archive is extracted as soon as it is downloaded
+    async def _on_archive(self, zip_path: Path):
+        metrics.ARCHIVES.inc(course=self._course.title)
+        metrics.ARCHIVE_BYTES.inc(zip_path.stat().st_size, course=self._course.title)
+        await self._wait_scan()
+        Logger.d("Downloader", f"Extracting course '{self._course.title}' from '{zip_path}'...")
+        # Off the event loop, so that the downloads of other courses go on meanwhile
+        await asyncio.to_thread(
+            extract_files,
+            zip_path,
+            self._course.title,
+            self._destination_base,
+            self._entry_download_configs,
+            self._ignored_files_list,
+            self._course_config.files,
+            self._summary_writer,
+            self._journal,
+            self._index,
+            self._versions,
+            self._extract_options
+        )
+
+    async def proc(self):
+        self._start_scan()
         try:
-            Logger.d("Downloader", f"Downloading course '{self._course.title}' to temporary file '{temp_zip_path}'...")
-            await self._session.download_archive(
-                self._course.id,
-                temp_zip_path,
-                filter_func
-            )
-            if not temp_zip_path.exists():
-                raise RuntimeError("Downloaded archive file does not exist")
-            if temp_zip_path.stat().st_size == 0:
-                raise RuntimeError("Downloaded archive is empty")
-
-            Logger.d("Downloader", f"Extracting course '{self._course.title}' from '{temp_zip_path}'...")
-            extract_files(
-                temp_zip_path,
-                self._course.title,
-                self._destination_base,
-                self._entry_download_configs,
-                self._ignored_files_list,
-                self._course_config.files,
-                self._summary_writer
-            )
+            await self._proc()
         finally:
-            if temp_zip_path.exists():
-                temp_zip_path.unlink()
+            if self._scan_task:
+                # Cancelling the task does not stop the thread it runs on
+                self._scan_stop.set()
+                self._scan_task.cancel()
+
+    async def _proc(self):
+        if isinstance(self._session, TUMMoodleFileSession) and self._session.prefers_files():
+            await self._proc_files(self._session)
+            return
+
+        filter_func = self._get_filter_func()
+
+        Logger.d("Downloader", f"Downloading course '{self._course.title}'...")
+        await self._session.download_archives(
+            self._course.id,
+            self._on_archive,
+            filter_func,
+            self._batch_options,
+            self._progress
+        )
 
 
 class TUMMoodleDownloader():
-    _session: TUMMoodleSession
     _config: Config
     _summary_writer: SummaryWriter | None
+    # records the files being written, for recovery by the next run should this one crash
+    _journal: Journal | None
+    # what is stored in the destinations, shared by all courses of the run
+    _index: FSIndex | None
+    # previous versions of files updated with the "version" update type
+    _versions: VersionStore | None
     _additional_matchers: list[PatternMatcher]
-
-    def __init__(self, config: Config, additional_matchers: list[PatternMatcher] | None = None):
+    # limits the number of courses processed at the same time across all accounts
+    _course_slots: asyncio.Semaphore | None
+    # only compute and print the sync plan, without downloading anything
+    _plan_only: bool
+    # by account name and course id, titles are not unique across accounts
+    _plans: dict[tuple[str, str], tuple[str, list[PlanEntry]]]
+    _progress: ProgressTracker | None
+
+    def __init__(self, config: Config, additional_matchers: list[PatternMatcher] | None = None, plan_only: bool = False):
         self._config = config
         self._summary_writer = None
+        self._journal = None
+        self._index = None
+        self._versions = None
         self._additional_matchers = additional_matchers if additional_matchers else []
+        self._course_slots = None
+        self._plan_only = plan_only
+        self._plans = {}
+        self._progress = None
 
-    def _check_additional_matchers(self, course_title: str) -> bool:
-        # if not provided, always match
-        if not self._additional_matchers:
-            return True
-        for matcher in self._additional_matchers:
-            if matcher.match(course_title):
-                return True
-        return False
-
-    async def _proc_course(self, course: CourseInfo):
+    async def _proc_course(self, session: TUMMoodleSession, account: AccountConfig, course_config: CourseConfig, course: CourseInfo):
         try:
-            # Check if the course matches any configured course
-            course_config = None
-            for config in self._config.courses_config:
-                # No matcher (should not happen)
-                if not config.title_matcher:
-                    continue
-                # Title didn't match
-                if not config.title_matcher.match(course.title):
-                    continue
-                # Compare semester
-                if course.is_ws != config.is_ws or course.start_year != config.start_year:
-                    continue
-                course_config = config
-                break
-            if not course_config:
-                Logger.d("Downloader", f"Skipping course '{course.title}': no matching config found")
-                return
-
-            if not self._check_additional_matchers(course.title):
-                Logger.d("Downloader", f"Skipping course '{course.title}': does not match any of the additional matchers")
-                return
-
-            Logger.i("Downloader", f"Started processing course '{course.title}'")
-            await _CourseProcess(
-                self._session,
-                course_config,
-                course,
-                self._config.destination_base,
-                self._config.ignored_files,
-                self._summary_writer,
-            ).proc()
-            Logger.i("Downloader", f"Finished processing course '{course.title}'")
+            async with self._course_slots or nullcontext():
+                course_process = _CourseProcess(
+                    session,
+                    course_config,
+                    course,
+                    account.destination_base,
+                    self._config.ignored_files,
+                    self._summary_writer,
+                    BatchOptions(
+                        self._config.download_batch_size,
+                        self._config.download_batch_concurrency,
+                    ),
+                    ExtractOptions(self._config.extract_zero_copy, self._config.extract_workers),
+                    self._progress.course(course.title) if self._progress else None,
+                    self._journal,
+                    self._index,
+                    self._versions,
+                )
+                if self._plan_only:
+                    Logger.d("Downloader", f"Planning course '{course.title}'")
+                    self._plans[(account.name, course.id)] = (course.title, await course_process.plan())
+                    return
+                Logger.i("Downloader", f"Started processing course '{course.title}'")
+                start = time.perf_counter()
+                await course_process.proc()
+                metrics.COURSE_DURATION.observe(time.perf_counter() - start, course=course.title)
+                metrics.COURSE_LAST_SYNC.set(time.time(), course=course.title)
+                Logger.i("Downloader", f"Finished processing course '{course.title}'")
         except Exception as e:
+            metrics.COURSE_FAILURES.inc(course=course.title)
             Logger.e("Downloader", f"Error downloading from course '{course.title}': {e}")
 
+    async def _proc_account(self, account: AccountConfig, backend, breaker: CircuitBreaker, throttle: Throttle):
+        try:
+            async with TUMMoodleSessionBuilder(self._config, account, backend, breaker, throttle) as session:
+                # Courses not matching any config or additional matcher are already skipped while parsing
+                selector = CourseSelector(account.courses_config, self._additional_matchers)
+                courses = await session.get_courses(self._config.show_hidden_courses, selector)
+                Logger.i("Downloader", f"Found {len(courses)} matching courses for account '{account.name}'")
+                await asyncio.gather(*[
+                    self._proc_course(session, account, course_config, course)
+                    for course in courses
+                    if (course_config := selector.select(course.title, course.is_ws, course.start_year))
+                ])
+        except Exception as e:
+            Logger.e("Downloader", f"Error processing account '{account.name}': {e}")
+
+    async def _proc_accounts(self):
+        self._index = FSIndex() if not self._plan_only else None
+        if self._config.max_concurrent_courses > 0:
+            self._course_slots = asyncio.Semaphore(self._config.max_concurrent_courses)
+        # All accounts talk to the same host, so they share one circuit breaker
+        breaker = CircuitBreaker(self._config.circuit_breaker_threshold, self._config.circuit_breaker_cooldown)
+        # Limits are global, not per account
+        throttle = Throttle(self._config.throttle_bandwidth,
+                            self._config.throttle_requests_per_second,
+                            self._config.throttle_schedule)
+        self._progress = ProgressTracker(
+            self._config.progress_display if not self._plan_only else "none",
+            self._config.progress_jsonl if not self._plan_only else None,
+            self._config.progress_interval,
+            self._config.progress_stall_timeout,
+        )
+        # Downloads of all accounts share the writer threads
+        aio_writer.configure(self._config.download_writer_threads, self._config.download_preallocate)
+        try:
+            async with self._progress.running(), TUMMoodleSessionBackend(self._config) as backend:
+                await asyncio.gather(*[self._proc_account(account, backend, breaker, throttle)
+                                       for account in self._config.accounts])
+        finally:
+            await asyncio.to_thread(aio_writer.shutdown)
+            await asyncio.to_thread(shutdown_process_pool)
+            await asyncio.to_thread(shutdown_scan_pool)
+
+    async def _proc_with_metrics(self):
+        server = None
+        if self._config.metrics_listen:
+            try:
+                server = await metrics.serve(*self._config.metrics_listen)
+            except OSError as e:
+                Logger.e("Downloader", f"Failed to serve metrics on {self._config.metrics_listen}: {e}")
+        start = time.perf_counter()
+        try:
+            await self._proc_accounts()
+        finally:
+            metrics.RUN_DURATION.set(time.perf_counter() - start)
+            metrics.RUN_LAST.set(time.time())
+            if server:
+                server.close()
+                await server.wait_closed()
+            if self._config.metrics_textfile:
+                try:
+                    metrics.REGISTRY.write_textfile(self._config.metrics_textfile)
+                except OSError as e:
+                    Logger.e("Downloader", f"Failed to write metrics to {self._config.metrics_textfile}: {e}")
+
+    async def _proc_with_journal(self):
+        journal_dir = self._config.cache_dir / JOURNAL_DIRNAME
+        # Writes left in flight by a crashed run are dealt with before anything else is written
+        recover(journal_dir)
+        journal = Journal(journal_dir)
+        try:
+            journal.open()
+            self._journal = journal
+        except OSError as e:
+            Logger.e("Downloader", f"Failed to open journal in {journal_dir}, interrupted writes cannot be recovered: {e}")
+        # Connected on first use, i.e. only when a file with the "version" update type is replaced
+        versions_path = self._config.cache_dir / VERSIONS_FILENAME
+        self._versions = VersionStore(versions_path, self._config.versions_max_versions, self._config.versions_expire_days)
+        try:
+            await self._proc_with_metrics()
+        finally:
+            self._journal = None
+            journal.close()
+            try:
+                # Versions beyond the retention limits are deleted once per run, if any have ever been kept
+                if versions_path.exists():
+                    self._versions.prune()
+            except Exception as e:
+                Logger.e("Downloader", f"Failed to prune the version store {versions_path}: {e}")
+            finally:
+                self._versions.close()
+                self._versions = None
+
     # Do magic ╰( ͡° ͜ʖ ͡° )つ──☆*:・ﾟ
     async def do_magic(self):
-        async with TUMMoodleSessionBuilder(self._config) as self._session:  # type: ignore
-            if self._config.summary_enabled:
-                with SummaryManager(
-                    self._config.summary_expire_days,
-                    self._config.summary_dir
-                ) as summary_writer:
-                    self._summary_writer = summary_writer
-                    courses = await self._session.get_courses(False)
-                    Logger.i("Downloader", f"Found {len(courses)} courses in total")
-                    await asyncio.gather(*[self._proc_course(course) for course in courses])
-            else:
-                self._summary_writer = None
-                courses = await self._session.get_courses(False)
-                Logger.i("Downloader", f"Found {len(courses)} courses in total")
-                await asyncio.gather(*[self._proc_course(course) for course in courses])
+        if self._plan_only:
+            self._summary_writer = None
+            await self._proc_accounts()
+            accounts = {account_name for account_name, _ in self._plans}
+            for (account_name, _), (course_title, plan) in sorted(self._plans.items(), key=lambda item: (item[0][0], item[1][0])):
+                print(format_plan(f"{account_name}: {course_title}" if len(accounts) > 1 else course_title, plan))
+            return
+
+        if self._config.summary_enabled or self._config.history_enabled:
+            with SummaryManager(
+                self._config.summary_expire_days,
+                self._config.summary_dir,
+                summary_format=self._config.summary_format,
+                history_expire_days=self._config.history_expire_days,
+                summary_enabled=self._config.summary_enabled,
+                history_enabled=self._config.history_enabled
+            ) as summary_writer:
+                self._summary_writer = summary_writer
+                await self._proc_with_journal()
+        else:
+            self._summary_writer = None
+            await self._proc_with_journal()
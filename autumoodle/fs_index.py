@@ -0,0 +1,255 @@
+'''
+Author: Uyanide pywang0608@foxmail.com
+Date: 2026-10-19 01:44:05
+LastEditTime: 2026-10-19 02:23:28
+Description: In-memory index of the files in the destination directories, scanned in parallel
+'''
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass
+from pathlib import Path
+import os
+import re
+import threading
+
+from .log import Logger
+
+
+# Listing directories is mostly waiting for the file system, e.g. on network shares.
+# Shared by the scans of all courses, so that scanning them at the same time does not multiply the threads.
+SCAN_WORKERS = 16
+
+_scan_pool: ThreadPoolExecutor | None = None
+_scan_pool_lock = threading.Lock()
+
+# "_<digit>" as in the names given to renamed versions, "stem_N.suffix"
+_RENAMED_PATTERN = re.compile(r"_\d")
+
+
+@dataclass(frozen=True, slots=True)
+class FileState:
+    size: int
+    mtime: float
+
+
+class _Listing:
+    __slots__ = ("files", "subdirs", "_families")
+
+    files: dict[str, FileState]
+    subdirs: set[str]
+    # stem -> names of files that may be renamed versions of "stem.*", built on first use
+    _families: dict[str, list[str]] | None
+
+    def __init__(self):
+        self.files = {}
+        self.subdirs = set()
+        self._families = None
+
+    @staticmethod
+    def _stems(name: str) -> list[str]:
+        return [name[:match.start()] for match in _RENAMED_PATTERN.finditer(name)]
+
+    def add(self, name: str, state: FileState) -> None:
+        if name not in self.files and self._families is not None:
+            for stem in self._stems(name):
+                self._families.setdefault(stem, []).append(name)
+        self.files[name] = state
+
+    def family(self, stem: str) -> list[str]:
+        if self._families is None:
+            self._families = {}
+            for name in self.files:
+                for candidate in self._stems(name):
+                    self._families.setdefault(candidate, []).append(name)
+        return self._families.get(stem, [])
+
+
+def _get_scan_pool() -> ThreadPoolExecutor:
+    global _scan_pool
+    with _scan_pool_lock:
+        if _scan_pool is None:
+            _scan_pool = ThreadPoolExecutor(max_workers=SCAN_WORKERS, thread_name_prefix="fs_index")
+        return _scan_pool
+
+
+def shutdown_scan_pool() -> None:
+    '''Shut down the scanning threads, once no directory is being scanned anymore.'''
+    global _scan_pool
+    with _scan_pool_lock:
+        pool = _scan_pool
+        _scan_pool = None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _key(path: Path) -> Path:
+    return Path(os.path.abspath(path))
+
+
+def _list_directory(path: Path) -> _Listing | None:
+    '''Returns None if the directory does not exist.'''
+    listing = _Listing()
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        listing.subdirs.add(entry.name)
+                    else:
+                        stat = entry.stat()
+                        listing.files[entry.name] = FileState(stat.st_size, stat.st_mtime)
+                except OSError:
+                    # Removed while listing, or a dangling symlink
+                    continue
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    return listing
+
+
+class FSIndex:
+    '''
+    Directory listings of the destinations, path -> (size, mtime), so that deciding whether and where to store
+    a file does not need a round trip to the file system. Directories below the scanned roots are all
+    known after the scan, others are listed on first use. Writes are recorded as they happen.
+    '''
+    _listings: dict[Path, _Listing]
+    # directories known not to exist
+    _absent: set[Path]
+    # directories whose whole subtree is in _listings
+    _roots: list[Path]
+    _lock: threading.Lock
+
+    def __init__(self):
+        self._listings = {}
+        self._absent = set()
+        self._roots = []
+        self._lock = threading.Lock()
+
+    def _is_scanned(self, directory: Path) -> bool:
+        return any(directory.is_relative_to(root) for root in self._roots)
+
+    def scan(self, roots: list[Path], stop: threading.Event | None = None) -> None:
+        '''
+        List the given directories and all directories below them, using several threads. Once stop is set,
+        no more directories are listed and nothing is recorded, they are then listed on first use instead.
+        '''
+        pending_roots = []
+        with self._lock:
+            for root in map(_key, roots):
+                if not self._is_scanned(root) and root not in pending_roots:
+                    pending_roots.append(root)
+        if not pending_roots:
+            return
+
+        listings: dict[Path, _Listing | None] = {}
+        visited: set[str] = set()
+        executor = _get_scan_pool()
+        futures = {}
+        try:
+            for root in pending_roots:
+                visited.add(os.path.realpath(root))
+                futures[executor.submit(_list_directory, root)] = root
+            while futures:
+                # Checked at least once a second, even if listing a directory takes longer
+                done, _ = wait(futures, timeout=1, return_when=FIRST_COMPLETED)
+                if stop is not None and stop.is_set():
+                    Logger.d("FSIndex", f"Scan of {', '.join(map(str, pending_roots))} stopped")
+                    return
+                for future in done:
+                    directory = futures.pop(future)
+                    listing = future.result()
+                    listings[directory] = listing
+                    if listing is None:
+                        continue
+                    for name in listing.subdirs:
+                        subdir = directory / name
+                        # Symlinks may lead back up the tree
+                        real_path = os.path.realpath(subdir)
+                        if real_path in visited:
+                            continue
+                        visited.add(real_path)
+                        futures[executor.submit(_list_directory, subdir)] = subdir
+        finally:
+            for future in futures:
+                future.cancel()
+
+        with self._lock:
+            for directory, listing in listings.items():
+                # Directories listed or created meanwhile already have a listing with the latest writes in it
+                if directory in self._listings:
+                    continue
+                if listing is None:
+                    self._absent.add(directory)
+                else:
+                    self._absent.discard(directory)
+                    self._listings[directory] = listing
+            self._roots.extend(pending_roots)
+        Logger.d("FSIndex", f"Scanned {sum(1 for listing in listings.values() if listing)} directories "
+                 f"below {', '.join(map(str, pending_roots))}")
+
+    def _listing(self, directory: Path) -> _Listing | None:
+        # Called with the lock held
+        listing = self._listings.get(directory)
+        if listing is not None or directory in self._absent:
+            return listing
+        if self._is_scanned(directory):
+            # Not found by the scan, so it does not exist
+            self._absent.add(directory)
+            return None
+        listing = _list_directory(directory)
+        if listing is None:
+            self._absent.add(directory)
+        else:
+            self._listings[directory] = listing
+        return listing
+
+    def exists(self, path: Path) -> bool:
+        path = _key(path)
+        with self._lock:
+            listing = self._listing(path.parent)
+            return listing is not None and (path.name in listing.files or path.name in listing.subdirs)
+
+    def latest_mtime(self, path: Path) -> float:
+        '''Newest modification time of the file and its renamed versions "stem_N.suffix", 0 if there are none.'''
+        path = _key(path)
+        with self._lock:
+            listing = self._listing(path.parent)
+            if listing is None:
+                return 0
+            newest = listing.files[path.name].mtime if path.name in listing.files else 0
+            stem, suffix = path.stem, path.suffix
+            for name in listing.family(stem):
+                # Same as globbing "stem_[0-9]*suffix"
+                if name.endswith(suffix) and len(name) >= len(stem) + 2 + len(suffix):
+                    newest = max(newest, listing.files[name].mtime)
+            return newest
+
+    def make_dirs(self, directory: Path) -> None:
+        '''Create the directory and its parents unless already known to exist.'''
+        directory = _key(directory)
+        missing = []
+        with self._lock:
+            current = directory
+            while self._listing(current) is None and current.parent != current:
+                missing.append(current)
+                current = current.parent
+        if not missing:
+            return
+        directory.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            # Record the new directories from the top, each in the listing of its parent
+            for created in reversed(missing):
+                self._absent.discard(created)
+                self._listings.setdefault(created, _Listing())
+                parent = self._listings.get(created.parent)
+                if parent is not None:
+                    parent.subdirs.add(created.name)
+
+    def add(self, path: Path) -> None:
+        '''Record a file that has just been written.'''
+        path = _key(path)
+        stat = path.stat()
+        with self._lock:
+            listing = self._listing(path.parent)
+            if listing is not None:
+                listing.add(path.name, FileState(stat.st_size, stat.st_mtime))
@@ -0,0 +1,162 @@
+'''
+Author: Uyanide pywang0608@foxmail.com
+Date: 2026-10-19 01:10:55
+LastEditTime: 2026-10-19 02:22:49
+Description: Queryable SQLite database of synced files across runs
+'''
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable
+import sqlite3
+import time
+
+from .log import Logger
+
+
+HISTORY_FILENAME = "autumoodle_history.sqlite3"
+
+# Bump this and add a migration in _init_schema when the schema changes
+SCHEMA_VERSION = 2
+
+
+@dataclass(frozen=True, slots=True)
+class HistoryRecord:
+    synced_at: float
+    course_name: str
+    category_name: str
+    entry_name: str
+    file_name: str
+    stored_path: str
+    status: str
+    detail: str
+
+
+class HistoryStore:
+    '''Sync history of all runs in a single indexed SQLite database, expired by age.'''
+    _path: Path
+    _conn: sqlite3.Connection | None
+
+    def __init__(self, path: Path):
+        self._path = path
+        self._conn = None
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def open(self) -> None:
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        # Concurrent runs may write to the same database, wait for their transactions instead of failing.
+        # Records are added from the threads files are stored on, serialized by the summary writer.
+        self._conn = sqlite3.connect(self._path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._init_schema()
+
+    def close(self) -> None:
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
+    def __enter__(self) -> "HistoryStore":
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def _init_schema(self) -> None:
+        conn = self._conn
+        assert conn
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version > SCHEMA_VERSION:
+            raise RuntimeError(f"History database {self._path} was created by a newer version (schema {version})")
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS history (
+                    id INTEGER PRIMARY KEY,
+                    synced_at REAL NOT NULL,
+                    course_name TEXT NOT NULL,
+                    category_name TEXT NOT NULL,
+                    entry_name TEXT NOT NULL,
+                    file_name TEXT NOT NULL,
+                    stored_path TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    detail TEXT NOT NULL
+                )""")
+            if version < 2:
+                # Version 1 indexed the names case-sensitively, which case-insensitive prefix matching cannot use
+                conn.execute("DROP INDEX IF EXISTS idx_history_course")
+                conn.execute("DROP INDEX IF EXISTS idx_history_entry")
+                conn.execute("DROP INDEX IF EXISTS idx_history_path")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_history_synced_at ON history (synced_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_history_course ON history (course_name COLLATE NOCASE, synced_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_history_entry ON history (entry_name COLLATE NOCASE, synced_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_history_path ON history (stored_path COLLATE NOCASE, synced_at)")
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def add_records(self, records: Iterable[HistoryRecord]) -> None:
+        with self._conn:  # type: ignore
+            self._conn.executemany(  # type: ignore
+                "INSERT INTO history (synced_at, course_name, category_name, entry_name, file_name, stored_path, status, detail) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                ((r.synced_at, r.course_name, r.category_name, r.entry_name,
+                  r.file_name, r.stored_path, r.status, r.detail) for r in records)
+            )
+
+    def purge(self, expire_days: int) -> int:
+        '''Delete records older than expire_days, returns the number of deleted records.'''
+        threshold = time.time() - expire_days * 86400
+        with self._conn:  # type: ignore
+            cursor = self._conn.execute("DELETE FROM history WHERE synced_at < ?", (threshold,))  # type: ignore
+        if cursor.rowcount:
+            Logger.d("HistoryStore", f"Deleted {cursor.rowcount} history records older than {expire_days} days")
+        return cursor.rowcount
+
+    def query(self,
+              course: str | None = None,
+              entry: str | None = None,
+              path: str | None = None,
+              status: str | None = None,
+              since: float | None = None,
+              limit: int | None = None) -> list[HistoryRecord]:
+        '''
+        Query records, newest first. course, entry and path are matched as prefixes (case-insensitive for ASCII),
+        so that the indexes can be used, since is a unix timestamp.
+        '''
+        conditions = []
+        params: list = []
+        if course:
+            conditions.append("course_name LIKE ? ESCAPE '\\'")
+            params.append(_prefix_pattern(course))
+        if entry:
+            conditions.append("entry_name LIKE ? ESCAPE '\\'")
+            params.append(_prefix_pattern(entry))
+        if path:
+            conditions.append("stored_path LIKE ? ESCAPE '\\'")
+            params.append(_prefix_pattern(path))
+        if status:
+            conditions.append("status = ?")
+            params.append(status)
+        if since is not None:
+            conditions.append("synced_at >= ?")
+            params.append(since)
+        sql = "SELECT synced_at, course_name, category_name, entry_name, file_name, stored_path, status, detail FROM history"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY synced_at DESC, id DESC"
+        if limit is not None and limit > 0:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [HistoryRecord(*row) for row in self._conn.execute(sql, params)]  # type: ignore
+
+
+def _prefix_pattern(prefix: str) -> str:
+    # Wildcards in the prefix itself are matched literally
+    return prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def format_record(record: HistoryRecord) -> str:
+    synced_at = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record.synced_at))
+    detail = f" ({record.detail})" if record.detail else ""
+    return f"{synced_at} [{record.status}] {record.course_name}: {record.stored_path}{detail}"
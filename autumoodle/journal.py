@@ -0,0 +1,251 @@
+'''
+Author: Uyanide pywang0608@foxmail.com
+Date: 2026-10-19 01:41:26
+LastEditTime: 2026-10-19 02:28:44
+Description: Atomic file writes and a per-run journal to recover writes interrupted by a crash
+'''
+
+from pathlib import Path
+from typing import Callable, TextIO
+import json
+import os
+import secrets
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where whether a run is in progress is guessed from its pid instead
+    fcntl = None
+
+from .log import Logger
+
+
+JOURNAL_DIRNAME = "journal"
+# Temporary files are hidden and placed next to their destination, so that they can be moved into place atomically
+TEMP_SUFFIX = ".autumoodle-part"
+
+
+def temp_path_for(dest: Path) -> Path:
+    return dest.with_name(f".{dest.name}.{secrets.token_hex(4)}{TEMP_SUFFIX}")
+
+
+def move_into_place(temp_path: Path, dest: Path, no_clobber: bool = False) -> Path:
+    '''
+    Atomically move a completely written temporary file to dest, returns the path it ended up at.
+    With no_clobber, an existing file is never replaced, and the first free "stem_N.suffix" is taken instead.
+    '''
+    if not no_clobber:
+        os.replace(temp_path, dest)
+        return dest
+    final_path = dest
+    counter = 1
+    while True:
+        try:
+            # Fails if the name has been taken, even by a file created just now
+            os.link(temp_path, final_path)
+            os.unlink(temp_path)
+            return final_path
+        except FileExistsError:
+            pass
+        except OSError:
+            # Hard links are not supported by every file system, fall back to checking first
+            if not final_path.exists():
+                os.replace(temp_path, final_path)
+                return final_path
+        final_path = dest.with_name(f"{dest.stem}_{counter}{dest.suffix}")
+        counter += 1
+
+
+class Journal:
+    '''
+    Records the files of a run that are being written, as JSON lines of
+      {"op": "begin", "temp": ..., "dest": ..., "no_clobber": ...}  before the temporary file is written
+      {"op": "written", "temp": ...}                                once it is complete
+      {"op": "done", "temp": ...}                                   once it has been moved into place
+    The journal is removed when the run ends. If it is left behind, recover() finishes or discards
+    exactly the writes that were in flight.
+    While the run is in progress, the journal is exclusively locked, which also holds for other
+    processes sharing the directory that cannot see the pid of this one, e.g. in other containers.
+    '''
+    _path: Path
+    _file: TextIO | None
+    # writes may come from several threads
+    _lock: threading.Lock
+
+    def __init__(self, directory: Path):
+        self._path = directory / f"run_{os.getpid()}_{time.time_ns()}.jsonl"
+        self._file = None
+        self._lock = threading.Lock()
+
+    def open(self) -> None:
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        if not fcntl:
+            self._file = open(self._path, "a", encoding="utf-8")
+            return
+        # Locked under a name recover() does not look at, so that it never finds the journal unlocked
+        new_path = self._path.with_name(f".{self._path.name}")
+        self._file = open(new_path, "a", encoding="utf-8")
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        os.replace(new_path, self._path)
+
+    def close(self) -> None:
+        if self._file:
+            # Every write has either completed or been cleaned up by now, removed before unlocking
+            self._path.unlink(missing_ok=True)
+            self._file.close()
+            self._file = None
+
+    def __enter__(self) -> "Journal":
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _record(self, record: dict) -> None:
+        if not self._file:
+            return
+        with self._lock:
+            # Flushed right away so that it survives the process being killed
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    def begin(self, temp_path: Path, dest: Path, no_clobber: bool) -> None:
+        self._record({"op": "begin", "temp": str(temp_path), "dest": str(dest), "no_clobber": no_clobber})
+
+    def written(self, temp_path: Path) -> None:
+        self._record({"op": "written", "temp": str(temp_path)})
+
+    def done(self, temp_path: Path) -> None:
+        self._record({"op": "done", "temp": str(temp_path)})
+
+
+def write_atomically(dest: Path,
+                     write_func: Callable[[Path], None],
+                     timestamp: float | None = None,
+                     journal: Journal | None = None,
+                     no_clobber: bool = False) -> Path:
+    '''
+    Write a file via write_func to a temporary file next to dest and move it into place once complete,
+    so that dest is never seen partially written. Returns the path the file ended up at.
+    '''
+    temp_path = temp_path_for(dest)
+    if journal:
+        journal.begin(temp_path, dest, no_clobber)
+    try:
+        write_func(temp_path)
+        # Set before moving, so that a file with the remote timestamp is always complete
+        if timestamp is not None:
+            os.utime(temp_path, (timestamp, timestamp))
+        if journal:
+            journal.written(temp_path)
+        final_path = move_into_place(temp_path, dest, no_clobber)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    if journal:
+        journal.done(temp_path)
+    return final_path
+
+
+def _lock_if_ended(path: Path) -> TextIO | None:
+    '''Returns the journal locked exclusively if its run has ended, None if it is still in progress.'''
+    f = open(path, "r", encoding="utf-8")
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        return None
+    except BaseException:
+        f.close()
+        raise
+    if os.fstat(f.fileno()).st_ino != os.stat(path).st_ino:
+        # Recovered and removed by another process before the lock was acquired
+        f.close()
+        raise FileNotFoundError(path)
+    return f
+
+
+def _is_running(pid: int) -> bool:
+    # The pid of a previous run may be reused by this one, e.g. as pid 1 in a container
+    if pid == os.getpid():
+        return False
+    if os.name != "posix":
+        # Signals cannot be used to probe processes elsewhere, assume the run has ended
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _recover_journal(f: TextIO) -> tuple[int, int]:
+    '''Returns (number of writes rolled forward, number of writes rolled back)'''
+    writes: dict[str, dict] = {}
+    for line in f:
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            # The last line may have been cut off by the crash
+            continue
+        if record.get("op") == "begin":
+            writes[record["temp"]] = record
+        elif record.get("op") == "written" and record.get("temp") in writes:
+            writes[record["temp"]]["written"] = True
+        elif record.get("op") == "done":
+            writes.pop(record.get("temp"), None)
+
+    forward = back = 0
+    for temp, record in writes.items():
+        temp_path = Path(temp)
+        dest = Path(record["dest"])
+        if not temp_path.exists():
+            # Moved into place, but not recorded as done before the crash
+            continue
+        if record.get("written"):
+            final_path = move_into_place(temp_path, dest, record.get("no_clobber", False))
+            Logger.i("Journal", f"Completed interrupted write of {final_path}")
+            forward += 1
+        else:
+            temp_path.unlink(missing_ok=True)
+            Logger.i("Journal", f"Discarded incomplete write of {dest}")
+            back += 1
+    return forward, back
+
+
+def recover(directory: Path) -> None:
+    '''Finish or discard the writes left in flight by runs that did not end properly.'''
+    if not directory.is_dir():
+        return
+    for path in sorted(directory.glob("run_*.jsonl")):
+        try:
+            if fcntl:
+                f = _lock_if_ended(path)
+            else:
+                try:
+                    pid = int(path.stem.split("_")[1])
+                except (IndexError, ValueError):
+                    continue
+                f = None if _is_running(pid) else open(path, "r", encoding="utf-8")
+        except FileNotFoundError:
+            # Removed by its run or another recovery in the meantime
+            continue
+        except Exception as e:
+            Logger.e("Journal", f"Failed to open journal {path}: {e}")
+            continue
+        if f is None:
+            Logger.d("Journal", f"Skipping journal {path} of a run still in progress")
+            continue
+        try:
+            with f:
+                forward, back = _recover_journal(f)
+                Logger.i("Journal", f"Recovered journal {path}: {forward} writes completed, {back} discarded")
+                # Removed while still locked, so that no other recovery replays it
+                path.unlink(missing_ok=True)
+        except Exception as e:
+            Logger.e("Journal", f"Failed to recover journal {path}: {e}")
@@ -0,0 +1,226 @@
+'''
+Author: Uyanide pywang0608@foxmail.com
+Date: 2026-10-19 01:22:17
+LastEditTime: 2026-10-19 02:29:54
+Description: In-process metrics registry in the Prometheus text format
+'''
+
+from abc import ABC, abstractmethod
+from pathlib import Path
+import math
+import os
+import threading
+
+from .log import Logger
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(label_names: tuple[str, ...], label_values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric(ABC):
+    name: str
+    help: str
+    type: str
+    label_names: tuple[str, ...]
+
+    def __init__(self, name: str, help: str, label_names: list[str] | None = None):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names or [])
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"Metric {self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    @abstractmethod
+    def _samples(self) -> list[str]:
+        '''Sample lines of the metric, called with the lock held'''
+        pass
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class _SingleValueMetric(_Metric):
+    '''A metric with one value per set of labels'''
+    _values: dict[tuple[str, ...], float]
+
+    def __init__(self, name: str, help: str, label_names: list[str] | None = None):
+        super().__init__(name, help, label_names)
+        self._values = {}
+
+    def _add(self, amount: float, labels: dict[str, str]) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> list[str]:
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+                for key, value in self._values.items()]
+
+
+class Counter(_SingleValueMetric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        if amount < 0:
+            raise ValueError(f"Counter {self.name} can only be increased, got {amount}")
+        self._add(amount, labels)
+
+
+class Gauge(_SingleValueMetric):
+    type = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        self._add(amount, labels)
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self._add(-amount, labels)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+    _buckets: tuple[float, ...]
+    _counts: dict[tuple[str, ...], list[int]]
+    _sums: dict[tuple[str, ...], float]
+
+    def __init__(self, name: str, help: str, buckets: list[float], label_names: list[str] | None = None):
+        super().__init__(name, help, label_names)
+        self._buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._counts = {}
+        self._sums = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * len(self._buckets))
+            for i, bound in enumerate(self._buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._sums[key] = self._sums.get(key, 0) + value
+
+    def _samples(self) -> list[str]:
+        lines = []
+        for key, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self._buckets, counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(self._sums[key])}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    _metrics: list[_Metric]
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+    def write_textfile(self, path: Path) -> None:
+        '''Atomically write all metrics to a file, e.g. for the textfile collector of node_exporter.'''
+        import tempfile
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=path.parent)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(self.render())
+            os.replace(tmp_path, path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+        Logger.d("Metrics", f"Metrics written to {path}")
+
+
+REGISTRY = Registry()
+
+########
+# Metrics fed by the downloader, sessions and extraction
+
+FILES = REGISTRY.register(Counter(
+    "autumoodle_files_total", "Files written to the destination", ["course", "status"]))
+ARCHIVE_BYTES = REGISTRY.register(Counter(
+    "autumoodle_archive_bytes_total", "Bytes of downloaded archives", ["course"]))
+ARCHIVES = REGISTRY.register(Counter(
+    "autumoodle_archives_total", "Downloaded archives", ["course"]))
+LOGINS = REGISTRY.register(Counter(
+    "autumoodle_logins_total", "Logins performed, i.e. sessions that were missing or had expired", ["session_type"]))
+RETRIES = REGISTRY.register(Counter(
+    "autumoodle_retries_total", "Requests retried after a transient failure"))
+COURSE_FAILURES = REGISTRY.register(Counter(
+    "autumoodle_course_failures_total", "Courses that failed to sync", ["course"]))
+PARSE_DURATION = REGISTRY.register(Histogram(
+    "autumoodle_parse_duration_seconds", "Time spent parsing Moodle pages",
+    [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10], ["page"]))
+PARSE_CACHE = REGISTRY.register(Counter(
+    "autumoodle_parse_cache_total", "Lookups of parsed pages from earlier runs", ["result"]))
+COURSE_DURATION = REGISTRY.register(Histogram(
+    "autumoodle_course_duration_seconds", "Time spent syncing a course",
+    [1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600], ["course"]))
+COURSE_LAST_SYNC = REGISTRY.register(Gauge(
+    "autumoodle_course_last_success_timestamp_seconds", "Time of the last successful sync of a course", ["course"]))
+RUN_DURATION = REGISTRY.register(Gauge(
+    "autumoodle_run_duration_seconds", "Duration of the last run"))
+RUN_LAST = REGISTRY.register(Gauge(
+    "autumoodle_run_last_timestamp_seconds", "Time the last run finished"))
+
+
+async def serve(host: str, port: int):
+    '''Start an HTTP server exposing the metrics at /metrics, returns the asyncio server.'''
+    import asyncio
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=10)
+            # Skip the headers
+            while (await asyncio.wait_for(reader.readline(), timeout=10)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, content_type, body = "200 OK", "text/plain; version=0.0.4; charset=utf-8", REGISTRY.render().encode()
+            else:
+                status, content_type, body = "404 Not Found", "text/plain; charset=utf-8", b"Not Found\n"
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    Logger.i("Metrics", f"Serving metrics on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,115 @@
+'''
+Author: Uyanide pywang0608@foxmail.com
+Date: 2026-10-19 01:59:50
+LastEditTime: 2026-10-19 02:21:12
+Description: Cache of parse results across runs, keyed by the hash of the page without its volatile parts
+'''
+
+from pathlib import Path
+from typing import Any
+import hashlib
+import json
+import os
+import re
+import threading
+
+from .log import Logger
+from .journal import write_atomically
+
+
+PARSE_CACHE_DIRNAME = "parse_cache"
+
+# Parts of a page that change between requests without changing what is parsed from it:
+# the session key (in forms, URLs and M.cfg), and ids generated per request by YUI and Moodle
+_VOLATILE = re.compile(
+    r'(?P<key>sesskey|logintoken)(?P<sep>["\']?\s*[:=]\s*["\']?|["\']?\s+value=["\'])[^"\'&\s<>]*'
+    r'|yui_[0-9_]+'
+    r'|random[0-9a-f]{13}\d*'
+)
+
+
+def _replace_volatile(match: re.Match) -> str:
+    return f"{match['key']}{match['sep']}" if match['key'] else ""
+
+
+def page_key(page: str, version: str = "") -> str:
+    '''Hash of the page with its volatile parts removed, and of the version of the parser.'''
+    normalized = _VOLATILE.sub(_replace_volatile, page)
+    digest = hashlib.sha256(version.encode())
+    digest.update(normalized.encode("utf-8", errors="surrogatepass"))
+    return digest.hexdigest()
+
+
+class ParseCache:
+    '''
+    JSON-serializable parse results in one file per page, evicted least recently used first once the files
+    take more than max_size bytes in total. The modification time of a file is its last use.
+    '''
+    _directory: Path
+    _max_size: int
+    _version: str
+    # the size of the cache is only computed when an entry is added
+    _lock: threading.Lock
+
+    def __init__(self, directory: Path, max_size: int, version: str = ""):
+        self._directory = directory
+        self._max_size = max_size
+        self._version = version
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> Path:
+        return self._directory / f"{key}.json"
+
+    def get(self, page: str) -> tuple[str, Any | None]:
+        '''
+        Returns (key of the page, cached result or None). Results that do not belong to a single page can be
+        cached under a name instead, which then takes the place of the page.
+        '''
+        key = page_key(page, self._version)
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+            # Marks the entry as recently used
+            os.utime(path)
+            return key, value
+        except FileNotFoundError:
+            return key, None
+        except (OSError, ValueError) as e:
+            Logger.w("ParseCache", f"Ignoring unreadable cache entry {path}: {e}")
+            path.unlink(missing_ok=True)
+            return key, None
+
+    def put(self, key: str, value: Any) -> None:
+        try:
+            self._directory.mkdir(parents=True, exist_ok=True)
+            data = json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            write_atomically(self._path(key), lambda path: path.write_bytes(data))
+            self._evict()
+        except OSError as e:
+            # The result is only not cached, parsing goes on as usual
+            Logger.w("ParseCache", f"Failed to cache parse result: {e}")
+
+    def _evict(self) -> None:
+        with self._lock:
+            entries = []
+            total = 0
+            with os.scandir(self._directory) as it:
+                for entry in it:
+                    if not entry.name.endswith(".json"):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+            if total <= self._max_size:
+                return
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self._max_size:
+                    break
+                Path(path).unlink(missing_ok=True)
+                total -= size
+                Logger.d("ParseCache", f"Evicted {path}")
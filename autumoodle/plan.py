@@ -0,0 +1,123 @@
+'''
+Author: Uyanide pywang0608@foxmail.com
+Date: 2026-10-19 01:14:36
+LastEditTime: 2026-10-19 02:09:56
+Description: Sync plan computed without downloading anything
+'''
+
+from dataclasses import dataclass
+from pathlib import Path
+
+from .config_mgr import UpdateType
+from .session_intf import RemoteFile, clean_name
+from .zip_extract import FileRoute, is_up_to_date
+
+
+# Actions of a plan entry
+PLAN_NEW = "new"        # nothing found locally, will be added
+PLAN_UPDATE = "update"  # older locally, will be updated according to the update type
+PLAN_KEEP = "keep"      # up to date locally, or found locally and the update type is skip
+PLAN_CHECK = "check"    # found locally, but the remote modification time is only known once downloaded
+PLAN_IGNORE = "ignore"  # filtered out by the configuration, will not be requested or stored at all
+
+
+@dataclass(frozen=True, slots=True)
+class PlanEntry:
+    course_name: str
+    category_name: str
+    entry_name: str
+    # path of the file as in a download center archive, None if only the entry is known
+    file_name: str | None
+    destination: Path | None
+    update_type: UpdateType | None
+    action: str
+
+
+class LocalTree:
+    '''Caches directory listings, so that each destination directory is only listed once.'''
+    _listings: dict[Path, dict[str, Path]]
+
+    def __init__(self):
+        self._listings = {}
+
+    def find(self, directory: Path, entry_name: str) -> Path | None:
+        '''
+        Find the local counterpart of an entry whose files are not known. Entries are stored either
+        as a file named after the entry plus an extension, or as a directory named after the entry.
+        '''
+        listing = self._listings.get(directory)
+        if listing is None:
+            listing = {}
+            if directory.is_dir():
+                for path in directory.iterdir():
+                    listing.setdefault(path.name, path)
+                    listing.setdefault(path.stem, path)
+            self._listings[directory] = listing
+        return listing.get(entry_name)
+
+
+def entry_file_prefix(category_name: str, entry_name: str) -> str:
+    '''Path of an entry in a download center archive, without the extension of a single file.'''
+    return f"{clean_name(category_name)}/{clean_name(entry_name)}"
+
+
+def file_entry_prefixes(file_name: str) -> list[str]:
+    '''The possible results of entry_file_prefix for the entry a file belongs to.'''
+    parts = file_name.split("/")
+    if len(parts) > 2:
+        return [f"{parts[0]}/{parts[1]}"]
+    # A single file named after the entry, with or without an extension
+    return list(dict.fromkeys([file_name, file_name.rsplit(".", 1)[0]]))
+
+
+def evaluate_file(course_name: str, category_name: str, entry_name: str, file: RemoteFile, route: FileRoute | None) -> PlanEntry:
+    '''What storing the file would do, decided like zip_extract does once it is downloaded.'''
+    if route is None:
+        return PlanEntry(course_name, category_name, entry_name, file.name, None, None, PLAN_IGNORE)
+    if not route.destination_path.exists():
+        action = PLAN_NEW
+    elif is_up_to_date(route, file.time_modified) or route.update_type == UpdateType.SKIP:
+        action = PLAN_KEEP
+    else:
+        action = PLAN_UPDATE
+    return PlanEntry(course_name, category_name, entry_name, file.name, route.destination_path, route.update_type, action)
+
+
+def evaluate_entry(course_name: str,
+                   category_name: str,
+                   entry_name: str,
+                   route: FileRoute | None,
+                   local_tree: LocalTree) -> PlanEntry:
+    '''
+    What downloading an entry whose files are not known would do, with the route of the entry
+    as if it were a single file named after it.
+    '''
+    if route is None:
+        return PlanEntry(course_name, category_name, entry_name, None, None, None, PLAN_IGNORE)
+    local = local_tree.find(route.destination_path.parent, route.destination_path.name)
+    if local is None:
+        action = PLAN_NEW
+    elif route.update_type == UpdateType.SKIP and local.is_file():
+        # Directories may still receive new files
+        action = PLAN_KEEP
+    else:
+        action = PLAN_CHECK
+    return PlanEntry(course_name, category_name, entry_name, None, local or route.destination_path, route.update_type, action)
+
+
+def format_plan(title: str, entries: list[PlanEntry]) -> str:
+    counts: dict[str, int] = {}
+    for entry in entries:
+        counts[entry.action] = counts.get(entry.action, 0) + 1
+    counts_str = ", ".join(f"{count} {action}" for action, count in counts.items())
+    lines = [f"Course '{title}': {len(entries)} entries" + (f" ({counts_str})" if counts_str else "")]
+    for entry in entries:
+        line = f"  [{entry.action}] {entry.category_name} / {entry.entry_name}"
+        if entry.file_name is not None:
+            line += f" : {entry.file_name}"
+        if entry.destination is not None:
+            line += f" -> {entry.destination}"
+        if entry.update_type is not None:
+            line += f" ({entry.update_type.value})"
+        lines.append(line)
+    return "\n".join(lines)
@@ -0,0 +1,229 @@
+'''
+Author: Uyanide pywang0608@foxmail.com
+Date: 2026-10-19 01:20:53
+LastEditTime: 2026-10-19 01:20:53
+Description: Progress events of archive downloads, with a live terminal display and a JSON lines stream
+'''
+
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import TextIO
+import asyncio
+import json
+import shutil
+import sys
+import time
+
+from .log import Logger
+
+
+# Weight of the latest sample in the smoothed rate
+RATE_SMOOTHING = 0.3
+
+
+@dataclass(frozen=True, slots=True)
+class ProgressEvent:
+    event: str  # "start", "progress", "done" or "failed"
+    time: float
+    course: str
+    archive: str
+    downloaded: int  # in bytes
+    total: int | None  # in bytes, None if unknown
+    rate: float  # in bytes/s
+    eta: float | None  # in seconds, None if unknown
+
+
+def format_size(size: float) -> str:
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if size < 1024 or unit == "GiB":
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size:.0f} B"
+        size /= 1024
+    return ""  # unreachable
+
+
+class ArchiveProgress:
+    '''Progress of a single archive download, updated by the session.'''
+    _tracker: "ProgressTracker"
+    course: str
+    archive: str
+    total: int | None
+    downloaded: int
+    rate: float
+    _sample_time: float
+    _sample_downloaded: int
+
+    def __init__(self, tracker: "ProgressTracker", course: str, archive: str):
+        self._tracker = tracker
+        self.course = course
+        self.archive = archive
+        self.total = None
+        self.downloaded = 0
+        self.rate = 0.0
+        self._sample_time = time.monotonic()
+        self._sample_downloaded = 0
+
+    @property
+    def stall_timeout(self) -> float:
+        '''Seconds without receiving any data after which the download should be aborted, 0 to disable.'''
+        return self._tracker.stall_timeout
+
+    def set_total(self, total: int | None) -> None:
+        self.total = total if total else None
+
+    def update(self, size: int) -> None:
+        self.downloaded += size
+
+    def _sample(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._sample_time
+        if elapsed <= 0:
+            return
+        rate = (self.downloaded - self._sample_downloaded) / elapsed
+        self.rate = rate if self._sample_downloaded == 0 else RATE_SMOOTHING * rate + (1 - RATE_SMOOTHING) * self.rate
+        self._sample_time = now
+        self._sample_downloaded = self.downloaded
+
+    @property
+    def eta(self) -> float | None:
+        if self.total is None or self.rate <= 0:
+            return None
+        return max(0.0, (self.total - self.downloaded) / self.rate)
+
+    def event(self, name: str) -> ProgressEvent:
+        return ProgressEvent(
+            event=name,
+            time=time.time(),
+            course=self.course,
+            archive=self.archive,
+            downloaded=self.downloaded,
+            total=self.total,
+            rate=self.rate,
+            eta=self.eta,
+        )
+
+
+class ProgressTracker:
+    '''
+    Collects the progress of all running archive downloads, shows an aggregated live line on the
+    terminal and/or writes progress events as JSON lines.
+    '''
+    _display: bool
+    _jsonl_path: str | None
+    _interval: float
+    _stall_timeout: float
+    _active: dict[int, ArchiveProgress]
+    _jsonl_file: TextIO | None
+
+    def __init__(self, display: str = "none", jsonl_path: str | None = None, interval: float = 2, stall_timeout: float = 0):
+        self._display = display == "terminal" or (display == "auto" and sys.stderr.isatty())
+        self._jsonl_path = jsonl_path
+        self._interval = interval
+        self._stall_timeout = stall_timeout
+        self._active = {}
+        self._jsonl_file = None
+
+    @property
+    def stall_timeout(self) -> float:
+        return self._stall_timeout
+
+    @property
+    def enabled(self) -> bool:
+        return self._display or self._jsonl_path is not None
+
+    def _emit(self, event: ProgressEvent) -> None:
+        if self._jsonl_file:
+            self._jsonl_file.write(json.dumps(asdict(event), ensure_ascii=False) + "\n")
+            self._jsonl_file.flush()
+
+    def course(self, course: str) -> "CourseProgress":
+        return CourseProgress(self, course)
+
+    @contextmanager
+    def archive(self, course: str, archive: str):
+        '''Track the download of an archive, yielding the object to be updated by the session.'''
+        progress = ArchiveProgress(self, course, archive)
+        self._active[id(progress)] = progress
+        self._emit(progress.event("start"))
+        try:
+            yield progress
+        except BaseException:
+            progress._sample()
+            self._emit(progress.event("failed"))
+            raise
+        else:
+            progress._sample()
+            self._emit(progress.event("done"))
+        finally:
+            del self._active[id(progress)]
+
+    def _render(self) -> str:
+        active = list(self._active.values())
+        total_rate = sum(progress.rate for progress in active)
+        parts = [f"{len(active)} downloads", f"{format_size(total_rate)}/s"]
+        for progress in active:
+            part = f"{progress.course} ({progress.archive}): {format_size(progress.downloaded)}"
+            if progress.total:
+                part += f" / {format_size(progress.total)}"
+            if progress.eta is not None:
+                part += f", ETA {int(progress.eta // 60)}:{int(progress.eta % 60):02d}"
+            parts.append(part)
+        return " | ".join(parts)
+
+    def _tick(self) -> None:
+        for progress in self._active.values():
+            progress._sample()
+            self._emit(progress.event("progress"))
+        if self._display:
+            line = self._render() if self._active else ""
+            # Cut to terminal width, otherwise the line wraps and can not be overwritten
+            width = shutil.get_terminal_size().columns
+            sys.stderr.write("\r\033[K" + line[:width - 1])
+            sys.stderr.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self._interval)
+            self._tick()
+
+    @asynccontextmanager
+    async def running(self):
+        '''Report the progress periodically while in this context.'''
+        if not self.enabled:
+            yield self
+            return
+        if self._jsonl_path == "-":
+            self._jsonl_file = sys.stdout
+        elif self._jsonl_path is not None:
+            path = Path(self._jsonl_path).expanduser()
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._jsonl_file = path.open("a", encoding="utf-8")
+        task = asyncio.create_task(self._run())
+        try:
+            yield self
+        finally:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            if self._display:
+                sys.stderr.write("\r\033[K")
+                sys.stderr.flush()
+            if self._jsonl_file and self._jsonl_file is not sys.stdout:
+                self._jsonl_file.close()
+            self._jsonl_file = None
+            Logger.d("ProgressTracker", "Progress reporting stopped")
+
+
+class CourseProgress:
+    '''Progress of the archives of a single course, passed to the session.'''
+    _tracker: ProgressTracker
+    _course: str
+
+    def __init__(self, tracker: ProgressTracker, course: str):
+        self._tracker = tracker
+        self._course = course
+
+    def archive(self, archive: str):
+        return self._tracker.archive(self._course, archive)
@@ -1,12 +1,15 @@
 '''
 Author: Uyanide pywang0608@foxmail.com
 Date: 2025-10-29 09:57:27
-LastEditTime: 2025-11-06 23:30:58
+LastEditTime: 2026-10-19 02:12:11
 Description: Helpers for "requests" session implementation
 '''
 
 from bs4 import BeautifulSoup
 from urllib.parse import urlencode, urlparse, urljoin
+import httpx
+
+from .retry import RetryableError
 
 GENERAL_HEADERS = {
     "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/141.0.0.0 Safari/537.36",
@@ -18,6 +21,17 @@ FORM_HEADERS = {
 }
 
 
+def check_complete(response: httpx.Response, received: int, expected: int, what: str) -> None:
+    '''
+    Raise a RetryableError if fewer bytes than expected were received. With a content encoding, Content-Length
+    is the size of the encoded body, so the raw bytes received are compared with it instead.
+    '''
+    if response.headers.get("Content-Encoding", "identity").lower() not in ("", "identity"):
+        received, expected = response.num_bytes_downloaded, int(response.headers.get("Content-Length", "0"))
+    if expected and received != expected:
+        raise RetryableError(f"{what} truncated, got {received} of {expected} bytes")
+
+
 def join_relative_url(url: str, relative: str) -> str:
     # Case already absolute URL
     if relative.startswith("http://") or relative.startswith("https://"):
@@ -0,0 +1,110 @@
+'''
+Author: Uyanide pywang0608@foxmail.com
+Date: 2026-10-19 01:18:01
+LastEditTime: 2026-10-19 02:28:10
+Description: Retry policies with exponential backoff and a host-level circuit breaker
+'''
+
+from dataclasses import dataclass
+from typing import Awaitable, Callable, TypeVar
+import asyncio
+import random
+import time
+
+from . import metrics
+from .log import Logger
+
+
+T = TypeVar("T")
+
+
+class RetryableError(Exception):
+    '''Transient failures worth trying again, e.g. 5xx responses, timeouts and truncated archives.'''
+    pass
+
+
+class CircuitBreaker:
+    '''
+    Shared by all sessions talking to the same host. After threshold consecutive transient
+    failures, all requests are paused for cooldown seconds instead of failing one after another.
+    '''
+    _threshold: int
+    _cooldown: float
+    _failures: int
+    _open_until: float
+
+    def __init__(self, threshold: int, cooldown: float):
+        self._threshold = threshold
+        self._cooldown = cooldown
+        self._failures = 0
+        self._open_until = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self._threshold > 0
+
+    async def wait(self) -> None:
+        '''Wait until the circuit is closed again.'''
+        while (delay := self._open_until - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+
+    def record_success(self) -> None:
+        self._failures = 0
+
+    def record_failure(self) -> None:
+        if not self.enabled:
+            return
+        self._failures += 1
+        if self._failures >= self._threshold and time.monotonic() >= self._open_until:
+            self._open_until = time.monotonic() + self._cooldown
+            Logger.w("CircuitBreaker",
+                     f"{self._failures} consecutive failures, pausing all requests for {self._cooldown:.0f} seconds")
+            # After the cooldown a single further failure opens the circuit again
+            self._failures = self._threshold - 1
+
+
+@dataclass(frozen=True, slots=True)
+class RetryPolicy:
+    attempts: int = 3         # total number of attempts, 1 for no retries
+    base_delay: float = 2.0   # in seconds, doubled after each failed attempt
+    max_delay: float = 60.0   # in seconds
+
+    def delay(self, retry: int) -> float:
+        '''Backoff before the given retry (0-based), with full jitter to spread concurrent retries.'''
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry))
+
+    @classmethod
+    def from_dict(cls, data: dict, default: "RetryPolicy") -> "RetryPolicy":
+        policy = cls(
+            attempts=data.get("attempts", default.attempts),
+            base_delay=data.get("base_delay", default.base_delay),
+            max_delay=data.get("max_delay", default.max_delay),
+        )
+        if policy.attempts < 1:
+            raise ValueError("retry attempts must be at least 1")
+        if policy.base_delay < 0 or policy.max_delay < 0:
+            raise ValueError("retry delays must not be negative")
+        return policy
+
+    async def run(self, func: Callable[[], Awaitable[T]], name: str, breaker: CircuitBreaker | None = None) -> T:
+        '''Call func until it succeeds, retrying only on RetryableError.'''
+        retry = 0
+        while True:
+            if breaker:
+                await breaker.wait()
+            try:
+                result = await func()
+            except RetryableError as e:
+                if breaker:
+                    breaker.record_failure()
+                if retry + 1 >= self.attempts:
+                    raise
+                delay = self.delay(retry)
+                retry += 1
+                metrics.RETRIES.inc()
+                Logger.w("Retry", f"{name} failed: {e}, retrying in {delay:.1f}s ({retry}/{self.attempts - 1})")
+                await asyncio.sleep(delay)
+                continue
+            if breaker:
+                breaker.record_success()
+            return result
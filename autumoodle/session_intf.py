@@ -1,16 +1,23 @@
 '''
 Author: Uyanide pywang0608@foxmail.com
 Date: 2025-10-29 17:26:36
-LastEditTime: 2025-11-04 23:35:00
+LastEditTime: 2026-10-19 02:26:07
 Description: Interfaces for Moodle session implementations and data classes
 '''
 
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from pathlib import Path
-from typing import Callable
+from typing import Awaitable, Callable
+from zipfile import ZipFile, BadZipFile
+import asyncio
 
-from .utils import passthrough
+from .log import Logger
+from . import metrics
+from .retry import RetryPolicy, RetryableError, CircuitBreaker
+from .progress import ArchiveProgress, CourseProgress
+from .course_selector import CourseSelector
+from .utils import passthrough, create_temp_file
 
 
 # describes a downloadable resource in the download center
@@ -41,15 +48,233 @@ class CourseInfo(ABC):
     start_year: int
 
 
+# describes a single file that can be downloaded without going through the download center
+@dataclass(frozen=True, slots=True)
+class RemoteFile:
+    """A single file of a resource, named as it would be in a download center archive"""
+    name: str             # e.g. "Category/Entry.pdf", or "Category/Entry/sub/file.pdf" for folders
+    url: str
+    size: int             # in bytes
+    time_modified: float  # unix timestamp
+
+
+# describes how the selected resources of a course are split into archives
+@dataclass(frozen=True, slots=True)
+class BatchOptions:
+    """Options for downloading the resources of a course in multiple archives"""
+    size: int = 0         # max number of entries per archive, 0 for a single archive
+    concurrency: int = 1  # max number of archives of a course downloaded at the same time
+
+
 class TUMMoodleSession(ABC):
     """Interface for a Moodle session"""
 
     @abstractmethod
-    async def get_courses(self, show_hidden: bool) -> list[CourseInfo]:
-        """Get the list of courses"""
+    async def get_courses(self, show_hidden: bool, selector: CourseSelector | None = None) -> list[CourseInfo]:
+        """Get the list of courses, only those accepted by the selector if given"""
+        pass
+
+    @abstractmethod
+    async def get_categories(self, course_id: str, filter: Callable[[list], list] = passthrough) -> list[CategoryInfo]:
+        """Get the categories of a course after applying the filter, without downloading anything"""
+        pass
+
+    @abstractmethod
+    async def download_archives(self,
+                                course_id: str,
+                                on_archive: Callable[[Path], Awaitable[None]],
+                                filter: Callable[[list], list] = passthrough,
+                                batch_options: BatchOptions = BatchOptions(),
+                                progress: CourseProgress | None = None) -> None:
+        """Download the resources of a course in one or more archives, passing each archive to on_archive once it is downloaded"""
         pass
 
+
+class TUMMoodleFileSession(TUMMoodleSession):
+    """Interface for a Moodle session that can download single files instead of archives"""
+
+    def prefers_files(self) -> bool:
+        """Whether download_files is to be used instead of download_archives"""
+        return True
+
     @abstractmethod
-    async def download_archive(self, course_id: str, save_path: Path, filter: Callable[[list], list] = passthrough) -> None:
-        """Download the archive of a course"""
+    async def download_files(self,
+                             course_id: str,
+                             want: Callable[[RemoteFile], bool],
+                             on_file: Callable[[RemoteFile, Path], Awaitable[None]],
+                             filter: Callable[[list], list] = passthrough,
+                             progress: CourseProgress | None = None,
+                             on_archive: Callable[[Path], Awaitable[None]] | None = None) -> None:
+        """
+        Download the files of the resources of a course that are accepted by want, passing each
+        downloaded file to on_file. The file is deleted after on_file returns, unless moved away.
+        Resources that cannot be downloaded as single files are downloaded in an archive passed to
+        on_archive if given, and skipped otherwise.
+        """
         pass
+
+
+def clean_name(name: str) -> str:
+    """Clean a title for use as a path component of a RemoteFile name, like the download center does"""
+    return name.replace("/", "_").replace("\\", "_").strip()
+
+
+def split_batches(categories: list[CategoryInfo], size: int) -> list[list[CategoryInfo]]:
+    """Split the entries of the categories into batches of at most size entries, keeping their order"""
+    if size <= 0:
+        return [categories] if any(category.entries for category in categories) else []
+    batches: list[list[CategoryInfo]] = []
+    current: list[CategoryInfo] = []
+    count = 0
+    for category in categories:
+        start = 0
+        while start < len(category.entries):
+            entries = category.entries[start:start + size - count]
+            current.append(replace(category, entries=entries))
+            start += len(entries)
+            count += len(entries)
+            if count >= size:
+                batches.append(current)
+                current = []
+                count = 0
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _check_archive(zip_path: Path) -> None:
+    if not zip_path.exists():
+        raise RetryableError("Downloaded archive file does not exist")
+    if zip_path.stat().st_size == 0:
+        raise RetryableError("Downloaded archive is empty")
+    try:
+        # Reads the central directory at the end of the file, which is missing if truncated
+        with ZipFile(zip_path):
+            pass
+    except BadZipFile as e:
+        raise RetryableError(f"Downloaded archive is corrupted: {e}") from e
+
+
+def _split_batch(batch: list[CategoryInfo]) -> list[list[CategoryInfo]]:
+    '''Split a batch in halves, or keep it as it is if it has a single entry.'''
+    count = sum(len(category.entries) for category in batch)
+    return split_batches(batch, (count + 1) // 2) if count > 1 else [batch]
+
+
+async def download_batches(batches: list[list[CategoryInfo]],
+                           download_func: Callable[[list[CategoryInfo], Path, ArchiveProgress | None], Awaitable[None]],
+                           on_archive: Callable[[Path], Awaitable[None]],
+                           concurrency: int,
+                           retry_policy: RetryPolicy,
+                           breaker: CircuitBreaker | None = None,
+                           progress: CourseProgress | None = None) -> None:
+    """
+    Download each batch into a temporary archive with download_func and pass it to on_archive.
+    A failed batch is retried according to retry_policy split in halves, so that the entries of a half
+    that succeeds are not downloaded again when the other half fails once more. Other batches are not affected.
+    """
+    slots = asyncio.Semaphore(max(1, concurrency))
+
+    async def attempt(name: str, batch: list[CategoryInfo]) -> Path:
+        temp_zip_path = create_temp_file(".zip")
+        try:
+            Logger.d("TUMMoodleSession", f"Downloading {name} ({sum(len(c.entries) for c in batch)} entries)...")
+            if progress:
+                with progress.archive(name) as archive_progress:
+                    await download_func(batch, temp_zip_path, archive_progress)
+            else:
+                await download_func(batch, temp_zip_path, None)
+            _check_archive(temp_zip_path)
+        except BaseException:
+            temp_zip_path.unlink(missing_ok=True)
+            raise
+        return temp_zip_path
+
+    async def proc_batch(name: str, batch: list[CategoryInfo], retry: int = 0):
+        async with slots:
+            if breaker:
+                await breaker.wait()
+            try:
+                temp_zip_path = await attempt(name, batch)
+            except RetryableError as e:
+                if breaker:
+                    breaker.record_failure()
+                if retry + 1 >= retry_policy.attempts:
+                    raise RuntimeError(f"Failed to download {name}: {e}") from e
+                error = e
+            except Exception as e:
+                raise RuntimeError(f"Failed to download {name}: {e}") from e
+            else:
+                if breaker:
+                    breaker.record_success()
+                error = None
+        if error is not None:
+            parts = _split_batch(batch)
+            delay = retry_policy.delay(retry)
+            metrics.RETRIES.inc()
+            Logger.w("Retry", f"Downloading {name} failed: {error}, retrying in {delay:.1f}s "
+                     f"as {len(parts)} archive(s) ({retry + 1}/{retry_policy.attempts - 1})")
+            await asyncio.sleep(delay)
+            names = [f"{name}.{i + 1}" for i in range(len(parts))] if len(parts) > 1 else [name]
+            results = await asyncio.gather(*[proc_batch(part_name, part, retry + 1) for part_name, part in zip(names, parts)],
+                                           return_exceptions=True)
+            errors = [result for result in results if isinstance(result, BaseException)]
+            if errors:
+                raise RuntimeError("; ".join(str(e) for e in errors))
+            return
+        try:
+            await on_archive(temp_zip_path)
+        finally:
+            temp_zip_path.unlink(missing_ok=True)
+
+    results = await asyncio.gather(*[proc_batch(f"archive {i + 1}/{len(batches)}", batch) for i, batch in enumerate(batches)],
+                                   return_exceptions=True)
+    errors = [result for result in results if isinstance(result, BaseException)]
+    for error in errors:
+        Logger.e("TUMMoodleSession", str(error))
+    if errors:
+        raise RuntimeError(f"{len(errors)} of {len(batches)} archives failed")
+
+
+async def download_single_files(files: list[RemoteFile],
+                                download_func: Callable[[RemoteFile, Path, ArchiveProgress | None], Awaitable[None]],
+                                on_file: Callable[[RemoteFile, Path], Awaitable[None]],
+                                concurrency: int,
+                                retry_policy: RetryPolicy,
+                                breaker: CircuitBreaker | None = None,
+                                progress: CourseProgress | None = None) -> None:
+    """
+    Download each file into a temporary file with download_func and pass it to on_file.
+    The temporary file is kept between attempts, so that download_func may resume what it already contains.
+    """
+    slots = asyncio.Semaphore(max(1, concurrency))
+
+    async def proc_file(file: RemoteFile):
+        async def attempt():
+            if progress:
+                with progress.archive(file.name) as archive_progress:
+                    await download_func(file, temp_path, archive_progress)
+            else:
+                await download_func(file, temp_path, None)
+
+        async with slots:
+            temp_path = create_temp_file()
+            try:
+                try:
+                    await retry_policy.run(attempt, f"Downloading {file.name}", breaker)
+                except Exception as e:
+                    raise RuntimeError(f"Failed to download {file.name}: {e}") from e
+            except BaseException:
+                temp_path.unlink(missing_ok=True)
+                raise
+        try:
+            await on_file(file, temp_path)
+        finally:
+            temp_path.unlink(missing_ok=True)
+
+    results = await asyncio.gather(*[proc_file(file) for file in files], return_exceptions=True)
+    errors = [result for result in results if isinstance(result, BaseException)]
+    for error in errors:
+        Logger.e("TUMMoodleSession", str(error))
+    if errors:
+        raise RuntimeError(f"{len(errors)} of {len(files)} files failed")
@@ -1,33 +1,76 @@
 '''
 Author: Uyanide pywang0608@foxmail.com
 Date: 2025-10-30 12:40:53
-LastEditTime: 2025-10-31 13:55:41
+LastEditTime: 2026-10-19 01:59:50
 Description: Factory for Moodle session implementations
 '''
 
 from contextlib import asynccontextmanager
 
-from .config_mgr import Config
+from .config_mgr import Config, AccountConfig
+from .retry import CircuitBreaker
+from .throttle import Throttle
 
 
 @asynccontextmanager
-async def TUMMoodleSessionBuilder(config: Config):
+async def TUMMoodleSessionBackend(config: Config):
+    '''Resources shared by the sessions of all accounts, e.g. the browser for playwright sessions'''
+    if config.session_type == "playwright":
+        from .session_playwright import launch_browser
+        async with launch_browser(config.playwright_browser, config.playwright_headless) as browser:
+            yield browser
+    else:
+        yield None
+
+
+@asynccontextmanager
+async def TUMMoodleSessionBuilder(config: Config, account: AccountConfig, backend=None, breaker: CircuitBreaker | None = None,
+                                  throttle: Throttle | None = None):
     if config.session_type == "requests":
-        from .session_requests import TUMMoodleSession as SessionRequests
+        from .session_requests import TUMMoodleSession as SessionRequests, DOWNLOAD_CENTER_PARSER_VERSION
+        from .parse_cache import ParseCache, PARSE_CACHE_DIRNAME
         async with SessionRequests(
-            config.username,
-            config.password,
-            config.session_save_path if config.session_save else None
+            account.username,
+            account.password,
+            account.session_save_path if config.session_save else None,
+            page_retry=config.retry_pages,
+            download_retry=config.retry_downloads,
+            breaker=breaker,
+            throttle=throttle,
+            direct_downloads=config.download_mode == "files",
+            file_concurrency=config.download_file_concurrency,
+            parse_cache=ParseCache(config.cache_dir / PARSE_CACHE_DIRNAME, config.parse_cache_max_size * 1024,
+                                   DOWNLOAD_CENTER_PARSER_VERSION) if config.parse_cache_enabled else None,
         ) as session:
             yield session
     elif config.session_type == "playwright":
         from .session_playwright import TUMMoodleSession as SessionPlaywright
         async with SessionPlaywright(
-            config.username,
-            config.password,
+            account.username,
+            account.password,
             config.playwright_headless,
             config.playwright_browser,
-            config.session_save_path if config.session_save else None
+            account.session_save_path if config.session_save else None,
+            backend,
+            page_retry=config.retry_pages,
+            download_retry=config.retry_downloads,
+            breaker=breaker,
+            throttle=throttle,
+        ) as session:
+            yield session
+    elif config.session_type == "webservice":
+        from .session_webservice import TUMMoodleSession as SessionWebservice
+        async with SessionWebservice(
+            account.username,
+            account.password,
+            config.webservice_url,
+            account.webservice_token,
+            account.session_save_path if config.session_save else None,
+            concurrency=config.webservice_concurrency,
+            page_retry=config.retry_pages,
+            download_retry=config.retry_downloads,
+            breaker=breaker,
+            throttle=throttle,
         ) as session:
             yield session
     else:
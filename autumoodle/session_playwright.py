@@ -1,17 +1,27 @@
 '''
 Author: Uyanide pywang0608@foxmail.com
 Date: 2025-10-26 21:59:22
-LastEditTime: 2025-11-06 23:40:54
+LastEditTime: 2026-10-19 02:28:55
 Description: Playwright-based Moodle session implementation
 '''
 
-from typing import Callable
-from playwright.async_api import async_playwright, Playwright, Browser, Page, BrowserContext, Locator, Download
+from typing import Awaitable, Callable
+from contextlib import asynccontextmanager
+import asyncio
+import time
+from playwright.async_api import async_playwright, Playwright, Browser, Page, BrowserContext, Locator, Download, CDPSession
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
 from dataclasses import dataclass
 from pathlib import Path
 
 from .log import Logger
 from . import utils
+from .session_store import SessionStore
+from .retry import RetryPolicy, RetryableError, CircuitBreaker
+from .throttle import Throttle
+from .progress import ArchiveProgress, CourseProgress
+from . import metrics
+from .course_selector import CourseSelector
 from . import session_intf as intf
 
 # autopep8: off
@@ -37,6 +47,20 @@ def COURSES_PAGE_URL(show_hidden): return f"{MOODLE_URL()}/my/?coc-manage={'1' i
 TIMEOUT = 30  # in seconds
 
 
+@asynccontextmanager
+async def launch_browser(browser_name: str, headless: bool):
+    '''Launch a browser that can be shared by multiple sessions, each with its own context.'''
+    Logger.d("TUMMoodleSession", "Launching the browser...")
+    async with async_playwright() as playwright:
+        browser = await playwright[browser_name].launch(headless=headless)
+        Logger.d("TUMMoodleSession", "Browser has been launched")
+        try:
+            yield browser
+        finally:
+            await browser.close()
+            Logger.d("TUMMoodleSession", "Browser has been closed")
+
+
 @dataclass(frozen=True, slots=True)
 class EntryInfo(intf.EntryInfo):
     id: str
@@ -61,70 +85,200 @@ class CourseInfo(intf.CourseInfo):
     start_year: int = 0
 
 
+async def parse_courses(page: Page, selector: CourseSelector | None = None) -> list[CourseInfo]:
+    '''Parse the courses listed on an opened "Meine Startseite" page.'''
+    # Read all links in a single round trip instead of several per course
+    links = await page.locator('div.coursebox h3 a').evaluate_all('''links => links.map(link => ({
+        title: link.getAttribute("title"),
+        href: link.getAttribute("href"),
+        metainfo: link.querySelector("span.coc-metainfo")?.innerText ?? ""
+    }))''')
+    courses = []
+    for link in links:
+        title = link["title"]
+        if not title:
+            Logger.d("TUMMoodleSession", f"Skipping course with missing title")
+            continue
+        title = title.strip()
+        metainfo_text = link["metainfo"].strip()
+        is_ws, start_year = utils.parse_semester(metainfo_text.split(
+            " | ")[0].removeprefix("(")) if metainfo_text else (False, 0)
+        # Skip non-matching courses before doing anything else with them
+        if selector and not selector.select(title, is_ws, start_year):
+            continue
+        href = link["href"]
+        if not href or href.find("id=") == -1:
+            Logger.d("TUMMoodleSession", f"Skipping invalid course link: {href}")
+            continue
+        id = href.split("id=")[-1].split("&")[0]  # get the numeric id
+        course = CourseInfo(
+            id=id,
+            title=title,
+            metainfo=metainfo_text,
+            is_ws=is_ws,
+            start_year=start_year
+        )
+        Logger.d("TUMMoodleSession", f"Found course: {course}")
+        courses.append(course)
+    return courses
+
+
+async def _parse_download_form_entry(entry: Locator) -> EntryInfo | None:
+    '''Parse a single download form entry (div.form-check) and return ResourceInfo.'''
+    entry_input = entry.locator('input')
+    if not entry_input:
+        return None
+    entry_id = await entry_input.get_attribute("name")
+    if not entry_id:
+        return None
+    entry_id = entry_id.split("_")[-1]  # only keep the numeric ID part
+    entry_title = (await entry.locator('span.itemtitle').locator('span').inner_text()).strip()
+    if not entry_title:
+        return None
+    if await entry_input.is_checked():
+        await entry_input.uncheck()
+    return EntryInfo(
+        id=entry_id,
+        title=entry_title,
+        _input=entry_input,
+        _div=entry
+    )
+
+
+async def _parse_categorie(card: Locator) -> list[EntryInfo]:
+    '''Parse a download category card and return list of ResourceInfo.'''
+    # Get the section title
+    title = (await card.locator('span.sectiontitle').inner_text()).strip()
+    Logger.d("TUMMoodleSession", f"Processing card '{title}'...")
+
+    entries = []
+    items = card.locator('div.form-check')
+    count = await items.count()
+    # The first div should be the section title
+    if count <= 1:
+        Logger.d("TUMMoodleSession", f"No resources found in card '{title}'")
+        return entries
+    for j in range(1, count):
+        item = items.nth(j)
+        item_idx = j
+        entry = await _parse_download_form_entry(item)
+        if entry:
+            Logger.d("TUMMoodleSession", f"Found resource: {entry.title} (ID: {entry.id})")
+            entries.append(entry)
+        else:
+            Logger.d("TUMMoodleSession", f"Failed to parse resource item at index {item_idx} in card '{title}'")
+    return entries
+
+
+async def parse_download_center(page: Page) -> list[CategoryInfo]:
+    '''Parse all categories on an opened download center page.'''
+    # Click on "keine" first
+    await page.locator('a[id="downloadcenter-none-included"]').click()
+    # Find all download cards
+    download_cards = page.locator('div.card', has=page.locator('span.sectiontitle'))
+    count = await download_cards.count()
+    Logger.d("TUMMoodleSession", f"Found {count} cards")
+    categories: list[CategoryInfo] = []
+    for i in range(count):
+        card = download_cards.nth(i)
+        card_title = (await (card.locator('span.sectiontitle').inner_text())).strip()
+        entries = await _parse_categorie(card)
+        if entries:
+            Logger.d("TUMMoodleSession", f"Adding {len(entries)} resources under '{card_title}'")
+            categories.append(CategoryInfo(
+                title=card_title,
+                entries=entries  # pyright: ignore[reportArgumentType]
+            ))
+        else:
+            Logger.d("TUMMoodleSession", f"Failed to parse resources in card '{card_title}'")
+
+    Logger.d("TUMMoodleSession", f"Total categories parsed: {len(categories)}.")
+    return categories
+
+
 class TUMMoodleSession(intf.TUMMoodleSession):
     _username: str
     _password: str
     _headless: bool
     _browser_name: str
-    _storage_state_path: Path | None
+    _store: SessionStore | None
     _show_hidden_courses: bool
+    # serializes logins of concurrently opened pages
+    _login_lock: asyncio.Lock
+    _login_count: int
+    # retry policies for pages and archives, and the breaker shared with all other sessions
+    _page_retry: RetryPolicy
+    _download_retry: RetryPolicy
+    _breaker: CircuitBreaker | None
+    _throttle: Throttle | None
+    _bandwidth_warned: bool
 
     # Playwright objects
-    _async_playwright: Playwright
+    _async_playwright: Playwright | None  # None if using a shared browser
     _browser: Browser
     _context: BrowserContext
+    _shared_browser: Browser | None
 
-    def __init__(self, username, password, headless=True, browser="firefox", storage_state_path: Path | None = None):
+    def __init__(self, username, password, headless=True, browser="firefox", storage_state_path: Path | None = None,
+                 shared_browser: Browser | None = None, page_retry: RetryPolicy = RetryPolicy(),
+                 download_retry: RetryPolicy = RetryPolicy(), breaker: CircuitBreaker | None = None,
+                 throttle: Throttle | None = None):
         '''Initialize TUMMoodleSession with credentials without starting the browser.'''
         self._username = username
+        self._page_retry = page_retry
+        self._download_retry = download_retry
+        self._breaker = breaker
+        self._throttle = throttle
+        self._bandwidth_warned = False
         self._password = password
         self._headless = headless
         self._browser_name = browser
-        self._storage_state_path = storage_state_path
+        self._store = SessionStore(storage_state_path) if storage_state_path else None
+        self._login_lock = asyncio.Lock()
+        self._login_count = 0
+        self._shared_browser = shared_browser
+        self._async_playwright = None
 
     async def __aenter__(self):
-        '''Start the Playwright browser and create a new page.'''
-        Logger.d("TUMMoodleSession", "Launching the browser...")
-        self._async_playwright = await async_playwright().start()
-        self._browser = await self._async_playwright[self._browser_name].launch(headless=self._headless)
+        '''Start the Playwright browser (if not shared) and create a new browser context.'''
+        if self._shared_browser:
+            self._browser = self._shared_browser
+        else:
+            Logger.d("TUMMoodleSession", "Launching the browser...")
+            self._async_playwright = await async_playwright().start()
+            self._browser = await self._async_playwright[self._browser_name].launch(headless=self._headless)
 
-        if self._storage_state_path and self._storage_state_path.exists():
-            Logger.d("TUMMoodleSession", f"Using saved session from {self._storage_state_path}")
+        storage_state = self._store.load() if self._store else None
+        if storage_state:
+            Logger.d("TUMMoodleSession", f"Using saved session from {self._store.path}")  # type: ignore
             try:
-                self._context = await self._browser.new_context(storage_state=str(self._storage_state_path))
+                self._context = await self._browser.new_context(storage_state=storage_state)  # type: ignore
             except Exception as e:
                 Logger.w("TUMMoodleSession", f"Failed to load storage state: {e}, starting with a fresh context")
                 self._context = await self._browser.new_context()
         else:
             self._context = await self._browser.new_context()
 
-        Logger.d("TUMMoodleSession", "Browser has been launched")
-        try:
-            Logger.d("TUMMoodleSession", "Attempting the first login...")
-            page = await self._create_page(COURSES_PAGE_URL(False))
-            await page.close()
-            Logger.d("TUMMoodleSession", "Initial login attempt finished")
-        except Exception as e:
-            Logger.e("TUMMoodleSession", f"Failed to open Moodle main page: {e}")
+        # Login status is checked lazily when the first page is opened
+        Logger.d("TUMMoodleSession", "Browser context has been created")
         return self
 
     async def __aexit__(self, exc_type, exc_value, traceback):
         Logger.d("TUMMoodleSession", "Saving session state...")
         await self._save_storage_state()
-        Logger.d("TUMMoodleSession", "Closing the browser...")
         await self._context.close()
-        await self._browser.close()
-        await self._async_playwright.stop()
-        Logger.d("TUMMoodleSession", "Browser has been closed")
+        if self._async_playwright:
+            Logger.d("TUMMoodleSession", "Closing the browser...")
+            await self._browser.close()
+            await self._async_playwright.stop()
+            Logger.d("TUMMoodleSession", "Browser has been closed")
 
     async def _save_storage_state(self):
         '''Save current browser context storage (cookies/localStorage) to file.'''
-        if not self._storage_state_path:
+        if not self._store:
             return
         try:
-            self._storage_state_path.parent.mkdir(parents=True, exist_ok=True)
-            await self._context.storage_state(path=str(self._storage_state_path))
-            Logger.d("TUMMoodleSession", f"Session state saved to {self._storage_state_path}")
+            self._store.save(await self._context.storage_state())  # type: ignore
         except Exception as e:
             Logger.w("TUMMoodleSession", f"Failed to save session state: {e}")
 
@@ -134,13 +288,41 @@ class TUMMoodleSession(intf.TUMMoodleSession):
         await self._goto(page, url)
         return page
 
+    async def _navigate(self, page: Page, url: str):
+        if self._throttle:
+            await self._throttle.requests.acquire()
+        try:
+            response = await page.goto(url, timeout=TIMEOUT * 1000)
+        except PlaywrightTimeoutError as e:
+            raise RetryableError(f"Timeout: {e}") from e
+        if response and response.status >= 500:
+            raise RetryableError(f"Server error, status code: {response.status}")
+
+    async def _goto_once(self, page: Page, url: str):
+        login_count = self._login_count
+        await self._navigate(page, url)
+        if self._is_login_page(page.url):
+            async with self._login_lock:
+                # Another page may have already logged in while waiting for the lock
+                if self._login_count == login_count and not await self._check_login(page):
+                    raise RuntimeError(f"Failed to log in on page: {page.url}")
+            # Replay the original navigation with the refreshed session
+            await self._navigate(page, url)
+            if self._is_login_page(page.url):
+                raise RuntimeError(f"Still redirected to login page after login: {page.url}")
+        if not page.url.startswith(url):
+            Logger.w("TUMMoodleSession", f"Redirected to unexpected URL: {page.url}")
+
     async def _goto(self, page: Page, url: str):
-        '''Navigate to the specified URL and ensure login status.'''
+        '''Navigate to the specified URL, logging in and navigating again if redirected to a login page.'''
         if page.url != url:
-            await page.goto(url, timeout=TIMEOUT * 1000)
-            await self._check_login(page)
-            if not page.url.startswith(url):
-                Logger.w("TUMMoodleSession", f"Redirected to unexpected URL: {page.url}")
+            await self._page_retry.run(lambda: self._goto_once(page, url), f"Navigating to {url}", self._breaker)
+
+    @staticmethod
+    def _is_login_page(url: str) -> bool:
+        return (url.startswith(TUM_LOGIN_URL())
+                or url.startswith(MOODLE_LOGIN_URL())
+                or url.removesuffix("/") == MOODLE_URL())
 
     async def _check_login(self, page: Page) -> bool:
         '''Check if current page is one of the known login pages, and perform login if needed.'''
@@ -157,7 +339,7 @@ class TUMMoodleSession(intf.TUMMoodleSession):
             except Exception as e:
                 Logger.e("TUMMoodleSession", f"Failed to login via Moodle: {e}")
                 return False
-        elif page.url.removesuffix("/") == MOODLE_URL:
+        elif page.url.removesuffix("/") == MOODLE_URL():
             try:
                 Logger.d("TUMMoodleSession", "Moodle main login page detected, attempting login...")
                 await page.locator('a:has-text("With TUM ID")').click()
@@ -184,6 +366,8 @@ class TUMMoodleSession(intf.TUMMoodleSession):
             Logger.d("TUMMoodleSession", "Submitted login form, waiting for redirect...")
             await page.wait_for_url(utils.check_prefix(MOODLE_URL()), timeout=TIMEOUT * 1000)
             Logger.d("TUMMoodleSession", "Successfully logged in.")
+            self._login_count += 1
+            metrics.LOGINS.inc(session_type="playwright")
             Logger.d("TUMMoodleSession", "Saving session state after login...")
             await self._save_storage_state()
             return True
@@ -191,39 +375,15 @@ class TUMMoodleSession(intf.TUMMoodleSession):
             Logger.e("TUMMoodleSession", f"Login failed: {e}")
             return False
 
-    async def get_courses(self, show_hidden: bool) -> list[intf.CourseInfo]:
+    async def get_courses(self, show_hidden: bool, selector: CourseSelector | None = None) -> list[intf.CourseInfo]:
         '''Retrieve the list of courses from the Moodle "Meine Startseite" page.'''
         home_page = None
         try:
             Logger.d("TUMMoodleSession", "Retrieving courses from Meine Startseite...")
             home_page = await self._create_page(COURSES_PAGE_URL(show_hidden))
-            links = home_page.locator('div.coursebox h3 a')
-            courses = []
-            count = await links.count()
-            for i in range(count):
-                link = links.nth(i)
-                title = await link.get_attribute("title")
-                if not title:
-                    Logger.d("TUMMoodleSession", f"Skipping course with missing title")
-                    continue
-                href = await link.get_attribute("href")
-                if not href or href.find("id=") == -1:
-                    Logger.d("TUMMoodleSession", f"Skipping invalid course link: {href}")
-                    continue
-                id = href.split("id=")[-1].split("&")[0]  # get the numeric id
-                metainfo = link.locator('span.coc-metainfo')
-                metainfo_text = (await metainfo.inner_text()).strip() if metainfo else ""
-                is_ws, start_year = utils.parse_semester(metainfo_text.split(
-                    " | ")[0].removeprefix("(")) if metainfo_text else (False, 0)
-                course = CourseInfo(
-                    id=id,
-                    title=title.strip(),
-                    metainfo=metainfo_text,
-                    is_ws=is_ws,
-                    start_year=start_year
-                )
-                Logger.d("TUMMoodleSession", f"Found course: {course}")
-                courses.append(course)
+            parse_start = time.perf_counter()
+            courses = await parse_courses(home_page, selector)
+            metrics.PARSE_DURATION.observe(time.perf_counter() - parse_start, page="courses")
             Logger.d("TUMMoodleSession", f"Total courses retrieved: {len(courses)}")
             return courses
         except Exception as e:
@@ -233,50 +393,30 @@ class TUMMoodleSession(intf.TUMMoodleSession):
             if home_page:
                 await home_page.close()
 
-    async def _parse_download_form_entry(self, entry) -> EntryInfo | None:
-        '''Parse a single download form entry (div.form-check) and return ResourceInfo.'''
-        entry_input = entry.locator('input')
-        if not entry_input:
-            return None
-        entry_id = await entry_input.get_attribute("name")
-        if not entry_id:
+    async def _limit_bandwidth(self, page: Page) -> CDPSession | None:
+        '''
+        Apply the current bandwidth limit to the page. The browser downloads by itself, so the limit
+        can only be split evenly between running downloads, and only chromium supports it (via CDP).
+        The limit holds until the returned session is detached.
+        '''
+        assert self._throttle
+        bandwidth = self._throttle.current_bandwidth()
+        if bandwidth <= 0:
             return None
-        entry_id = entry_id.split("_")[-1]  # only keep the numeric ID part
-        entry_title = (await entry.locator('span.itemtitle').locator('span').inner_text()).strip()
-        if not entry_title:
+        if self._browser_name != "chromium":
+            if not self._bandwidth_warned:
+                Logger.w("TUMMoodleSession", f"Bandwidth limit is only supported with chromium, not {self._browser_name}")
+                self._bandwidth_warned = True
             return None
-        if await entry_input.is_checked():
-            await entry_input.uncheck()
-        return EntryInfo(
-            id=entry_id,
-            title=entry_title,
-            _input=entry_input,
-            _div=entry
-        )
-
-    async def _parse_categorie(self, card) -> list[EntryInfo]:
-        '''Parse a download category card and return list of ResourceInfo.'''
-        # Get the section title
-        title = (await card.locator('span.sectiontitle').inner_text()).strip()
-        Logger.d("TUMMoodleSession", f"Processing card '{title}'...")
-
-        entries = []
-        items = card.locator('div.form-check')
-        count = await items.count()
-        # The first div should be the section title
-        if count <= 1:
-            Logger.d("TUMMoodleSession", f"No resources found in card '{title}'")
-            return entries
-        for j in range(1, count):
-            item = items.nth(j)
-            item_idx = j
-            entry = await self._parse_download_form_entry(item)
-            if entry:
-                Logger.d("TUMMoodleSession", f"Found resource: {entry.title} (ID: {entry.id})")
-                entries.append(entry)
-            else:
-                Logger.d("TUMMoodleSession", f"Failed to parse resource item at index {item_idx} in card '{title}'")
-        return entries
+        cdp = await self._context.new_cdp_session(page)
+        await cdp.send("Network.emulateNetworkConditions", {
+            "offline": False,
+            "latency": 0,
+            # in bytes/s
+            "downloadThroughput": bandwidth * 1024 / max(1, self._throttle.active_downloads),
+            "uploadThroughput": -1,
+        })
+        return cdp
 
     async def _perform_download(self, categories: list[CategoryInfo], page: Page) -> Download | None:
         '''Perform the download of selected resources and save to the specified path.'''
@@ -294,45 +434,86 @@ class TUMMoodleSession(intf.TUMMoodleSession):
             Logger.d("TUMMoodleSession", f"Download initiated, waiting for completion...")
             return await download_info.value
 
-    async def download_archive(self, course_id: str, save_path: Path, filter: Callable[[list], list] = utils.passthrough) -> None:
-        '''Download the archive for the specified course ID, applying the filter function to resources.'''
+    async def _save_download(self, categories: list[CategoryInfo], page: Page, save_path: Path) -> None:
+        download = await self._perform_download(categories, page)
+        if not download:
+            raise RuntimeError("No entries selected for download")
+        Logger.d("TUMMoodleSession", f"Downloaded archive will be saved to: {save_path}")
+        await download.save_as(str(save_path))
+
+    async def _parse_download_center(self, page: Page) -> list[CategoryInfo]:
+        parse_start = time.perf_counter()
+        categories = await parse_download_center(page)
+        metrics.PARSE_DURATION.observe(time.perf_counter() - parse_start, page="download_center")
+        return categories
+
+    async def get_categories(self, course_id: str, filter: Callable[[list], list] = utils.passthrough) -> list[intf.CategoryInfo]:
+        '''Retrieve the categories for the specified course ID, applying the filter function to resources.'''
+        page = None
+        try:
+            Logger.d("TUMMoodleSession", f"Retrieving categories for course {course_id}...")
+            page = await self._create_page(DOWNLOAD_CENTER_URL(course_id))
+            return filter(await self._parse_download_center(page))
+        except Exception as e:
+            Logger.e("TUMMoodleSession", f"Failed to retrieve categories for course {course_id}: {e}")
+            raise
+        finally:
+            if page:
+                await page.close()
+
+    async def download_archives(self,
+                                course_id: str,
+                                on_archive: Callable[[Path], Awaitable[None]],
+                                filter: Callable[[list], list] = utils.passthrough,
+                                batch_options: intf.BatchOptions = intf.BatchOptions(),
+                                progress: CourseProgress | None = None) -> None:
+        '''
+        Download the archives for the specified course ID, applying the filter function to resources.
+        All batches are submitted from the same page one after another, since the selection is per page.
+        '''
         page = None
         try:
             Logger.d("TUMMoodleSession", f"Downloading archives for course {course_id}...")
             download_url = DOWNLOAD_CENTER_URL(course_id)
             page = await self._create_page(download_url)
-            await self._check_login(page)
-
-            # Click on "keine" first
-            await page.locator('a[id="downloadcenter-none-included"]').click()
-            # Find all download cards
-            download_cards = page.locator('div.card', has=page.locator('span.sectiontitle'))
-            count = await download_cards.count()
-            Logger.d("TUMMoodleSession", f"Found {count} cards")
-            categories: list[CategoryInfo] = []
-            for i in range(count):
-                card = download_cards.nth(i)
-                card_title = (await (card.locator('span.sectiontitle').inner_text())).strip()
-                entries = await self._parse_categorie(card)
-                if entries:
-                    Logger.d("TUMMoodleSession", f"Adding {len(entries)} resources under '{card_title}'")
-                    categories.append(CategoryInfo(
-                        title=card_title,
-                        entries=entries  # pyright: ignore[reportArgumentType]
-                    ))
-                else:
-                    Logger.d("TUMMoodleSession", f"Failed to parse resources in card '{card_title}'")
-
-            Logger.d("TUMMoodleSession", f"Total categories parsed: {len(categories)}.")
+            categories = await self._parse_download_center(page)
             filtered_categories = filter(categories)
             Logger.d("TUMMoodleSession",
                      f"Total entries after filtering: {sum(len(cat.entries) for cat in filtered_categories)}.")
-            download = await self._perform_download(filtered_categories, page)
-            if download:
-                Logger.d("TUMMoodleSession", f"Downloaded archive will be saved to: {save_path}")
-                await download.save_as(str(save_path))
-            else:
+            batches = intf.split_batches(filtered_categories, batch_options.size)
+            if not batches:
                 Logger.w("TUMMoodleSession", f"No archive was downloaded for course {course_id}")
+                return
+
+            selected: list[Locator] = []
+
+            async def download_func(batch: list[CategoryInfo], save_path: Path, archive_progress: ArchiveProgress | None):
+                # Deselect the entries of the previous batch first
+                for input_elem in selected:
+                    await input_elem.uncheck()
+                selected.clear()
+                selected.extend(item._input for category in batch for item in category.entries)  # type: ignore
+                try:
+                    if self._throttle:
+                        await self._throttle.requests.acquire()
+                        # Counted as active until saved, the download only starts in _perform_download
+                        with self._throttle.download():
+                            cdp = await self._limit_bandwidth(page)  # type: ignore
+                            try:
+                                await self._save_download(batch, page, save_path)  # type: ignore
+                            finally:
+                                if cdp:
+                                    await cdp.detach()
+                    else:
+                        await self._save_download(batch, page, save_path)  # type: ignore
+                    # The browser does not report the progress of downloads, only the final size is known
+                    if archive_progress and save_path.exists():
+                        archive_progress.update(save_path.stat().st_size)
+                except PlaywrightTimeoutError as e:
+                    raise RetryableError(f"Timeout: {e}") from e
+
+            await intf.download_batches(batches, download_func, on_archive,  # type: ignore
+                                        1, self._download_retry, self._breaker, progress)
 
         except Exception as e:
             Logger.e("TUMMoodleSession", f"Failed to download archive for course {course_id}: {e}")
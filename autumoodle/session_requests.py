@@ -1,37 +1,60 @@
 '''
 Author: Uyanide pywang0608@foxmail.com
 Date: 2025-10-29 21:13:55
-LastEditTime: 2025-11-06 23:42:07
+LastEditTime: 2026-10-19 02:21:12
 Description: httpx(requests)-based Moodle session implementation
 '''
 
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
+from email.utils import formatdate, parsedate_to_datetime
 from pathlib import Path
+from urllib.parse import unquote, urlsplit
 import httpx
-import pickle
 from bs4 import BeautifulSoup, Tag
-from typing import Callable
+from typing import Awaitable, Callable
+import asyncio
+import re
+import time
 
 from .log import Logger
 from . import utils
 from . import request_helper
-from .auth import auth
+from .session_store import SessionStore, cookie_to_dict, dict_to_cookie
+from .retry import RetryPolicy, RetryableError, CircuitBreaker
+from .throttle import Throttle
+from .aio_writer import AsyncFileWriter
+from .progress import ArchiveProgress, CourseProgress
+from . import metrics
+from .course_selector import CourseSelector
+from .parse_cache import ParseCache
 from . import session_intf as intf
 
 # autopep8: off
 def MOODLE_URL(): return "https://www.moodle.tum.de"
+# pages that unauthenticated requests get redirected to
+def MOODLE_LOGIN_URL(): return f"{MOODLE_URL()}/login/index.php"
+def TUM_LOGIN_URL(): return "https://login.tum.de"
 # the param "courseid" should be appended along with the actual course id from COURSES_PAGE_URL
 def DOWNLOAD_CENTER_URL(course_id): return f"{MOODLE_URL()}/local/downloadcenter/index.php?courseid={course_id}"
+# redirect=1 skips the resource page and redirects to the file itself, whatever the display setting of the resource
+def RESOURCE_URL(entry_id): return f"{MOODLE_URL()}/mod/resource/view.php?id={entry_id}&redirect=1"
+def FOLDER_URL(entry_id): return f"{MOODLE_URL()}/mod/folder/view.php?id={entry_id}"
+def COURSE_URL(course_id): return f"{MOODLE_URL()}/course/view.php?id={course_id}"
 # coc-manage=1 enables "Ausgeblendete Kurse verwalten" that shows all courses
 def COURSES_PAGE_URL(show_hidden): return f"{MOODLE_URL()}/my/{'?coc-manage=1' if show_hidden else ''}"
+# opened by the Moodle app after SSO login, redirects to moodlemobile://token=... with a web service token
+def MOBILE_LAUNCH_URL(service, passport): return f"{MOODLE_URL()}/admin/tool/mobile/launch.php?service={service}&passport={passport}&urlscheme=moodlemobile"
 # autopep8: on
 
+# small enough for the bandwidth limiter to interleave concurrent downloads smoothly
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
 
 @dataclass(frozen=True, slots=True)
 class EntryInfo(intf.EntryInfo):
     id: str
     title: str
-    _input_name: str
+    _input_name: str  # e.g. "item_resource_123"
 
 
 @dataclass(slots=True)
@@ -41,6 +64,12 @@ class CategoryInfo(intf.CategoryInfo):
     _input_name: str
 
 
+@dataclass(frozen=True, slots=True)
+class DownloadForm:
+    action: str
+    payload: dict[str, str]  # fields to be submitted along with the selected entries
+
+
 @dataclass(frozen=True, slots=True)
 class CourseInfo(intf.CourseInfo):
     id: str
@@ -50,28 +79,332 @@ class CourseInfo(intf.CourseInfo):
     start_year: int
 
 
-class TUMMoodleSession(intf.TUMMoodleSession):
+def parse_courses(html: str, selector: CourseSelector | None = None) -> list[CourseInfo]:
+    '''Parse the courses listed on the "Meine Startseite" page.'''
+    soup = BeautifulSoup(html, 'html.parser')
+    links = soup.select('div.coursebox h3 a')
+    courses = []
+    for link in links:
+        title = link.get('title')
+        if not isinstance(title, str):
+            Logger.d("TUMMoodleSession", f"Skipping course with missing title")
+            continue
+        title = title.strip()
+        metainfo_tag = link.find('span', class_='coc-metainfo')
+        metainfo_text = metainfo_tag.get_text(strip=True) if metainfo_tag else ""
+        is_ws, start_year = utils.parse_semester(metainfo_text.split(
+            " | ")[0].removeprefix("(")) if metainfo_text else (False, 0)
+        # Skip non-matching courses before doing anything else with them
+        if selector and not selector.select(title, is_ws, start_year):
+            continue
+        href = link.get('href')
+        if not isinstance(href, str) or href.find("id=") == -1:
+            Logger.d("TUMMoodleSession", f"Skipping invalid course link: {href}")
+            continue
+        id = href.split("id=")[-1].split("&")[0]  # get the numeric id
+        course = CourseInfo(
+            id=id,
+            title=title,
+            metainfo=metainfo_text,
+            is_ws=is_ws,
+            start_year=start_year
+        )
+        Logger.d("TUMMoodleSession", f"Found course: {course}")
+        courses.append(course)
+    return courses
+
+
+def _parse_entry(entry: Tag) -> EntryInfo | None:
+    entry_input = entry.select_one('input')
+    if not entry_input:
+        return None
+    entry_input_name = entry_input.get('name')
+    if not isinstance(entry_input_name, str):
+        return None
+    entry_id = entry_input_name.split("_")[-1]
+    entry_label = entry.select_one('span.itemtitle')
+    if not entry_label:
+        return None
+    entry_label_span = entry_label.select_one('span')
+    if not entry_label_span:
+        return None
+    entry_title = entry_label_span.get_text(strip=True)
+    if not entry_title:
+        return None
+    return EntryInfo(
+        id=entry_id,
+        title=entry_title,
+        _input_name=entry_input_name
+    )
+
+
+def _parse_category(card: Tag) -> CategoryInfo | None:
+    title_tags = card.select('span.sectiontitle')
+    if not title_tags:
+        Logger.d("TUMMoodleSession", "No title tag found in resource card")
+        return None
+    title = title_tags[0].get_text(strip=True)
+    Logger.d("TUMMoodleSession", f"Processing card '{title}'...")
+
+    entries = []
+    items = card.select('div.form-check')
+    if len(items) <= 1:
+        Logger.d("TUMMoodleSession", f"No resources found in card '{title}'")
+        return None
+    category_input = items[0].select_one('input')
+    if not category_input:
+        Logger.d("TUMMoodleSession", f"No category input found in card '{title}'")
+        return None
+    category_input_name = category_input.get('name')
+    if not isinstance(category_input_name, str):
+        Logger.d("TUMMoodleSession", f"Invalid category input name in card '{title}'")
+        return None
+    for item in items[1:]:  # skip the first one (select all)
+        entry = _parse_entry(item)
+        if entry:
+            Logger.d("TUMMoodleSession", f"Found resource: {entry.title} (ID: {entry.id})")
+            entries.append(entry)
+
+    if not entries:
+        Logger.d("TUMMoodleSession", f"No valid resources parsed in card '{title}'")
+        return None
+
+    return CategoryInfo(
+        title=title,
+        entries=entries,
+        _input_name=category_input_name
+    )
+
+
+def _parse_download_form(soup: BeautifulSoup) -> DownloadForm:
+    form = soup.find('form')
+    if not form:  # should not happen
+        raise RuntimeError("No form found on download center page")
+
+    action = form.get('action')
+    if not action:  # should not happen
+        raise RuntimeError("No action found on download form")
+    action = str(action)
+
+    inputs = form.select('input')
+    payload = {
+        "courseid": "",
+        "sesskey": ""
+    }
+    for input_tag in inputs:
+        name = input_tag.get('name')
+        if not isinstance(name, str):
+            continue
+        if name in payload:
+            value = input_tag.get('value', '')
+            if not isinstance(value, str):
+                value = ''
+            payload[name] = value
+    payload.update({
+        "_qf__local_downloadcenter_download_form": "1",
+        "mform_isexpanded_id_downloadoptions": "1",
+        "submitbutton": "ZIP-Archiv erstellen"
+    })
+    return DownloadForm(action=action, payload=payload)
+
+
+def parse_download_center(html: str) -> tuple[DownloadForm, list[CategoryInfo]]:
+    '''Parse the categories and the form to submit on a download center page.'''
+    soup = BeautifulSoup(html, 'html.parser')
+    try:
+        form = _parse_download_form(soup)
+        download_cards = soup.select('div.card:has(span.sectiontitle)')
+        Logger.d("TUMMoodleSession", f"Found {len(download_cards)} cards")
+        categories: list[CategoryInfo] = []
+        for card in download_cards:
+            category = _parse_category(card)
+            if category:
+                categories.append(category)
+    finally:
+        # Parsed values are plain strings, so the tree, which is much larger than the page itself,
+        # can be released right away instead of being held while the archives are downloaded
+        soup.decompose()
+    return form, categories
+
+
+# Part of the key of cached download center pages, to be bumped whenever parsing them changes
+DOWNLOAD_CENTER_PARSER_VERSION = "download_center/1"
+
+_SESSKEY = re.compile(r'name="sesskey"[^>]*?\svalue="([^"]*)"|"sesskey":"([^"]*)"')
+
+
+def _dump_download_center(form: DownloadForm, categories: list[CategoryInfo]) -> dict:
+    return {
+        "action": form.action,
+        # The session key is taken from the page each time the entry is used
+        "payload": {**form.payload, "sesskey": ""},
+        "categories": [{
+            "title": category.title,
+            "input_name": category._input_name,
+            "entries": [[entry.id, entry.title, entry._input_name] for entry in category.entries],
+        } for category in categories],
+    }
+
+
+def _load_download_center(html: str, cached: dict) -> tuple[DownloadForm, list[CategoryInfo]] | None:
+    '''Parse results of a page from the cached ones of the same page under another session key.'''
+    match = _SESSKEY.search(html)
+    if not match:
+        return None
+    form = DownloadForm(action=cached["action"], payload={**cached["payload"], "sesskey": match[1] or match[2]})
+    categories = [CategoryInfo(
+        title=category["title"],
+        entries=[EntryInfo(id=id, title=title, _input_name=input_name) for id, title, input_name in category["entries"]],
+        _input_name=category["input_name"],
+    ) for category in cached["categories"]]
+    return form, categories
+
+
+def _entry_kind(entry: EntryInfo) -> str:
+    # "resource", "folder", "url", "page", ... as in the input name
+    parts = entry._input_name.split("_")
+    return parts[1] if len(parts) >= 3 else ""
+
+
+def _folder_file_path(url: str) -> str | None:
+    # .../pluginfile.php/<context>/mod_folder/content/<revision>/<path>/<file>
+    _, found, rest = unquote(urlsplit(url).path).partition("/mod_folder/content/")
+    if not found:
+        return None
+    _, _, file_path = rest.partition("/")
+    return f"/{file_path}" if file_path else None
+
+
+def parse_folder(html: str) -> list[tuple[str, str]]:
+    '''Parse the files listed on the page of a folder, returns [(path inside the folder, url)].'''
+    soup = BeautifulSoup(html, 'html.parser')
+    try:
+        files = []
+        for link in soup.select('div.foldertree a[href*="/pluginfile.php/"]'):
+            href = link.get('href')
+            if not isinstance(href, str):
+                continue
+            file_path = _folder_file_path(href)
+            if file_path:
+                files.append((file_path, href))
+        return files
+    finally:
+        soup.decompose()
+
+
+# Dates as shown next to resources, e.g. "Hochgeladen 19.10.26, 10:00" or "Modified 10/19/26, 10:00 AM"
+_SHOWN_TIME = re.compile(r"\d{1,2}:\d{2}")
+
+
+def parse_course_markers(html: str) -> dict[str, str]:
+    '''
+    Parse what the page of a course shows about when its activities were last modified, returns {entry id: marker}.
+    The marker is made of the upload or modification date shown next to a resource and the links to the files of
+    a folder shown inline, whose URLs contain the revision of the folder. Activities that show neither are left out.
+    '''
+    soup = BeautifulSoup(html, 'html.parser')
+    try:
+        markers = {}
+        for activity in soup.select('li.activity[id^="module-"]'):
+            activity_id = activity.get('id')
+            if not isinstance(activity_id, str):
+                continue
+            parts = [details.get_text(" ", strip=True) for details in activity.select('.resourcelinkdetails')]
+            # Size and type alone do not change with the file
+            parts = [part for part in parts if _SHOWN_TIME.search(part)]
+            parts.extend(href for link in activity.select('a[href*="/pluginfile.php/"]')
+                         if isinstance(href := link.get('href'), str))
+            if parts:
+                markers[activity_id.removeprefix("module-")] = "\n".join(parts)
+        return markers
+    finally:
+        soup.decompose()
+
+
+def _dump_discovered(entry_name: str, marker: str, files: list[intf.RemoteFile] | None) -> dict:
+    return {
+        "name": entry_name,
+        "marker": marker,
+        "files": [[file.name, file.url, file.size, file.time_modified] for file in files] if files is not None else None,
+    }
+
+
+def _load_discovered(cached: dict | None, entry_name: str, marker: str | None) -> tuple[bool, list[intf.RemoteFile] | None]:
+    '''(whether found, files) of an entry discovered in an earlier run under the same name and marker.'''
+    if not cached or not marker or cached.get("name") != entry_name or cached.get("marker") != marker:
+        return False, None
+    files = cached.get("files")
+    return True, [intf.RemoteFile(*file) for file in files] if files is not None else None
+
+
+def _remote_file(name: str, response: httpx.Response) -> intf.RemoteFile | None:
+    # Without Last-Modified there is no telling whether the local copy is up to date
+    last_modified = response.headers.get('Last-Modified')
+    if not last_modified:
+        return None
+    try:
+        time_modified = parsedate_to_datetime(last_modified).timestamp()
+    except (TypeError, ValueError):
+        return None
+    return intf.RemoteFile(
+        name=name,
+        url=str(response.url),
+        size=int(response.headers.get('Content-Length', '0')),
+        time_modified=time_modified,
+    )
+
+
+class TUMMoodleSession(intf.TUMMoodleFileSession):
     _username: str
     _password: str
-    _storage_state_path: Path | None
+    _store: SessionStore | None
+    _origins: list  # localStorage entries from a shared playwright session
 
     _client: httpx.AsyncClient
-
-    def __init__(self, username: str, password: str, storage_state_path: Path | None = None, retries: int = 2, timeout: int = 30):
+    # serializes re-authentication of concurrent requests
+    _login_lock: asyncio.Lock
+    _login_count: int
+    # retry policies for pages and archives, and the breaker shared with all other sessions
+    _page_retry: RetryPolicy
+    _download_retry: RetryPolicy
+    _breaker: CircuitBreaker | None
+    _throttle: Throttle | None
+    _timeout: int
+    # download resources as single files instead of archives from the download center
+    _direct_downloads: bool
+    _file_concurrency: int
+    # parse results of download center pages from earlier runs
+    _parse_cache: ParseCache | None
+
+    def __init__(self, username: str, password: str, storage_state_path: Path | None = None, retries: int = 2, timeout: int = 30,
+                 page_retry: RetryPolicy = RetryPolicy(), download_retry: RetryPolicy = RetryPolicy(),
+                 breaker: CircuitBreaker | None = None, throttle: Throttle | None = None,
+                 direct_downloads: bool = False, file_concurrency: int = 4, parse_cache: ParseCache | None = None):
         self._username = username
         self._password = password
+        self._parse_cache = parse_cache
+        self._direct_downloads = direct_downloads
+        self._file_concurrency = max(1, file_concurrency)
+        self._page_retry = page_retry
+        self._download_retry = download_retry
+        self._breaker = breaker
+        self._throttle = throttle
+        self._timeout = timeout
         self._client = httpx.AsyncClient(
             follow_redirects=True,
             transport=httpx.AsyncHTTPTransport(retries=retries),
             headers=request_helper.GENERAL_HEADERS,
             timeout=timeout,
         )
-        self._storage_state_path = storage_state_path
+        self._store = SessionStore(storage_state_path) if storage_state_path else None
+        self._origins = []
+        self._login_lock = asyncio.Lock()
+        self._login_count = 0
 
     async def __aenter__(self):
         Logger.d("TUMMoodleSession", "Loading session from storage...")
+        # Login status is checked lazily by the first actual request
         self._load_session()
-        await self._check_login()
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
@@ -85,179 +418,133 @@ class TUMMoodleSession(intf.TUMMoodleSession):
         Logger.d("TUMMoodleSession", "Session closed.´")
 
     def _save_session(self):
-        if self._storage_state_path:
-            self._storage_state_path.parent.mkdir(parents=True, exist_ok=True)
-            # The cookie jar contains a lock, which is not pickleable.
-            # We extract the cookies into a list, which is.
-            cookies_list = list(self._client.cookies.jar)
-            with open(self._storage_state_path, 'wb') as f:
-                pickle.dump(cookies_list, f)
-            Logger.d("TUMMoodleSession", f"Session saved to {self._storage_state_path}")
+        if self._store:
+            # Origins (localStorage) are only meaningful to browsers, but are kept so that
+            # a session file shared with the playwright implementation stays intact.
+            self._store.save({
+                "cookies": [cookie_to_dict(cookie) for cookie in self._client.cookies.jar],
+                "origins": self._origins,
+            })
 
     def _load_session(self) -> bool:
-        if not self._storage_state_path:
+        if not self._store:
             Logger.w("TUMMoodleSession", "No storage_state_path provided, cannot load session")
             return False
-        if not self._storage_state_path.exists():
-            Logger.w("TUMMoodleSession", f"Session file not found: {self._storage_state_path}")
-            return False
 
         try:
-            with open(self._storage_state_path, 'rb') as f:
-                cookies_list = pickle.load(f)
-            # Re-populate the new cookie jar with the loaded cookies.
-            for cookie in cookies_list:
-                self._client.cookies.jar.set_cookie(cookie)
-            Logger.d("TUMMoodleSession", f"Session loaded from {self._storage_state_path}")
+            state = self._store.load()
+            if state is None:
+                return False
+            for cookie in state["cookies"]:
+                self._client.cookies.jar.set_cookie(dict_to_cookie(cookie))
+            self._origins = state["origins"]
             return True
         except Exception as e:
             Logger.e("TUMMoodleSession", f"Failed to load session: {e}")
             return False
 
-    async def _check_login(self):
-        Logger.d("TUMMoodleSession", "Checking login status...")
-        response = await self._client.get(COURSES_PAGE_URL(False), follow_redirects=False)
-        if response.status_code == 200:
-            Logger.d("TUMMoodleSession", "Already logged in")
-            return
-        Logger.d("TUMMoodleSession", "Not logged in, performing login...")
-        await self._login()
+    @staticmethod
+    def _is_login_page(url: httpx.URL) -> bool:
+        url_str = str(url)
+        return (url_str.startswith(TUM_LOGIN_URL())
+                or url_str.startswith(MOODLE_LOGIN_URL())
+                or url_str.removesuffix("/") == MOODLE_URL())
+
+    async def _fetch(self, url: str, method: str = "GET") -> httpx.Response:
+        if self._throttle:
+            await self._throttle.requests.acquire()
+        try:
+            response = await self._client.request(method, url)
+        except httpx.TransportError as e:
+            # Timeouts, connection resets, ...
+            raise RetryableError(f"{type(e).__name__}: {e}") from e
+        if response.status_code >= 500:
+            raise RetryableError(f"Server error, status code: {response.status_code}")
+        return response
+
+    async def _get_once(self, url: str, method: str = "GET") -> httpx.Response:
+        login_count = self._login_count
+        response = await self._fetch(url, method)
+        if not self._is_login_page(response.url):
+            return response
+        Logger.d("TUMMoodleSession", f"Redirected to login page {response.url}, performing login...")
+        await self._relogin(login_count)
+        response = await self._fetch(url, method)
+        if self._is_login_page(response.url):
+            raise RuntimeError(f"Still redirected to login page after login: {response.url}")
+        return response
+
+    async def _get(self, url: str) -> httpx.Response:
+        '''GET the given page, logging in and replaying the request if redirected to a login page.'''
+        return await self._page_retry.run(lambda: self._get_once(url), f"GET {url}", self._breaker)
+
+    async def _head(self, url: str) -> httpx.Response:
+        '''Like _get, but only retrieves the headers.'''
+        return await self._page_retry.run(lambda: self._get_once(url, "HEAD"), f"HEAD {url}", self._breaker)
+
+    async def _relogin(self, login_count: int):
+        '''Log in again, unless another request has already done so since login_count was taken.'''
+        async with self._login_lock:
+            if self._login_count == login_count:
+                await self._login()
 
     async def _login(self):
+        # Only needed if the stored session has expired
+        from .auth import auth
         await auth(self._client, self._username, self._password)
+        self._login_count += 1
+        metrics.LOGINS.inc(session_type="requests")
         try:
             self._save_session()
         except Exception as e:
             Logger.e("TUMMoodleSession", f"Failed to save session after login: {e}")
 
-    async def get_courses(self, show_hidden: bool) -> list[intf.CourseInfo]:
+    async def get_webservice_token(self, service: str) -> str:
+        '''Obtain a web service token the same way the Moodle app does, i.e. via the launch page after logging in.'''
+        import base64
+        import hashlib
+        import secrets
+        # Makes sure the session is logged in
+        await self._get(COURSES_PAGE_URL(False))
+        passport = secrets.token_hex(8)
+        url = MOBILE_LAUNCH_URL(service, passport)
+        # Redirects are followed manually, since the last one leads to the app's URL scheme
+        for _ in range(10):
+            if self._throttle:
+                await self._throttle.requests.acquire()
+            response = await self._client.get(url, follow_redirects=False)
+            location = response.headers.get("Location")
+            if not response.is_redirect or not location:
+                raise RuntimeError(f"Failed to obtain web service token, status code: {response.status_code}")
+            if location.startswith("moodlemobile://token="):
+                # base64 of "signature:::token" or "signature:::token:::privatetoken"
+                decoded = base64.b64decode(location.removeprefix("moodlemobile://token=")).decode()
+                signature, token = decoded.split(":::")[:2]
+                if signature != hashlib.md5(f"{MOODLE_URL()}{passport}".encode()).hexdigest():
+                    raise RuntimeError("Web service token with an invalid signature received")
+                return token
+            url = str(response.url.join(location))
+        raise RuntimeError("Too many redirects while obtaining web service token")
+
+    async def get_courses(self, show_hidden: bool, selector: CourseSelector | None = None) -> list[intf.CourseInfo]:
         try:
             Logger.d("TUMMoodleSession", "Retrieving courses from Mein Startseite...")
-            response = await self._client.get(COURSES_PAGE_URL(show_hidden))
+            response = await self._get(COURSES_PAGE_URL(show_hidden))
             if response.status_code != 200:
                 raise RuntimeError(f"Failed to retrieve courses page, status code: {response.status_code}")
-            soup = BeautifulSoup(response.text, 'html.parser')
-            links = soup.select('div.coursebox h3 a')
-            courses = []
-            for link in links:
-                title = link.get('title')
-                if not isinstance(title, str):
-                    Logger.d("TUMMoodleSession", f"Skipping course with missing title")
-                    continue
-                href = link.get('href')
-                if not isinstance(href, str) or href.find("id=") == -1:
-                    Logger.d("TUMMoodleSession", f"Skipping invalid course link: {href}")
-                    continue
-                id = href.split("id=")[-1].split("&")[0]  # get the numeric id
-                metainfo_tag = link.find('span', class_='coc-metainfo')
-                metainfo_text = metainfo_tag.get_text(strip=True) if metainfo_tag else ""
-                is_ws, start_year = utils.parse_semester(metainfo_text.split(
-                    " | ")[0].removeprefix("(")) if metainfo_text else (False, 0)
-                course = CourseInfo(
-                    id=id,
-                    title=title.strip(),
-                    metainfo=metainfo_text,
-                    is_ws=is_ws,
-                    start_year=start_year
-                )
-                Logger.d("TUMMoodleSession", f"Found course: {course}")
-                courses.append(course)
+            parse_start = time.perf_counter()
+            courses = parse_courses(response.text, selector)
+            metrics.PARSE_DURATION.observe(time.perf_counter() - parse_start, page="courses")
             Logger.d("TUMMoodleSession", f"Total courses retrieved: {len(courses)}")
             return courses
         except Exception as e:
             Logger.e("TUMMoodleSession", f"Failed to retrieve courses: {e}")
             return []
 
-    def _parse_entry(self, entry: Tag) -> EntryInfo | None:
-        entry_input = entry.select_one('input')
-        if not entry_input:
-            return None
-        entry_input_name = entry_input.get('name')
-        if not isinstance(entry_input_name, str):
-            return None
-        entry_id = entry_input_name.split("_")[-1]
-        entry_label = entry.select_one('span.itemtitle')
-        if not entry_label:
-            return None
-        entry_label_span = entry_label.select_one('span')
-        if not entry_label_span:
-            return None
-        entry_title = entry_label_span.get_text(strip=True)
-        if not entry_title:
-            return None
-        return EntryInfo(
-            id=entry_id,
-            title=entry_title,
-            _input_name=entry_input_name
-        )
-
-    def _parse_category(self, card: Tag) -> CategoryInfo | None:
-        title_tags = card.select('span.sectiontitle')
-        if not title_tags:
-            Logger.d("TUMMoodleSession", "No title tag found in resource card")
-            return None
-        title = title_tags[0].get_text(strip=True)
-        Logger.d("TUMMoodleSession", f"Processing card '{title}'...")
-
-        entries = []
-        items = card.select('div.form-check')
-        if len(items) <= 1:
-            Logger.d("TUMMoodleSession", f"No resources found in card '{title}'")
-            return None
-        category_input = items[0].select_one('input')
-        if not category_input:
-            Logger.d("TUMMoodleSession", f"No category input found in card '{title}'")
-            return None
-        category_input_name = category_input.get('name')
-        if not isinstance(category_input_name, str):
-            Logger.d("TUMMoodleSession", f"Invalid category input name in card '{title}'")
-            return None
-        for item in items[1:]:  # skip the first one (select all)
-            entry = self._parse_entry(item)
-            if entry:
-                Logger.d("TUMMoodleSession", f"Found resource: {entry.title} (ID: {entry.id})")
-                entries.append(entry)
-
-        if not entries:
-            Logger.d("TUMMoodleSession", f"No valid resources parsed in card '{title}'")
-            return None
-
-        return CategoryInfo(
-            title=title,
-            entries=entries,
-            _input_name=category_input_name
-        )
-
-    async def _perform_download(self, categories: list[CategoryInfo], page: BeautifulSoup,
-                                save_path: Path) -> Path | None:
-        form = page.find('form')
-        if not form:  # should not happen
-            raise RuntimeError("No form found on download center page")
-
-        action = form.get('action')
-        if not action:  # should not happen
-            raise RuntimeError("No action found on download form")
-        action = str(action)
-
-        inputs = form.select('input')
-        payload = {
-            "courseid": "",
-            "sesskey": ""
-        }
-        for input_tag in inputs:
-            name = input_tag.get('name')
-            if not isinstance(name, str):
-                continue
-            if name in payload:
-                value = input_tag.get('value', '')
-                if not isinstance(value, str):
-                    value = ''
-                payload[name] = value
-        payload.update({
-            "_qf__local_downloadcenter_download_form": "1",
-            "mform_isexpanded_id_downloadoptions": "1",
-            "submitbutton": "ZIP-Archiv erstellen"
-        })
+    async def _perform_download(self, categories: list[CategoryInfo], form: DownloadForm,
+                                save_path: Path, progress: ArchiveProgress | None = None) -> Path | None:
+        action = form.action
+        payload = dict(form.payload)
 
         have_entries = False
         for category in categories:
@@ -274,50 +561,279 @@ class TUMMoodleSession(intf.TUMMoodleSession):
             Logger.d("TUMMoodleSession", "No entries selected for download")
             return None
 
+        if self._throttle:
+            await self._throttle.requests.acquire()
+        stall_timeout = progress.stall_timeout if progress else 0
         response = self._client.stream('POST', action, data=payload, headers={
             **request_helper.GENERAL_HEADERS,
             **request_helper.FORM_HEADERS
-        })
-        async with response as download_response:
-            if download_response.status_code != 200:
-                raise RuntimeError(f"Failed to download resources, status code: {download_response.status_code}")
-            if not download_response.headers.get('Content-Type', '') == 'application/x-zip':
-                raise RuntimeError(
-                    f"Downloaded content is not a zip archive: {download_response.headers.get('Content-Type', '')}")
-            total_size = int(download_response.headers.get('Content-Length', '0'))
-            Logger.d("TUMMoodleSession", f"Downloading archive of size {total_size} bytes...")
-            downloaded_size = 0
-            with open(save_path, 'wb') as f:
-                async for chunk in download_response.aiter_bytes():
-                    f.write(chunk)
-                    downloaded_size += len(chunk)
-            return save_path
-
-    async def download_archive(self, course_id: str, save_path: Path, filter: Callable[[list], list] = utils.passthrough) -> None:
+        }, timeout=httpx.Timeout(self._timeout, read=stall_timeout) if stall_timeout else httpx.USE_CLIENT_DEFAULT)
+        try:
+            async with response as download_response:
+                if download_response.status_code >= 500:
+                    raise RetryableError(f"Server error, status code: {download_response.status_code}")
+                if download_response.status_code != 200:
+                    raise RuntimeError(f"Failed to download resources, status code: {download_response.status_code}")
+                if not download_response.headers.get('Content-Type', '') == 'application/x-zip':
+                    raise RuntimeError(
+                        f"Downloaded content is not a zip archive: {download_response.headers.get('Content-Type', '')}")
+                total_size = int(download_response.headers.get('Content-Length', '0'))
+                Logger.d("TUMMoodleSession", f"Downloading archive of size {total_size} bytes...")
+                if progress:
+                    progress.set_total(total_size)
+                downloaded_size = 0
+                async with AsyncFileWriter(save_path, size_hint=total_size) as f:
+                    async for chunk in download_response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                        if self._throttle:
+                            await self._throttle.bandwidth.acquire(len(chunk))
+                        await f.write(chunk)
+                        downloaded_size += len(chunk)
+                        if progress:
+                            progress.update(len(chunk))
+                request_helper.check_complete(download_response, downloaded_size, total_size, "Archive")
+                return save_path
+        except httpx.ReadTimeout as e:
+            # Also covers waiting for Moodle to build the archive
+            raise RetryableError(f"Download stalled, no data received for {stall_timeout or self._timeout} seconds") from e
+        except httpx.TransportError as e:
+            raise RetryableError(f"{type(e).__name__}: {e}") from e
+
+    async def _load_download_center(self, course_id: str) -> tuple[DownloadForm, list[CategoryInfo]]:
+        download_url = DOWNLOAD_CENTER_URL(course_id)
+        response = await self._get(download_url)
+        if response.status_code != 200:
+            raise RuntimeError(f"Failed to retrieve download center page, status code: {response.status_code}")
+        html = response.text
+        if self._parse_cache:
+            key, cached = self._parse_cache.get(html)
+            parsed = _load_download_center(html, cached) if cached else None
+            metrics.PARSE_CACHE.inc(result="hit" if parsed else "miss")
+            if parsed:
+                Logger.d("TUMMoodleSession", f"Download center of course {course_id} unchanged, using cached categories")
+                return parsed
+        parse_start = time.perf_counter()
+        form, categories = parse_download_center(html)
+        metrics.PARSE_DURATION.observe(time.perf_counter() - parse_start, page="download_center")
+        if self._parse_cache:
+            self._parse_cache.put(key, _dump_download_center(form, categories))
+        Logger.d("TUMMoodleSession", f"Total categories parsed: {len(categories)}")
+        return form, categories
+
+    async def get_categories(self, course_id: str, filter: Callable[[list], list] = utils.passthrough) -> list[intf.CategoryInfo]:
+        try:
+            Logger.d("TUMMoodleSession", f"Retrieving categories for course {course_id}...")
+            _, categories = await self._load_download_center(course_id)
+            return filter(categories)
+        except Exception as e:
+            Logger.e("TUMMoodleSession", f"Failed to retrieve categories for course {course_id}: {e}")
+            raise
+
+    async def download_archives(self,
+                                course_id: str,
+                                on_archive: Callable[[Path], Awaitable[None]],
+                                filter: Callable[[list], list] = utils.passthrough,
+                                batch_options: intf.BatchOptions = intf.BatchOptions(),
+                                progress: CourseProgress | None = None) -> None:
         try:
             Logger.d("TUMMoodleSession", f"Downloading archives for course {course_id}...")
-            download_url = DOWNLOAD_CENTER_URL(course_id)
-            response = await self._client.get(download_url)
-            if response.status_code != 200:
-                raise RuntimeError(f"Failed to retrieve download center page, status code: {response.status_code}")
-            soup = BeautifulSoup(response.text, 'html.parser')
-
-            download_cards = soup.select('div.card:has(span.sectiontitle)')
-            Logger.d("TUMMoodleSession", f"Found {len(download_cards)} cards")
-            categories: list[CategoryInfo] = []
-            for card in download_cards:
-                category = self._parse_category(card)
-                if category:
-                    categories.append(category)
-            Logger.d("TUMMoodleSession", f"Total categories parsed: {len(categories)}")
+            form, categories = await self._load_download_center(course_id)
             filtered_categories = filter(categories)
             Logger.d("TUMMoodleSession",
                      f"Total entries after filtering: {sum(len(cat.entries) for cat in filtered_categories)}")
-            downloaded_path = await self._perform_download(filtered_categories, soup, save_path)
-            if downloaded_path:
-                Logger.d("TUMMoodleSession", f"Downloaded archive will be saved to: {downloaded_path}")
-            else:
+            batches = intf.split_batches(filtered_categories, batch_options.size)
+            if not batches:
                 Logger.w("TUMMoodleSession", f"No archive was downloaded for course {course_id}")
+                return
+
+            async def download_func(batch: list[CategoryInfo], save_path: Path, archive_progress: ArchiveProgress | None):
+                # The form on the page stays valid, so batches can be posted concurrently
+                if not await self._perform_download(batch, form, save_path, archive_progress):
+                    raise RuntimeError("No entries selected for download")
+
+            await intf.download_batches(batches, download_func, on_archive,  # type: ignore
+                                        batch_options.concurrency, self._download_retry, self._breaker, progress)
         except Exception as e:
             Logger.e("TUMMoodleSession", f"Failed to download archive for course {course_id}: {e}")
             raise
+
+    def prefers_files(self) -> bool:
+        return self._direct_downloads
+
+    async def _discover_files(self, entry: EntryInfo, entry_name: str, marker: str | None,
+                              cached: dict | None) -> tuple[list[intf.RemoteFile] | None, str | None]:
+        '''
+        The files of an entry, named like in a download center archive, or None if they cannot be downloaded directly,
+        along with the marker they can be reused under in later runs. Files discovered under the same marker in an
+        earlier run are reused without any request.
+        '''
+        found, files = _load_discovered(cached, entry_name, marker)
+        if found:
+            return files, marker
+        kind = _entry_kind(entry)
+        if kind == "resource":
+            response = await self._head(RESOURCE_URL(entry.id))
+            # Not redirected to the file if e.g. the resource is an embedded page
+            if response.status_code != 200 or "/pluginfile.php/" not in response.url.path:
+                return None, marker
+            # Named after the resource, with the extension of the file
+            file = _remote_file(f"{entry_name}{Path(unquote(response.url.path)).suffix}", response)
+            return ([file] if file else None), marker
+        if kind == "folder":
+            response = await self._get(FOLDER_URL(entry.id))
+            if response.status_code != 200:
+                return None, None
+            listed = parse_folder(response.text)
+            # The URLs contain the revision of the folder, which changes whenever any of its files does
+            marker = "\n".join(url for _, url in listed)
+            found, files = _load_discovered(cached, entry_name, marker)
+            if found:
+                return files, marker
+            files = []
+            for file_path, url in listed:
+                file_response = await self._head(url)
+                file = _remote_file(f"{entry_name}{file_path}", file_response) if file_response.status_code == 200 else None
+                if not file:
+                    return None, marker
+                files.append(file)
+            return files or None, marker
+        return None, None
+
+    async def _load_course_markers(self, course_id: str) -> dict[str, str]:
+        try:
+            response = await self._get(COURSE_URL(course_id))
+            if response.status_code != 200:
+                raise RuntimeError(f"status code: {response.status_code}")
+            parse_start = time.perf_counter()
+            markers = parse_course_markers(response.text)
+            metrics.PARSE_DURATION.observe(time.perf_counter() - parse_start, page="course")
+            return markers
+        except Exception as e:
+            Logger.w("TUMMoodleSession", f"Failed to read modification dates from the page of course {course_id}: {e}")
+            return {}
+
+    async def _discover(self, course_id: str, categories: list[CategoryInfo]) -> tuple[list[intf.RemoteFile], list[CategoryInfo]]:
+        '''Split the entries into files to be downloaded directly and categories of the remaining entries.'''
+        # Without a cache of earlier runs there is nothing to compare the dates on the course page with
+        cache_key, cached = "", None
+        markers: dict[str, str] = {}
+        if self._parse_cache:
+            cache_key, cached = self._parse_cache.get(f"discovered/{course_id}")
+            markers = await self._load_course_markers(course_id)
+        cached = cached if isinstance(cached, dict) else {}
+        discovered: dict[str, dict] = {}
+        slots = asyncio.Semaphore(self._file_concurrency)
+
+        async def discover(entry: EntryInfo, category_name: str) -> list[intf.RemoteFile] | None:
+            entry_name = f"{category_name}/{intf.clean_name(entry.title)}"
+            async with slots:
+                try:
+                    files, marker = await self._discover_files(entry, entry_name, markers.get(entry.id), cached.get(entry.id))
+                except Exception as e:
+                    Logger.w("TUMMoodleSession", f"Failed to look up the files of '{entry.title}', falling back to archive: {e}")
+                    return None
+            if marker:
+                discovered[entry.id] = _dump_discovered(entry_name, marker, files)
+            return files
+
+        # All entries share the same slots, instead of one category after another
+        results = iter(await asyncio.gather(*[discover(entry, intf.clean_name(category.title))  # type: ignore
+                                              for category in categories for entry in category.entries]))
+        files: list[intf.RemoteFile] = []
+        remaining: list[CategoryInfo] = []
+        for category in categories:
+            leftover = []
+            for entry in category.entries:
+                entry_files = next(results)
+                if entry_files is None:
+                    leftover.append(entry)
+                else:
+                    files.extend(entry_files)
+            if leftover:
+                remaining.append(replace(category, entries=leftover))
+        if self._parse_cache and discovered != cached:
+            self._parse_cache.put(cache_key, discovered)
+        return files, remaining
+
+    async def _download_direct(self, file: intf.RemoteFile, save_path: Path, progress: ArchiveProgress | None = None):
+        offset = save_path.stat().st_size if save_path.exists() else 0
+        headers = {}
+        if 0 < offset < file.size:
+            # Resume the previous attempt, unless the file has been modified since
+            headers = {"Range": f"bytes={offset}-", "If-Range": formatdate(file.time_modified, usegmt=True)}
+        if self._throttle:
+            await self._throttle.requests.acquire()
+        login_count = self._login_count
+        stall_timeout = progress.stall_timeout if progress else 0
+        response = self._client.stream('GET', file.url, headers=headers, timeout=httpx.Timeout(
+            self._timeout, read=stall_timeout) if stall_timeout else httpx.USE_CLIENT_DEFAULT)
+        try:
+            async with response as download_response:
+                if self._is_login_page(download_response.url):
+                    # The session expired, the next attempt downloads the file with the new one
+                    Logger.d("TUMMoodleSession", f"Redirected to login page {download_response.url}, performing login...")
+                    await self._relogin(login_count)
+                    raise RetryableError("Redirected to login page")
+                if download_response.status_code >= 500:
+                    raise RetryableError(f"Server error, status code: {download_response.status_code}")
+                if download_response.status_code not in (200, 206):
+                    raise RuntimeError(f"Failed to download file, status code: {download_response.status_code}")
+                resumed = download_response.status_code == 206
+                if resumed:
+                    Logger.d("TUMMoodleSession", f"Resuming {file.name} at {offset} bytes...")
+                else:
+                    offset = 0
+                if progress:
+                    progress.set_total(file.size - offset)
+                downloaded_size = offset
+                async with AsyncFileWriter(save_path, append=resumed, size_hint=file.size) as f:
+                    async for chunk in download_response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                        if self._throttle:
+                            await self._throttle.bandwidth.acquire(len(chunk))
+                        await f.write(chunk)
+                        downloaded_size += len(chunk)
+                        if progress:
+                            progress.update(len(chunk))
+                request_helper.check_complete(download_response, downloaded_size, file.size, "File")
+        except httpx.ReadTimeout as e:
+            raise RetryableError(f"Download stalled, no data received for {stall_timeout or self._timeout} seconds") from e
+        except httpx.TransportError as e:
+            raise RetryableError(f"{type(e).__name__}: {e}") from e
+
+    async def download_files(self,
+                             course_id: str,
+                             want: Callable[[intf.RemoteFile], bool],
+                             on_file: Callable[[intf.RemoteFile, Path], Awaitable[None]],
+                             filter: Callable[[list], list] = utils.passthrough,
+                             progress: CourseProgress | None = None,
+                             on_archive: Callable[[Path], Awaitable[None]] | None = None) -> None:
+        try:
+            Logger.d("TUMMoodleSession", f"Downloading files for course {course_id}...")
+            # The download center is only used to list the resources, and for those that are not plain files
+            form, categories = await self._load_download_center(course_id)
+            files, remaining = await self._discover(course_id, filter(categories))
+            # Up-to-date files are skipped before downloading anything
+            wanted = [file for file in files if want(file)]
+            Logger.d("TUMMoodleSession", f"Downloading {len(wanted)} of {len(files)} files, "
+                     f"{sum(len(category.entries) for category in remaining)} entries in an archive...")
+            errors = []
+            if wanted:
+                try:
+                    await intf.download_single_files(wanted, self._download_direct, on_file, self._file_concurrency,
+                                                     self._download_retry, self._breaker, progress)
+                except Exception as e:
+                    errors.append(e)
+            if remaining and on_archive:
+                async def download_func(batch: list[CategoryInfo], save_path: Path, archive_progress: ArchiveProgress | None):
+                    if not await self._perform_download(batch, form, save_path, archive_progress):
+                        raise RuntimeError("No entries selected for download")
+
+                try:
+                    await intf.download_batches(intf.split_batches(remaining, 0), download_func, on_archive,  # type: ignore
+                                                1, self._download_retry, self._breaker, progress)
+                except Exception as e:
+                    errors.append(e)
+            if errors:
+                raise RuntimeError("; ".join(str(error) for error in errors))
+        except Exception as e:
+            Logger.e("TUMMoodleSession", f"Failed to download files for course {course_id}: {e}")
+            raise
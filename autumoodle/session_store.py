@@ -0,0 +1,168 @@
+'''
+Author: Uyanide pywang0608@foxmail.com
+Date: 2026-10-19 01:08:06
+LastEditTime: 2026-10-19 02:11:32
+Description: Versioned session store shared by all session implementations
+'''
+
+from http.cookiejar import Cookie
+from pathlib import Path
+import hashlib
+import json
+import os
+import tempfile
+
+from .log import Logger
+
+
+# Bump this when the layout of the stored file changes in an incompatible way
+STORE_VERSION = 1
+
+
+class SessionStore:
+    '''
+    Stores session cookies as JSON, using the same layout as Playwright's storage_state
+    ({"cookies": [...], "origins": [...]}) plus a version field, so that both session
+    implementations can share the same file.
+    '''
+    _path: Path
+    _digest: str | None  # digest of the content last loaded from / written to the file
+
+    def __init__(self, path: Path):
+        self._path = path
+        self._digest = None
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    @staticmethod
+    def _compute_digest(state: dict) -> str:
+        return hashlib.sha256(json.dumps(state, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def load(self) -> dict | None:
+        '''Load the storage state, returns None if there is no usable stored session.'''
+        if not self._path.exists():
+            Logger.w("SessionStore", f"Session file not found: {self._path}")
+            return None
+        try:
+            data = json.loads(self._path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            # e.g. a session file written by older versions with pickle
+            Logger.w("SessionStore", f"Ignoring unreadable session file {self._path}: {e}")
+            return None
+        if not isinstance(data, dict) or data.get("version") != STORE_VERSION:
+            Logger.w("SessionStore", f"Ignoring session file with unsupported version: {self._path}")
+            return None
+        state = _normalize_state(data)
+        self._digest = self._compute_digest(state)
+        Logger.d("SessionStore", f"Session loaded from {self._path}")
+        return state
+
+    def save(self, state: dict) -> bool:
+        '''Atomically write the storage state, returns False if skipped because nothing changed.'''
+        # Compared in the form that is written, so that a loaded and saved again state is unchanged
+        state = _normalize_state(state)
+        digest = self._compute_digest(state)
+        if digest == self._digest:
+            Logger.d("SessionStore", "Session unchanged, skipping write")
+            return False
+
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file in the same directory and move it into place,
+        # so that concurrent runs never observe a partially written file
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{self._path.name}.", suffix=".tmp", dir=self._path.parent)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"version": STORE_VERSION, **state}, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self._path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+        self._digest = digest
+        Logger.d("SessionStore", f"Session saved to {self._path}")
+        return True
+
+
+def _normalize_same_site(same_site: str | None) -> str:
+    same_site = same_site or "Lax"
+    return same_site.capitalize() if same_site.lower() in ("strict", "lax", "none") else "Lax"
+
+
+def _normalize_cookie(data: dict) -> dict:
+    '''The cookie as cookie_to_dict would produce it, fields unknown to it are kept as they are.'''
+    expires = data.get("expires", -1)
+    return {
+        **data,
+        "value": data.get("value", "") or "",
+        "path": data.get("path", "/"),
+        # Playwright stores fractional seconds, http.cookiejar only whole ones
+        "expires": int(expires) if expires is not None and expires >= 0 else -1,
+        "httpOnly": bool(data.get("httpOnly", False)),
+        "secure": bool(data.get("secure", False)),
+        "sameSite": _normalize_same_site(data.get("sameSite")),
+    }
+
+
+def _normalize_state(state: dict) -> dict:
+    # Sorted, as a cookie jar does not keep the order of the cookies it was loaded with
+    cookies = sorted((_normalize_cookie(cookie) for cookie in state.get("cookies", [])),
+                     key=lambda cookie: (cookie.get("domain", ""), cookie["path"], cookie.get("name", "")))
+    return {
+        "cookies": cookies,
+        "origins": state.get("origins", []),
+    }
+
+
+########
+# Conversion between http.cookiejar and the Playwright cookie format
+
+def _get_attr(cookie: Cookie, name: str) -> tuple[bool, str | None]:
+    '''(whether present, value) of a non-standard attribute, whose names are case-insensitive.'''
+    name = name.lower()
+    for key, value in getattr(cookie, "_rest", {}).items():
+        if key.lower() == name:
+            return True, value
+    return False, None
+
+
+def cookie_to_dict(cookie: Cookie) -> dict:
+    return {
+        "name": cookie.name,
+        "value": cookie.value or "",
+        "domain": cookie.domain,
+        "path": cookie.path,
+        # Playwright uses -1 for session cookies
+        "expires": cookie.expires if cookie.expires is not None else -1,
+        "httpOnly": _get_attr(cookie, "HttpOnly")[0],
+        "secure": cookie.secure,
+        "sameSite": _normalize_same_site(_get_attr(cookie, "SameSite")[1]),
+    }
+
+
+def dict_to_cookie(data: dict) -> Cookie:
+    domain = data.get("domain", "")
+    expires = data.get("expires", -1)
+    rest = {"SameSite": data.get("sameSite", "Lax")}
+    if data.get("httpOnly", False):
+        rest["HttpOnly"] = None  # type: ignore
+    return Cookie(
+        version=0,
+        name=data["name"],
+        value=data.get("value", ""),
+        port=None,
+        port_specified=False,
+        domain=domain,
+        domain_specified=domain.startswith("."),
+        domain_initial_dot=domain.startswith("."),
+        path=data.get("path", "/"),
+        path_specified=True,
+        secure=data.get("secure", False),
+        expires=int(expires) if expires is not None and expires >= 0 else None,
+        discard=expires is None or expires < 0,
+        comment=None,
+        comment_url=None,
+        rest=rest,
+    )
@@ -0,0 +1,360 @@
+'''
+Author: Uyanide pywang0608@foxmail.com
+Date: 2026-10-19 01:35:21
+LastEditTime: 2026-10-19 02:25:05
+Description: Moodle web service (REST API) based session implementation, downloading single files
+'''
+
+from dataclasses import dataclass
+from datetime import datetime
+from html import unescape
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+import logging
+import re
+import time
+import httpx
+
+from .log import Logger
+from . import utils
+from . import request_helper
+from .retry import RetryPolicy, RetryableError, CircuitBreaker
+from .throttle import Throttle
+from .aio_writer import AsyncFileWriter
+from .progress import ArchiveProgress, CourseProgress
+from . import metrics
+from .course_selector import CourseSelector
+from . import session_intf as intf
+
+# autopep8: off
+def MOODLE_URL(): return "https://www.moodle.tum.de"
+def REST_URL(base_url): return f"{base_url}/webservice/rest/server.php"
+# autopep8: on
+
+# the service used by the Moodle app, which is what tokens obtained via the launch page are issued for
+MOBILE_SERVICE = "moodle_mobile_app"
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Redacts tokens from the URLs httpx logs its requests with
+_TOKEN_PARAM = re.compile(r"\b((?:ws)?token=)[^&\s\"]+")
+
+
+class _RedactTokenFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        message = record.getMessage()
+        redacted = _TOKEN_PARAM.sub(r"\1***", message)
+        if redacted != message:
+            record.msg, record.args = redacted, None
+        return True
+
+
+logging.getLogger("httpx").addFilter(_RedactTokenFilter())
+
+
+@dataclass(frozen=True, slots=True)
+class EntryInfo(intf.EntryInfo):
+    id: str
+    title: str
+    _files: tuple[intf.RemoteFile, ...]
+
+
+@dataclass(slots=True)
+class CategoryInfo(intf.CategoryInfo):
+    title: str
+    entries: list[intf.EntryInfo]
+
+
+@dataclass(frozen=True, slots=True)
+class CourseInfo(intf.CourseInfo):
+    id: str
+    title: str
+    metainfo: str
+    is_ws: bool
+    start_year: int
+
+
+# e.g. "WiSe 2024/25", "WS24/25", "Wintersemester 2024/2025", "SoSe 2025", "SS25" in the short name or id number
+_SEMESTER_PATTERN = re.compile(r"\b(?:wise|ws|wintersemester|sose|ss|sommersemester)\s*\d{2,4}(?:/\d{2,4})?\b", re.IGNORECASE)
+
+
+def _semester_of(course_data: dict) -> tuple[bool, int, bool]:
+    '''
+    Semester of a course as (is_ws, start_year, guessed). Taken from the short name or id number if either names it,
+    otherwise guessed from the start date, as courses are often set up a few weeks before the semester starts.
+    '''
+    for field in ("idnumber", "shortname"):
+        match = _SEMESTER_PATTERN.search(course_data.get(field) or "")
+        if match:
+            return *utils.parse_semester(match[0]), False
+    timestamp = course_data.get("startdate")
+    if not timestamp:
+        return False, 0, True
+    date = datetime.fromtimestamp(timestamp)
+    if date.month >= 8:
+        return True, date.year, True
+    if date.month <= 2:
+        return True, date.year - 1, True
+    return False, date.year, True
+
+
+def _format_semester(is_ws: bool, start_year: int) -> str:
+    if not start_year:
+        return ""
+    # Same format as on the courses page, so that utils.parse_semester understands it
+    return f"(WiSe {start_year}/{(start_year + 1) % 100:02d})" if is_ws else f"(SoSe {start_year})"
+
+
+def _parse_module(module: dict, category_name: str) -> EntryInfo | None:
+    if not module.get("uservisible", True):
+        return None
+    title = unescape(module.get("name", "")).strip()
+    if not title:
+        return None
+    contents = [content for content in module.get("contents", []) if content.get("type") == "file"]
+    if not contents:
+        return None
+    entry_name = f"{category_name}/{intf.clean_name(title)}"
+    if module.get("modname") == "resource":
+        # Named after the resource like in the download center, only the main file is included there
+        main = contents[0]
+        names = [(f"{entry_name}{Path(main['filename']).suffix}", main)]
+    elif module.get("modname") == "folder":
+        names = [(f"{entry_name}{content.get('filepath', '/')}{content['filename']}", content) for content in contents]
+    else:
+        # Other kinds of modules are not included in download center archives either
+        return None
+    files = tuple(intf.RemoteFile(
+        name=name,
+        url=content["fileurl"],
+        size=content.get("filesize", 0),
+        time_modified=content.get("timemodified", 0),
+    ) for name, content in names)
+    return EntryInfo(id=str(module["id"]), title=title, _files=files)
+
+
+def parse_contents(sections: list[dict]) -> list[CategoryInfo]:
+    '''Parse the result of core_course_get_contents into categories, one per section.'''
+    categories = []
+    for section in sections:
+        title = unescape(section.get("name", "")).strip()
+        if not title:
+            continue
+        category_name = intf.clean_name(title)
+        entries: list[intf.EntryInfo] = []
+        for module in section.get("modules", []):
+            entry = _parse_module(module, category_name)
+            if entry:
+                Logger.d("TUMMoodleSession", f"Found resource: {entry.title} (ID: {entry.id})")
+                entries.append(entry)
+        if entries:
+            categories.append(CategoryInfo(title=title, entries=entries))
+        else:
+            Logger.d("TUMMoodleSession", f"No resources found in section '{title}'")
+    return categories
+
+
+class TUMMoodleSession(intf.TUMMoodleFileSession):
+    _username: str
+    _password: str
+    _storage_state_path: Path | None
+    _url: str
+    _token: str | None
+    _user_id: int
+    _concurrency: int
+    _timeout: int
+    _client: httpx.AsyncClient
+    _page_retry: RetryPolicy
+    _download_retry: RetryPolicy
+    _breaker: CircuitBreaker | None
+    _throttle: Throttle | None
+
+    def __init__(self, username: str, password: str, url: str = MOODLE_URL(), token: str | None = None,
+                 storage_state_path: Path | None = None, concurrency: int = 4, timeout: int = 30,
+                 page_retry: RetryPolicy = RetryPolicy(), download_retry: RetryPolicy = RetryPolicy(),
+                 breaker: CircuitBreaker | None = None, throttle: Throttle | None = None):
+        self._username = username
+        self._password = password
+        self._storage_state_path = storage_state_path
+        self._url = url.removesuffix("/")
+        self._token = token
+        self._user_id = 0
+        self._concurrency = max(1, concurrency)
+        self._timeout = timeout
+        self._page_retry = page_retry
+        self._download_retry = download_retry
+        self._breaker = breaker
+        self._throttle = throttle
+        self._client = httpx.AsyncClient(
+            follow_redirects=True,
+            headers=request_helper.GENERAL_HEADERS,
+            timeout=timeout,
+        )
+
+    async def __aenter__(self):
+        try:
+            if not self._token:
+                self._token = await self._obtain_token()
+            site_info = await self._call("core_webservice_get_site_info")
+            self._user_id = site_info["userid"]
+            Logger.d("TUMMoodleSession", f"Using web service of {site_info.get('sitename', self._url)} as user {self._user_id}")
+        except BaseException:
+            await self._client.aclose()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        Logger.d("TUMMoodleSession", "Closing session...")
+        await self._client.aclose()
+
+    async def _obtain_token(self) -> str:
+        # Web services do not support the SSO login, so the token is obtained with a regular session
+        from .session_requests import TUMMoodleSession as SessionRequests
+        Logger.d("TUMMoodleSession", "No web service token configured, obtaining one via the launch page...")
+        async with SessionRequests(self._username, self._password, self._storage_state_path,
+                                   page_retry=self._page_retry, breaker=self._breaker, throttle=self._throttle) as session:
+            return await session.get_webservice_token(MOBILE_SERVICE)
+
+    async def _call_once(self, function: str, params: dict[str, Any]) -> Any:
+        if self._throttle:
+            await self._throttle.requests.acquire()
+        try:
+            response = await self._client.post(REST_URL(self._url), data={
+                "wstoken": self._token,
+                "wsfunction": function,
+                "moodlewsrestformat": "json",
+                **params,
+            })
+        except httpx.TransportError as e:
+            raise RetryableError(f"{type(e).__name__}: {e}") from e
+        if response.status_code >= 500:
+            raise RetryableError(f"Server error, status code: {response.status_code}")
+        if response.status_code != 200:
+            raise RuntimeError(f"Failed to call {function}, status code: {response.status_code}")
+        data = response.json()
+        # Errors are reported with status 200
+        if isinstance(data, dict) and "exception" in data:
+            raise RuntimeError(f"Failed to call {function}: {data.get('errorcode')}: {data.get('message')}")
+        return data
+
+    async def _call(self, function: str, **params) -> Any:
+        '''Call a web service function, retrying on transient failures.'''
+        return await self._page_retry.run(lambda: self._call_once(function, params), function, self._breaker)
+
+    async def get_courses(self, show_hidden: bool, selector: CourseSelector | None = None) -> list[intf.CourseInfo]:
+        try:
+            Logger.d("TUMMoodleSession", "Retrieving enrolled courses...")
+            data = await self._call("core_enrol_get_users_courses", userid=self._user_id)
+            parse_start = time.perf_counter()
+            courses = []
+            for course_data in data:
+                # Hidden from the dashboard by the user
+                if course_data.get("hidden") and not show_hidden:
+                    continue
+                title = unescape(course_data.get("fullname", "")).strip()
+                if not title:
+                    Logger.d("TUMMoodleSession", f"Skipping course with missing title")
+                    continue
+                is_ws, start_year, guessed = _semester_of(course_data)
+                # Skip non-matching courses before doing anything else with them
+                if selector and not selector.select(title, is_ws, start_year):
+                    if guessed and selector.matches_title(title):
+                        Logger.w("TUMMoodleSession", f"Skipping course '{title}', whose semester {_format_semester(is_ws, start_year)} "
+                                 "is only guessed from its start date and matches no course config")
+                    continue
+                course = CourseInfo(
+                    id=str(course_data["id"]),
+                    title=title,
+                    metainfo=_format_semester(is_ws, start_year),
+                    is_ws=is_ws,
+                    start_year=start_year
+                )
+                Logger.d("TUMMoodleSession", f"Found course: {course}")
+                courses.append(course)
+            metrics.PARSE_DURATION.observe(time.perf_counter() - parse_start, page="courses")
+            Logger.d("TUMMoodleSession", f"Total courses retrieved: {len(courses)}")
+            return courses
+        except Exception as e:
+            Logger.e("TUMMoodleSession", f"Failed to retrieve courses: {e}")
+            return []
+
+    async def _load_contents(self, course_id: str) -> list[CategoryInfo]:
+        sections = await self._call("core_course_get_contents", courseid=course_id)
+        parse_start = time.perf_counter()
+        categories = parse_contents(sections)
+        metrics.PARSE_DURATION.observe(time.perf_counter() - parse_start, page="download_center")
+        Logger.d("TUMMoodleSession", f"Total categories parsed: {len(categories)}")
+        return categories
+
+    async def get_categories(self, course_id: str, filter: Callable[[list], list] = utils.passthrough) -> list[intf.CategoryInfo]:
+        try:
+            Logger.d("TUMMoodleSession", f"Retrieving categories for course {course_id}...")
+            return filter(await self._load_contents(course_id))
+        except Exception as e:
+            Logger.e("TUMMoodleSession", f"Failed to retrieve categories for course {course_id}: {e}")
+            raise
+
+    async def download_archives(self,
+                                course_id: str,
+                                on_archive: Callable[[Path], Awaitable[None]],
+                                filter: Callable[[list], list] = utils.passthrough,
+                                batch_options: intf.BatchOptions = intf.BatchOptions(),
+                                progress: CourseProgress | None = None) -> None:
+        # prefers_files() is always True, so files are never requested as archives
+        raise NotImplementedError("The web service has no download center, files are downloaded with download_files")
+
+    async def _download_file(self, file: intf.RemoteFile, save_path: Path, progress: ArchiveProgress | None = None):
+        if self._throttle:
+            await self._throttle.requests.acquire()
+        stall_timeout = progress.stall_timeout if progress else 0
+        # Files are only served with the token as a query parameter
+        response = self._client.stream(
+            'GET', file.url, params={"token": self._token}, timeout=httpx.Timeout(self._timeout, read=stall_timeout) if stall_timeout else httpx.USE_CLIENT_DEFAULT)
+        try:
+            async with response as download_response:
+                if download_response.status_code >= 500:
+                    raise RetryableError(f"Server error, status code: {download_response.status_code}")
+                if download_response.status_code != 200:
+                    raise RuntimeError(f"Failed to download file, status code: {download_response.status_code}")
+                # Errors, e.g. an invalid token, are reported as JSON
+                if download_response.headers.get('Content-Type', '').startswith('application/json'):
+                    raise RuntimeError(f"Failed to download file: {(await download_response.aread()).decode(errors='replace')}")
+                if progress:
+                    progress.set_total(file.size)
+                downloaded_size = 0
+                async with AsyncFileWriter(save_path, size_hint=file.size) as f:
+                    async for chunk in download_response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                        if self._throttle:
+                            await self._throttle.bandwidth.acquire(len(chunk))
+                        await f.write(chunk)
+                        downloaded_size += len(chunk)
+                        if progress:
+                            progress.update(len(chunk))
+                request_helper.check_complete(download_response, downloaded_size, file.size, "File")
+        except httpx.ReadTimeout as e:
+            raise RetryableError(f"Download stalled, no data received for {stall_timeout or self._timeout} seconds") from e
+        except httpx.TransportError as e:
+            raise RetryableError(f"{type(e).__name__}: {e}") from e
+
+    async def download_files(self,
+                             course_id: str,
+                             want: Callable[[intf.RemoteFile], bool],
+                             on_file: Callable[[intf.RemoteFile, Path], Awaitable[None]],
+                             filter: Callable[[list], list] = utils.passthrough,
+                             progress: CourseProgress | None = None,
+                             on_archive: Callable[[Path], Awaitable[None]] | None = None) -> None:
+        # Only modules with files are listed by parse_contents, so there is nothing to pass to on_archive
+        try:
+            Logger.d("TUMMoodleSession", f"Downloading files for course {course_id}...")
+            categories = filter(await self._load_contents(course_id))
+            # Up-to-date files are skipped before downloading anything
+            files = [file for category in categories for entry in category.entries
+                     for file in entry._files if want(file)]  # type: ignore
+            if not files:
+                Logger.d("TUMMoodleSession", f"No files to download for course {course_id}")
+                return
+            Logger.d("TUMMoodleSession", f"Downloading {len(files)} files...")
+            await intf.download_single_files(files, self._download_file, on_file,
+                                             self._concurrency, self._download_retry, self._breaker, progress)
+        except Exception as e:
+            Logger.e("TUMMoodleSession", f"Failed to download files for course {course_id}: {e}")
+            raise
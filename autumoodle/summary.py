@@ -1,14 +1,18 @@
 '''
 Author: Uyanide pywang0608@foxmail.com
 Date: 2025-11-03 13:03:19
-LastEditTime: 2025-11-14 13:06:11
+LastEditTime: 2026-10-19 02:22:49
 Description: Summary manager and Summary writer implementations
 '''
 
 from abc import ABC, abstractmethod
 from pathlib import Path
+from typing import Any, TextIO
+import csv
+import json
+import threading
 import time
-from dataclasses import dataclass
+from dataclasses import dataclass, fields, asdict, astuple
 
 from .log import Logger
 
@@ -24,6 +28,9 @@ class SummaryEntry:
     detail: str
 
 
+SUMMARY_FIELDS = tuple(f.name for f in fields(SummaryEntry))
+
+
 class SummaryWriter(ABC):
     @abstractmethod
     def __init__(self, dir: Path, prefix: str) -> None:
@@ -54,76 +61,256 @@ class SummaryWriter(ABC):
         pass
 
 
-class _SummaryWriterCSV(SummaryWriter):
+class _SummaryWriterBuffered(SummaryWriter):
+    '''
+    Base class for summary writers that write entries in batches and only keep
+    aggregated counters (plus the first few entries for the printed report) in memory.
+    '''
+    FLUSH_SIZE = 512          # entries buffered before being written out
+    MAX_LISTED_ENTRIES = 100  # entries listed in the printed report
+
     _file_path: Path
-    _file: object
-    _entries: list[SummaryEntry]
+    _buffer: list[SummaryEntry]
+    _listed: list[SummaryEntry]
+    _total: int
+    _counts: dict[str, int]
+    # entries are added from the threads files are stored on
+    _lock: threading.Lock
 
     def _format_filename(self, prefix: str) -> str:
         return f"{prefix}{time.strftime('%Y%m%d_%H%M%S', time.localtime())}{self.get_extname()}"
 
     def __init__(self, dir: Path, prefix: str) -> None:
         self._file_path = dir / self._format_filename(prefix)
-        self._entries = []
-        self._file = None
-
-    def get_extname(self) -> str:
-        return ".csv"
+        self._buffer = []
+        self._listed = []
+        self._total = 0
+        self._counts = {}
+        self._lock = threading.Lock()
 
     def get_filepath(self) -> Path:
         return self._file_path
 
     def open(self) -> None:
         self._file_path.parent.mkdir(parents=True, exist_ok=True)
+        self._open_file()
+
+    def close(self) -> None:
+        self.flush()
+        self._close_file()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._buffer:
+            self._write_entries(self._buffer)
+            self._buffer = []
+
+    def add_entry(self, entry: SummaryEntry) -> None:
+        with self._lock:
+            self._total += 1
+            self._counts[entry.status] = self._counts.get(entry.status, 0) + 1
+            if len(self._listed) < self.MAX_LISTED_ENTRIES:
+                self._listed.append(entry)
+            self._buffer.append(entry)
+            if len(self._buffer) >= self.FLUSH_SIZE:
+                self._flush()
+
+    def format_summary(self) -> str:
+        lines = [f"Total updated files: {self._total}."]
+        if self._total == 0:
+            lines[0] += " No files were updated."
+        else:
+            lines[0] += " Details: " + ", ".join(f"{status}: {count}" for status, count in self._counts.items())
+            lines.append("Updated files:")
+            lines.extend(f"- [{entry.status}] {entry.stored_path}" for entry in self._listed)
+            if self._total > len(self._listed):
+                lines.append(f"... and {self._total - len(self._listed)} more")
+        lines.append(f"Summary file has been saved to: {self._file_path}")
+        return "\n".join(lines)
+
+    @abstractmethod
+    def _open_file(self) -> None:
+        pass
+
+    @abstractmethod
+    def _write_entries(self, entries: list[SummaryEntry]) -> None:
+        pass
+
+    @abstractmethod
+    def _close_file(self) -> None:
+        pass
+
+
+class _SummaryWriterCSV(_SummaryWriterBuffered):
+    _file: TextIO | None
+    _writer: Any
+
+    def __init__(self, dir: Path, prefix: str) -> None:
+        super().__init__(dir, prefix)
+        self._file = None
+
+    def get_extname(self) -> str:
+        return ".csv"
+
+    def _open_file(self) -> None:
+        self._file = open(self._file_path, "w", encoding="utf-8", newline="")
+        self._writer = csv.writer(self._file, quoting=csv.QUOTE_ALL)
+        self._writer.writerow(SUMMARY_FIELDS)
+
+    def _write_entries(self, entries: list[SummaryEntry]) -> None:
+        self._writer.writerows(astuple(entry) for entry in entries)
+        self._file.flush()  # type: ignore
+
+    def _close_file(self) -> None:
+        self._file.close()  # type: ignore
+
+
+class _SummaryWriterJSONL(_SummaryWriterBuffered):
+    _file: TextIO | None
+
+    def __init__(self, dir: Path, prefix: str) -> None:
+        super().__init__(dir, prefix)
+        self._file = None
+
+    def get_extname(self) -> str:
+        return ".jsonl"
+
+    def _open_file(self) -> None:
         self._file = open(self._file_path, "w", encoding="utf-8")
-        self._write_header()
 
-    def _write(self, content: str) -> None:
-        self._file.write(content)  # type: ignore
+    def _write_entries(self, entries: list[SummaryEntry]) -> None:
+        self._file.write("".join(json.dumps(asdict(entry), ensure_ascii=False) + "\n" for entry in entries))  # type: ignore
+        self._file.flush()  # type: ignore
 
-    def close(self) -> None:
+    def _close_file(self) -> None:
         self._file.close()  # type: ignore
 
-    def _write_header(self) -> None:
-        header = '"stored_path","course_name","category_name","entry_name","file_name","status","detail"\n'
-        self._write(header)
+
+class _SummaryWriterSQLite(_SummaryWriterBuffered):
+    '''Writes into the history database shared by all runs instead of a new file per run'''
+    _store: Any  # HistoryStore, imported lazily along with sqlite3
+    _synced_at: float
+
+    def __init__(self, dir: Path, prefix: str) -> None:
+        from .history import HistoryStore, HISTORY_FILENAME
+        super().__init__(dir, prefix)
+        self._file_path = dir / HISTORY_FILENAME
+        self._store = HistoryStore(self._file_path)
+        self._synced_at = time.time()
+
+    def get_extname(self) -> str:
+        return ".sqlite3"
+
+    def _open_file(self) -> None:
+        self._store.open()
+
+    def _write_entries(self, entries: list[SummaryEntry]) -> None:
+        from .history import HistoryRecord
+        self._store.add_records(HistoryRecord(
+            synced_at=self._synced_at,
+            course_name=entry.course_name,
+            category_name=entry.category_name,
+            entry_name=entry.entry_name,
+            file_name=entry.file_name,
+            stored_path=entry.stored_path,
+            status=entry.status,
+            detail=entry.detail,
+        ) for entry in entries)
+
+    def _close_file(self) -> None:
+        self._store.close()
+
+
+class _SummaryWriterWithHistory(SummaryWriter):
+    '''Writes the summary of a run and records its entries in the history database at the same time'''
+    _summary: SummaryWriter
+    _history: SummaryWriter
+
+    def __init__(self, summary: SummaryWriter, history: SummaryWriter) -> None:  # type: ignore[override]
+        self._summary = summary
+        self._history = history
+
+    def get_extname(self) -> str:
+        return self._summary.get_extname()
+
+    def get_filepath(self) -> Path:
+        return self._summary.get_filepath()
+
+    def open(self) -> None:
+        self._history.open()
+        try:
+            self._summary.open()
+        except BaseException:
+            self._history.close()
+            raise
+
+    def close(self) -> None:
+        try:
+            self._summary.close()
+        finally:
+            self._history.close()
 
     def add_entry(self, entry: SummaryEntry) -> None:
-        line = f'"{entry.stored_path}","{entry.course_name}","{entry.category_name}","{entry.entry_name}","{entry.file_name}","{entry.status}","{entry.detail}"\n'
-        self._write(line)
-        self._entries.append(entry)
+        self._summary.add_entry(entry)
+        self._history.add_entry(entry)
 
     def format_summary(self) -> str:
-        total = len(self._entries)
-        counts = {}
-        for entry in self._entries:
-            counts[entry.status] = counts.get(entry.status, 0) + 1
-        ret = f"Total updated files: {total}."
-        if total == 0:
-            ret += " No files were updated.\n"
-        else:
-            ret += " Details: " + ", ".join(f"{status}: {count}" for status, count in counts.items())
-            ret += "\nUpdated files:\n"
-            for entry in self._entries:
-                ret += f"- [{entry.status}] {entry.stored_path}\n"
-        ret += f"Summary file has been saved to: {self._file_path}"
-        return ret
+        return self._summary.format_summary()
+
+
+_SUMMARY_WRITERS: dict[str, type[SummaryWriter]] = {
+    "csv": _SummaryWriterCSV,
+    "jsonl": _SummaryWriterJSONL,
+    "sqlite": _SummaryWriterSQLite,
+}
 
 
 class SummaryManager:
     _expire_days: int
+    # records of the sync history are kept forever if None
+    _history_expire_days: int | None
     _summary_dir: Path
     _summary_prefix: str
+    _summary_format: str
+    # whether to write a summary, and whether to record the history whatever the summary format
+    _summary_enabled: bool
+    _history_enabled: bool
     _writer: SummaryWriter | None
 
-    def __init__(self, expire_days: int, summary_dir: Path, summary_prefix: str = "autumoodle_summary_") -> None:
+    def __init__(self, expire_days: int, summary_dir: Path, summary_prefix: str = "autumoodle_summary_",
+                 summary_format: str = "csv", history_expire_days: int | None = None,
+                 summary_enabled: bool = True, history_enabled: bool = False) -> None:
+        if summary_format not in _SUMMARY_WRITERS:
+            raise ValueError(f"Unknown summary format: {summary_format}")
         self._expire_days = expire_days
+        self._history_expire_days = history_expire_days
         self._summary_dir = summary_dir
         self._summary_prefix = summary_prefix
+        self._summary_format = summary_format
+        self._summary_enabled = summary_enabled
+        self._history_enabled = history_enabled
         self._writer = None
         self.clear_old_summaries()
 
+    def _writes_history(self) -> bool:
+        return self._history_enabled or (self._summary_enabled and self._summary_format == "sqlite")
+
     def clear_old_summaries(self) -> None:
+        if self._writes_history():
+            from .history import HistoryStore, HISTORY_FILENAME
+            # History records are expired by age inside the database, separately from summary files
+            history_path = self._summary_dir / HISTORY_FILENAME
+            if self._history_expire_days is not None and history_path.exists():
+                try:
+                    with HistoryStore(history_path) as store:
+                        store.purge(self._history_expire_days)
+                except Exception as e:
+                    Logger.w("SummaryManager", f"Failed to purge old history records: {e}")
+        if not self._summary_enabled or self._summary_format == "sqlite":
+            return
         curr_time = time.time()
         for file in self._summary_dir.glob(f"{self._summary_prefix}*"):
             try:
@@ -137,14 +324,24 @@ class SummaryManager:
     def __enter__(self) -> SummaryWriter:
         if self._writer:
             raise RuntimeError("SummaryManager is already in use")
-        self._writer = _SummaryWriterCSV(self._summary_dir, self._summary_prefix)
-        Logger.i("SummaryManager", f"Creating new summary file at: {self._writer.get_filepath()}")
+        summary = _SUMMARY_WRITERS[self._summary_format](self._summary_dir, self._summary_prefix) if self._summary_enabled else None
+        if self._writes_history() and not isinstance(summary, _SummaryWriterSQLite):
+            # The sqlite summary is the history itself
+            history = _SummaryWriterSQLite(self._summary_dir, self._summary_prefix)
+            Logger.i("SummaryManager", f"Recording history in: {history.get_filepath()}")
+            self._writer = _SummaryWriterWithHistory(summary, history) if summary else history
+        else:
+            assert summary
+            self._writer = summary
+        if summary:
+            Logger.i("SummaryManager", f"Writing summary to: {summary.get_filepath()}")
         self._writer.open()
         return self._writer
 
     def __exit__(self, exc_type, exc_value, traceback) -> None:
         Logger.d("SummaryManager", "Exiting SummaryManager context")
         if self._writer:
-            print(self._writer.format_summary())
+            if self._summary_enabled:
+                print(self._writer.format_summary())
             self._writer.close()
         self._writer = None
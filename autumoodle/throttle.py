@@ -0,0 +1,147 @@
+'''
+Author: Uyanide pywang0608@foxmail.com
+Date: 2026-10-19 01:19:18
+LastEditTime: 2026-10-19 02:28:10
+Description: Bandwidth and request rate limiting shared by all sessions, with time-of-day schedules
+'''
+
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable
+import asyncio
+import time
+
+
+def _parse_time_of_day(value: str) -> int:
+    '''Parse "HH:MM" into minutes since midnight.'''
+    try:
+        hours, minutes = value.split(":")
+        result = int(hours) * 60 + int(minutes)
+    except ValueError:
+        raise ValueError(f"Invalid time of day: {value}, expected HH:MM")
+    if not 0 <= result <= 24 * 60:
+        raise ValueError(f"Invalid time of day: {value}, expected HH:MM")
+    return result
+
+
+@dataclass(frozen=True, slots=True)
+class ThrottleWindow:
+    start: int  # minutes since midnight
+    end: int    # minutes since midnight, may be smaller than start for windows over midnight
+    bandwidth: float | None  # in KiB/s, None to use the default
+    requests_per_second: float | None  # None to use the default
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        if "from" not in data or "to" not in data:
+            raise ValueError("throttle schedule entry requires 'from' and 'to' fields")
+        return cls(
+            start=_parse_time_of_day(data["from"]),
+            end=_parse_time_of_day(data["to"]),
+            bandwidth=data.get("bandwidth"),
+            requests_per_second=data.get("requests_per_second"),
+        )
+
+    def contains(self, minute: int) -> bool:
+        if self.start <= self.end:
+            return self.start <= minute < self.end
+        return minute >= self.start or minute < self.end
+
+
+class TokenBucket:
+    '''
+    Token bucket shared by all concurrent consumers, holding at most one second worth of tokens.
+    The rate is queried on every acquisition, so that it may change over the day.
+    '''
+    _rate_func: Callable[[], float]
+    _tokens: float | None
+    _last: float
+    _lock: asyncio.Lock | None
+
+    def __init__(self, rate_func: Callable[[], float]):
+        self._rate_func = rate_func  # tokens per second, <= 0 for unlimited
+        self._tokens = None
+        self._last = time.monotonic()
+        self._lock = None
+
+    def limited(self) -> bool:
+        return self._rate_func() > 0
+
+    async def acquire(self, amount: float = 1) -> None:
+        if not self.limited():
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # Consumers are served one after another in FIFO order
+        async with self._lock:
+            while True:
+                rate = self._rate_func()
+                if rate <= 0:
+                    return
+                now = time.monotonic()
+                if self._tokens is None:
+                    self._tokens = rate
+                else:
+                    self._tokens = min(rate, self._tokens + (now - self._last) * rate)
+                self._last = now
+                # Amounts larger than the capacity are granted once the bucket is full,
+                # the debt is then paid off by the following consumers
+                needed = min(amount, rate)
+                if self._tokens >= needed:
+                    self._tokens -= amount
+                    return
+                await asyncio.sleep((needed - self._tokens) / rate)
+
+
+class Throttle:
+    '''Limits the total download bandwidth and the rate of page requests of all sessions.'''
+    _bandwidth: float
+    _requests_per_second: float
+    _schedule: list[ThrottleWindow]
+    _active_downloads: int
+    bandwidth: TokenBucket  # in bytes
+    requests: TokenBucket
+
+    def __init__(self, bandwidth: float, requests_per_second: float, schedule: list[ThrottleWindow]):
+        self._bandwidth = bandwidth
+        self._requests_per_second = requests_per_second
+        self._schedule = schedule
+        self._active_downloads = 0
+        self.bandwidth = TokenBucket(lambda: self.current_bandwidth() * 1024)
+        self.requests = TokenBucket(self.current_requests_per_second)
+
+    def _current_window(self) -> ThrottleWindow | None:
+        if not self._schedule:
+            return None
+        now = time.localtime()
+        minute = now.tm_hour * 60 + now.tm_min
+        for window in self._schedule:
+            if window.contains(minute):
+                return window
+        return None
+
+    def current_bandwidth(self) -> float:
+        '''Current bandwidth limit in KiB/s, 0 for unlimited.'''
+        window = self._current_window()
+        if window and window.bandwidth is not None:
+            return window.bandwidth
+        return self._bandwidth
+
+    def current_requests_per_second(self) -> float:
+        window = self._current_window()
+        if window and window.requests_per_second is not None:
+            return window.requests_per_second
+        return self._requests_per_second
+
+    @property
+    def active_downloads(self) -> int:
+        return self._active_downloads
+
+    @contextmanager
+    def download(self):
+        '''Track a running download, for sessions that can only split the bandwidth evenly.'''
+        self._active_downloads += 1
+        try:
+            yield
+        finally:
+            self._active_downloads -= 1
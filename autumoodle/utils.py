@@ -1,15 +1,14 @@
 '''
 Author: Uyanide pywang0608@foxmail.com
 Date: 2025-10-29 22:08:19
-LastEditTime: 2025-10-31 13:56:34
+LastEditTime: 2026-10-19 02:01:21
 Description: Utility functions and classes for autumoodle
 '''
 
 import re
-import tempfile
 from pathlib import Path
 from enum import Enum
-from functools import partial
+from functools import lru_cache, partial
 from typing import Callable
 import unicodedata
 
@@ -22,6 +21,37 @@ def passthrough(whatever):
     return whatever
 
 
+# Applied to UTF-8, in which these never occur as part of a multi-byte sequence.
+# str.translate would look up every character in a dict, bytes.translate uses a flat table.
+_CONTROL_CHARS = bytes([*range(0x20), 0x7F])
+_RISKY_CHARS = b'<>:"|*'
+_SEPARATORS = b"/\\"
+_REPLACE_QUESTION_MARK = bytes.maketrans(b"?", b"_")
+_RISKY_CHARS_AND_SEPARATORS_SET = frozenset((_RISKY_CHARS + _SEPARATORS + b"?").decode())
+
+
+def _delete_bytes(filename: str, delete: bytes, table: bytes | None = None) -> str:
+    return filename.encode("utf-8", "surrogatepass").translate(table, delete).decode("utf-8", "surrogatepass")
+
+
+# The same category and entry titles are sanitized for every filter and again in every run of a daemon
+@lru_cache(maxsize=8192)
+def _sanitize_filename(filename: str, allow_separators: bool) -> str:
+    # NFKC leaves ASCII as it is
+    if not filename.isascii():
+        filename = unicodedata.normalize("NFKC", filename)
+
+    # Control characters, which are not printable
+    if not filename.isprintable():
+        filename = _delete_bytes(filename, _CONTROL_CHARS)
+    filename = filename.strip()
+
+    # Path separators and other risky chars, which most titles have none of
+    if _RISKY_CHARS_AND_SEPARATORS_SET.isdisjoint(filename):
+        return filename
+    return _delete_bytes(filename, _RISKY_CHARS if allow_separators else _RISKY_CHARS + _SEPARATORS, _REPLACE_QUESTION_MARK)
+
+
 def sanitize_filename(filename: str | Path, allow_separators: bool = False) -> str:
     """Sanitize a filename"""
     if not filename:
@@ -30,20 +60,7 @@ def sanitize_filename(filename: str | Path, allow_separators: bool = False) -> s
     if not isinstance(filename, str):
         filename = str(filename)
 
-    # Control characters
-    filename = unicodedata.normalize("NFKC", filename)
-    filename = re.sub(r"[\x00-\x1F\x7F]", "", filename)
-    filename = filename.strip()
-
-    # Path separators
-    if not allow_separators:
-        filename = filename.replace("/", "").replace("\\", "")
-
-    # Other risky chars
-    filename = re.sub(r'[<>:"|*]', "", filename)
-    filename = re.sub(r'[?]', "_", filename)
-
-    return filename
+    return _sanitize_filename(filename, allow_separators)
 
 
 def parse_semester(semester: str) -> tuple[bool, int]:
@@ -65,6 +82,7 @@ def parse_semester(semester: str) -> tuple[bool, int]:
 #     with tempfile.TemporaryDirectory(prefix=prefix) as d:
 #         yield Path(d)
 def create_temp_dir(prefix: str = "autumoodle_") -> Path:
+    import tempfile
     d = tempfile.mkdtemp(prefix=prefix)
     return Path(d)
 
@@ -74,6 +92,7 @@ def create_temp_dir(prefix: str = "autumoodle_") -> Path:
 #     with tempfile.NamedTemporaryFile(suffix=suffix, prefix=prefix) as f:
 #         yield Path(f.name)
 def create_temp_file(suffix: str = "", prefix: str = "autumoodle_") -> Path:
+    import tempfile
     f = tempfile.NamedTemporaryFile(suffix=suffix, prefix=prefix, delete=False)
     f.close()
     return Path(f.name)
@@ -0,0 +1,287 @@
+'''
+Author: Uyanide pywang0608@foxmail.com
+Date: 2026-10-19 01:47:57
+LastEditTime: 2026-10-19 02:29:44
+Description: Store of previous versions of files, deduplicated in content-defined chunks and compressed
+'''
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Iterator
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+from .log import Logger
+from .journal import write_atomically
+
+
+VERSIONS_FILENAME = "versions.sqlite3"
+
+# Bump this and add a migration in _init_schema when the schema changes
+SCHEMA_VERSION = 1
+
+# Chunk boundaries depend on the content only, so that an edit in the middle of a file
+# leaves the chunks before and after it unchanged. A boundary follows any of a few fixed
+# byte pairs, which the regex engine finds much faster than a rolling hash in Python could.
+MIN_CHUNK_SIZE = 2 * 1024
+MAX_CHUNK_SIZE = 64 * 1024
+# 8 of the 65536 byte pairs, i.e. 8 KiB chunks on average for compressed data such as most of a PDF.
+# Changing them changes all chunk boundaries, and with that the deduplication against stored versions.
+_BOUNDARY_PAIRS = [hashlib.sha256(b"autumoodle%d" % i).digest()[:2] for i in range(8)]
+_BOUNDARY = re.compile(b"|".join(re.escape(pair) for pair in _BOUNDARY_PAIRS))
+
+READ_SIZE = 1024 * 1024
+# Chunks are only stored compressed if that saves at least this fraction, PDFs are mostly compressed already
+MIN_COMPRESSION_SAVING = 0.05
+
+
+def _cut(data: bytearray, start: int, end: int) -> int:
+    '''Position of the first chunk boundary in data[start:end], or end if there is none.'''
+    # The first bytes of a chunk are not searched, which bounds the chunk size from below
+    match = _BOUNDARY.search(data, start + MIN_CHUNK_SIZE, end)
+    return match.end() if match else end
+
+
+def iter_chunks(f: BinaryIO) -> Iterator[bytes]:
+    '''Split the content of a file into chunks of MIN_CHUNK_SIZE to MAX_CHUNK_SIZE bytes at content-defined boundaries.'''
+    buffer = bytearray()
+    eof = False
+    while True:
+        while not eof and len(buffer) < MAX_CHUNK_SIZE:
+            data = f.read(READ_SIZE)
+            if not data:
+                eof = True
+            buffer += data
+        if not buffer:
+            return
+        position = 0
+        # Cut as long as a whole chunk of maximum size fits, the rest waits for more data
+        while len(buffer) - position >= MAX_CHUNK_SIZE or (eof and position < len(buffer)):
+            end = _cut(buffer, position, min(position + MAX_CHUNK_SIZE, len(buffer)))
+            yield bytes(buffer[position:end])
+            position = end
+        del buffer[:position]
+
+
+@dataclass(frozen=True, slots=True)
+class VersionRecord:
+    id: int
+    path: str
+    mtime: float
+    size: int
+    archived_at: float
+    sha256: str
+
+
+class VersionStore:
+    '''
+    Previous versions of files in a single SQLite database. Each version is a list of chunks, and each
+    distinct chunk is stored only once, so versions that differ in a few places take little space.
+    Versions beyond the retention limits are deleted by prune(), along with the chunks only they used.
+    '''
+    _path: Path
+    _conn: sqlite3.Connection | None
+    _lock: threading.Lock
+    # None for no limit
+    _max_versions: int | None
+    _expire_days: int | None
+
+    def __init__(self, path: Path, max_versions: int | None = None, expire_days: int | None = None):
+        self._path = path
+        self._conn = None
+        self._lock = threading.Lock()
+        self._max_versions = max_versions
+        self._expire_days = expire_days
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def open(self) -> None:
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        # Files may be stored from other threads, access is serialized by the lock
+        self._conn = sqlite3.connect(self._path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._init_schema()
+
+    def close(self) -> None:
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
+    def __enter__(self) -> "VersionStore":
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def _connection(self) -> sqlite3.Connection:
+        # Opened on first use, most runs do not archive anything
+        if not self._conn:
+            self.open()
+        assert self._conn
+        return self._conn
+
+    def _init_schema(self) -> None:
+        conn = self._conn
+        assert conn
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version > SCHEMA_VERSION:
+            raise RuntimeError(f"Version store {self._path} was created by a newer version (schema {version})")
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS chunks (
+                    hash TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    compressed INTEGER NOT NULL,
+                    data BLOB NOT NULL
+                )""")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS versions (
+                    id INTEGER PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    mtime REAL NOT NULL,
+                    size INTEGER NOT NULL,
+                    archived_at REAL NOT NULL,
+                    sha256 TEXT NOT NULL
+                )""")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS version_chunks (
+                    version_id INTEGER NOT NULL REFERENCES versions (id),
+                    seq INTEGER NOT NULL,
+                    hash TEXT NOT NULL REFERENCES chunks (hash),
+                    PRIMARY KEY (version_id, seq)
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_versions_path ON versions (path, archived_at)")
+            # Finds the chunks still referenced when pruning
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_version_chunks_hash ON version_chunks (hash)")
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def archive(self, path: Path) -> int:
+        '''Store the current content of the file as a version, returns the id of the version.'''
+        stat = path.stat()
+        file_hash = hashlib.sha256()
+        new_chunks = 0
+        with self._lock:
+            conn = self._connection()
+            # All or nothing, a version is never stored with chunks missing
+            with conn, open(path, "rb") as f:
+                cursor = conn.execute(
+                    "INSERT INTO versions (path, mtime, size, archived_at, sha256) VALUES (?, ?, ?, ?, '')",
+                    (str(path), stat.st_mtime, stat.st_size, time.time()))
+                version_id = cursor.lastrowid
+                assert version_id is not None
+                for seq, chunk in enumerate(iter_chunks(f)):
+                    file_hash.update(chunk)
+                    digest = hashlib.sha256(chunk).hexdigest()
+                    if not conn.execute("SELECT 1 FROM chunks WHERE hash = ?", (digest,)).fetchone():
+                        compressed = zlib.compress(chunk, 6)
+                        use_compressed = len(compressed) <= len(chunk) * (1 - MIN_COMPRESSION_SAVING)
+                        conn.execute("INSERT INTO chunks (hash, size, compressed, data) VALUES (?, ?, ?, ?)",
+                                     (digest, len(chunk), int(use_compressed), compressed if use_compressed else chunk))
+                        new_chunks += 1
+                    conn.execute("INSERT INTO version_chunks (version_id, seq, hash) VALUES (?, ?, ?)",
+                                 (version_id, seq, digest))
+                conn.execute("UPDATE versions SET sha256 = ? WHERE id = ?", (file_hash.hexdigest(), version_id))
+        Logger.d("VersionStore", f"Archived {path} as version {version_id} ({new_chunks} new chunks)")
+        return version_id
+
+    def prune(self) -> int:
+        '''
+        Delete the versions of each file beyond the newest max_versions, and those archived more than
+        expire_days ago, then the chunks no longer used by any version. Returns the number of deleted versions.
+        '''
+        if self._max_versions is None and self._expire_days is None:
+            return 0
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute("CREATE TEMP TABLE IF NOT EXISTS pruned (id INTEGER PRIMARY KEY)")
+                conn.execute("DELETE FROM pruned")
+                if self._max_versions is not None:
+                    conn.execute("""
+                        INSERT OR IGNORE INTO pruned (id)
+                        SELECT id FROM (
+                            SELECT id, ROW_NUMBER() OVER (PARTITION BY path ORDER BY archived_at DESC, id DESC) AS newer
+                            FROM versions
+                        ) WHERE newer > ?""", (self._max_versions,))
+                if self._expire_days is not None:
+                    conn.execute("INSERT OR IGNORE INTO pruned (id) SELECT id FROM versions WHERE archived_at < ?",
+                                 (time.time() - self._expire_days * 86400,))
+                deleted = conn.execute("SELECT COUNT(*) FROM pruned").fetchone()[0]
+                if not deleted:
+                    return 0
+                conn.execute("DELETE FROM version_chunks WHERE version_id IN (SELECT id FROM pruned)")
+                conn.execute("DELETE FROM versions WHERE id IN (SELECT id FROM pruned)")
+                # The space of deleted chunks is reused by later ones rather than returned to the file system
+                chunks = conn.execute(
+                    "DELETE FROM chunks WHERE NOT EXISTS (SELECT 1 FROM version_chunks v WHERE v.hash = chunks.hash)").rowcount
+        Logger.d("VersionStore", f"Pruned {deleted} versions and {chunks} chunks no longer used")
+        return deleted
+
+    def query(self, path: str | None = None, limit: int | None = None) -> list[VersionRecord]:
+        '''Versions whose path contains the given substring, newest first.'''
+        sql = "SELECT id, path, mtime, size, archived_at, sha256 FROM versions"
+        params: list = []
+        if path:
+            sql += " WHERE path LIKE ?"
+            params.append(f"%{path}%")
+        sql += " ORDER BY archived_at DESC, id DESC"
+        if limit is not None and limit > 0:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            return [VersionRecord(*row) for row in self._connection().execute(sql, params)]
+
+    def get(self, version_id: int) -> VersionRecord | None:
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT id, path, mtime, size, archived_at, sha256 FROM versions WHERE id = ?", (version_id,)).fetchone()
+        return VersionRecord(*row) if row else None
+
+    def stats(self) -> tuple[int, int, int]:
+        '''Returns (number of versions, total size of all versions, size actually stored) in bytes.'''
+        with self._lock:
+            conn = self._connection()
+            count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM versions").fetchone()
+            stored = conn.execute("SELECT COALESCE(SUM(LENGTH(data)), 0) FROM chunks").fetchone()[0]
+        return count, total, stored
+
+    def _write_version(self, version: VersionRecord, dest: Path) -> None:
+        file_hash = hashlib.sha256()
+        with self._lock, open(dest, "wb") as f:
+            rows = self._connection().execute(
+                "SELECT c.compressed, c.data FROM version_chunks v JOIN chunks c ON c.hash = v.hash "
+                "WHERE v.version_id = ? ORDER BY v.seq", (version.id,))
+            for compressed, data in rows:
+                chunk = zlib.decompress(data) if compressed else data
+                file_hash.update(chunk)
+                f.write(chunk)
+        if file_hash.hexdigest() != version.sha256:
+            raise RuntimeError(f"Version {version.id} is corrupted, its content does not match the recorded checksum")
+
+    def restore(self, version_id: int, dest: Path) -> Path:
+        '''Write the given version to dest, with its original modification time.'''
+        version = self.get(version_id)
+        if version is None:
+            raise KeyError(f"No version with id {version_id}")
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        return write_atomically(dest, lambda temp_path: self._write_version(version, temp_path), version.mtime)
+
+
+def default_restore_path(version: VersionRecord) -> Path:
+    '''Next to the current version, e.g. "slides.v12.pdf" for version 12 of "slides.pdf".'''
+    path = Path(version.path)
+    return path.with_name(f"{path.stem}.v{version.id}{path.suffix}")
+
+
+def format_version(version: VersionRecord) -> str:
+    archived_at = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(version.archived_at))
+    modified_at = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(version.mtime))
+    return f"#{version.id:<6} {archived_at}  modified {modified_at}  {version.size:>10} B  {version.path}"
+
@@ -1,21 +1,63 @@
 '''
 Author: Uyanide pywang0608@foxmail.com
 Date: 2025-10-29 22:08:19
-LastEditTime: 2025-11-06 10:21:01
-Description: Extract files from zip archives based on configuration
+LastEditTime: 2026-10-19 02:10:16
+Description: Extract files from zip archives, or store single downloaded files, based on configuration
 '''
 
 from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
-import shutil
+import errno
+import mmap
 import os
-from zipfile import ZipFile
+import shutil
+import threading
+import zlib
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import nullcontext
+from typing import BinaryIO, Callable, Iterator
+import multiprocessing
+from zipfile import ZipFile, ZipInfo, BadZipFile, ZIP_STORED
 from functools import partial
 
 from .config_mgr import UpdateType, FileConfig
-from .utils import create_temp_dir, PatternMatcher
+from .utils import PatternMatcher
 from .summary import SummaryWriter, SummaryEntry
+from .journal import Journal, temp_path_for, write_atomically
+from .fs_index import FSIndex
+from .versions import VersionStore
+from . import metrics
+
+
+EXTRACT_CHUNK_SIZE = 1024 * 1024
+
+# Local file header: signature, ..., file name length at 26, extra field length at 28, 30 bytes in total
+_LOCAL_HEADER_SIZE = 30
+_LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+# Errors of copy_file_range and sendfile telling that the files at hand cannot be copied that way
+_KERNEL_COPY_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF}
+
+
+# Archives with fewer members to extract than this are extracted in this process, even with several workers
+PARALLEL_MIN_MEMBERS = 64
+# Members are handed to the extraction processes in batches, several per worker for balancing the load
+BATCHES_PER_WORKER = 4
+MAX_BATCH_BYTES = 64 * 1024 * 1024
+
+
+@dataclass(frozen=True, slots=True)
+class ExtractOptions:
+    # copy stored members within the kernel instead of through Python
+    zero_copy: bool = True
+    # number of processes extracting members of an archive at the same time, 1 to extract in this process
+    workers: int = 1
+
+
+# by number of workers, archives of all courses are extracted in threads at the same time,
+# so a pool of another size is never shut down while another thread may be submitting to it
+_process_pools: dict[int, ProcessPoolExecutor] = {}
+_process_pools_lock = threading.Lock()
 
 
 @dataclass(frozen=True, slots=True)
@@ -27,7 +69,7 @@ class EntryDownloadConfig:
     update_type: UpdateType
 
 
-def _find_matching_config(category: str, entry: str, _file_download_configs: list[EntryDownloadConfig]) -> EntryDownloadConfig | None:
+def find_matching_config(category: str, entry: str, _file_download_configs: list[EntryDownloadConfig]) -> EntryDownloadConfig | None:
     for config in _file_download_configs:
         if config.category_matcher and not config.category_matcher.match(category):
             continue
@@ -52,10 +94,141 @@ def _check_ignored(fullpath: Path, ignored_files: list[PatternMatcher]) -> bool:
     return False
 
 
-def _copy_with_timestamp(src: Path, dest: Path, timestamp: float | None = None):
-    shutil.copy2(src, dest)
-    if timestamp is not None:
-        os.utime(dest, (timestamp, timestamp))
+def _extract_member(zip_ref: ZipFile, zip_info: ZipInfo, dest: Path):
+    # Streamed to the destination instead of through a temp directory holding the whole archive
+    with zip_ref.open(zip_info) as src, open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst, EXTRACT_CHUNK_SIZE)
+
+
+def _copy_range(src_fd: int, dst_fd: int, offset: int, count: int) -> None:
+    '''Copy count bytes at offset of src_fd to the current position of dst_fd, within the kernel where supported.'''
+    use_copy_file_range = hasattr(os, "copy_file_range")
+    use_sendfile = hasattr(os, "sendfile")
+    end = offset + count
+    while offset < end:
+        copied = None
+        if use_copy_file_range:
+            try:
+                copied = os.copy_file_range(src_fd, dst_fd, end - offset, offset)
+            except OSError as e:
+                if e.errno not in _KERNEL_COPY_UNSUPPORTED:
+                    raise
+                use_copy_file_range = False
+        if copied is None and use_sendfile:
+            try:
+                # Files as the destination only since Linux 2.6.33
+                copied = os.sendfile(dst_fd, src_fd, offset, end - offset)
+            except OSError as e:
+                if e.errno not in _KERNEL_COPY_UNSUPPORTED:
+                    raise
+                use_sendfile = False
+        if copied is None:
+            data = os.pread(src_fd, min(end - offset, EXTRACT_CHUNK_SIZE), offset)
+            copied = os.write(dst_fd, data)
+        if copied == 0:
+            raise BadZipFile(f"Unexpected end of archive at offset {offset}")
+        offset += copied
+
+
+class _RawArchive:
+    '''
+    Direct access to the bytes of stored (i.e. uncompressed) members of an archive, which are copied to their
+    destination as they are. The archive is mapped into memory for checking the CRC without copying it.
+    '''
+    _file: BinaryIO
+    _mmap: mmap.mmap
+
+    def __init__(self, zip_path: Path):
+        self._file = open(zip_path, "rb")
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if hasattr(mmap, "MADV_SEQUENTIAL"):
+                # Members are read front to back once, read ahead more and drop pages behind
+                self._mmap.madvise(mmap.MADV_SEQUENTIAL)
+        except BaseException:
+            self._file.close()
+            raise
+
+    def close(self) -> None:
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self) -> "_RawArchive":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    @staticmethod
+    def supports(zip_info: ZipInfo) -> bool:
+        # Encrypted members would have to be decrypted
+        return zip_info.compress_type == ZIP_STORED and not zip_info.flag_bits & 0x1 \
+            and zip_info.compress_size == zip_info.file_size
+
+    def _data_offset(self, zip_info: ZipInfo) -> int:
+        header_offset = zip_info.header_offset
+        header = self._mmap[header_offset:header_offset + _LOCAL_HEADER_SIZE]
+        if len(header) != _LOCAL_HEADER_SIZE or header[:4] != _LOCAL_HEADER_SIGNATURE:
+            raise BadZipFile(f"Bad local file header of {zip_info.filename!r}")
+        # The lengths in the local header may differ from those in the central directory
+        name_length = int.from_bytes(header[26:28], "little")
+        extra_length = int.from_bytes(header[28:30], "little")
+        return header_offset + _LOCAL_HEADER_SIZE + name_length + extra_length
+
+    def extract(self, zip_info: ZipInfo, dest: Path) -> None:
+        start = self._data_offset(zip_info)
+        end = start + zip_info.file_size
+        if end > len(self._mmap):
+            raise BadZipFile(f"Member {zip_info.filename!r} extends beyond the end of the archive")
+        with memoryview(self._mmap) as view, view[start:end] as data:
+            crc = zlib.crc32(data)
+        if crc != zip_info.CRC:
+            raise BadZipFile(f"Bad CRC-32 for file {zip_info.filename!r}")
+        with open(dest, "wb") as dst:
+            _copy_range(self._file.fileno(), dst.fileno(), start, zip_info.file_size)
+
+
+def _get_process_pool(workers: int) -> ProcessPoolExecutor:
+    with _process_pools_lock:
+        pool = _process_pools.get(workers)
+        if pool is None:
+            # Forking a process with running threads (e.g. the writer threads) may deadlock the child
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _process_pools[workers] = pool
+        return pool
+
+
+def shutdown_process_pool() -> None:
+    '''Shut down the worker processes, once no archive is being extracted anymore.'''
+    with _process_pools_lock:
+        pools = list(_process_pools.values())
+        _process_pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _extract_batch(zip_path: str, zero_copy: bool, tasks: list[tuple[int, str]]) -> list[Exception | None]:
+    '''
+    Run in an extraction process: extract the members at the given header offsets to the given paths.
+    Returns the error of each member, None if it has been extracted.
+    '''
+    results: list[Exception | None] = []
+    with ZipFile(zip_path, 'r') as zip_ref, \
+            (_RawArchive(Path(zip_path)) if zero_copy and hasattr(os, "pread") else nullcontext()) as raw_archive:
+        # Names may be duplicated, offsets may not
+        members = {zip_info.header_offset: zip_info for zip_info in zip_ref.infolist()}
+        for header_offset, path in tasks:
+            zip_info = members[header_offset]
+            try:
+                if raw_archive and _RawArchive.supports(zip_info):
+                    raw_archive.extract(zip_info, Path(path))
+                else:
+                    _extract_member(zip_ref, zip_info, Path(path))
+                results.append(None)
+            except Exception as e:
+                Path(path).unlink(missing_ok=True)
+                results.append(e)
+    return results
 
 
 def _find_latest_modification_time(target: Path):
@@ -82,17 +255,18 @@ def _summary_entry(course_name: str, category_name: str, entry_name: str, file_n
     )
 
 
-def _extract_overwrite(destination: Path, entry_func, extract_func):
+def _extract_overwrite(destination: Path, entry_func, extract_func, exists: Callable[[Path], bool] = Path.exists):
+    existed = exists(destination)
     extract_func(dest=destination)
     return entry_func(
         file_name=destination.name,
         stored_path=str(destination),
-        status="overwritten" if destination.exists() else "added",
+        status="overwritten" if existed else "added",
     )
 
 
-def _extract_skip(destination: Path, entry_func, extract_func):
-    if destination.exists():
+def _extract_skip(destination: Path, entry_func, extract_func, exists: Callable[[Path], bool] = Path.exists):
+    if exists(destination):
         return None
     extract_func(dest=destination)
     return entry_func(
@@ -102,110 +276,263 @@ def _extract_skip(destination: Path, entry_func, extract_func):
     )
 
 
-def _extract_rename(destination: Path, entry_func, extract_func):
-    final_path = Path(destination)
-    counter = 1
-    while final_path.exists():
-        final_path = destination.with_name(
-            f"{destination.stem}_{counter}{destination.suffix}")
-        counter += 1
-    extract_func(dest=final_path)
+def _extract_rename(destination: Path, entry_func, extract_func, exists: Callable[[Path], bool] = Path.exists):
+    # The first free name is taken when the file is moved into place, not probed beforehand
+    final_path = extract_func(dest=destination, no_clobber=True)
+    renamed = final_path != destination
     return entry_func(
         file_name=final_path.name,
         stored_path=str(final_path),
-        status="renamed" if counter > 1 else "added",
-        detail=f"renamed from {destination.name}" if counter > 1 else ""
+        status="renamed" if renamed else "added",
+        detail=f"renamed from {destination.name}" if renamed else ""
+    )
+
+
+def _extract_version(destination: Path, entry_func, extract_func, versions: VersionStore, exists: Callable[[Path], bool] = Path.exists):
+    version_id = None
+    if exists(destination):
+        # Archived before being replaced, the destination keeps only the latest content
+        version_id = versions.archive(destination)
+    extract_func(dest=destination)
+    return entry_func(
+        file_name=destination.name,
+        stored_path=str(destination),
+        status="versioned" if version_id is not None else "added",
+        detail=f"previous version archived as #{version_id}" if version_id is not None else ""
     )
 
 
+@dataclass(frozen=True, slots=True)
+class FileRoute:
+    category_name: str
+    entry_name: str
+    destination_path: Path
+    update_type: UpdateType
+
+
+def route_file(name: str,
+               destination_base: Path,
+               file_download_configs: list[EntryDownloadConfig],
+               ignored_files: list[PatternMatcher],
+               file_configs: list[FileConfig]) -> FileRoute | None:
+    '''
+    Determine where and how to store a file named like a member of a download center archive,
+    i.e. "category/entry[.ext]" or "category/entry/...". Returns None if it is not to be stored.
+    '''
+    normalized_name = name.replace("\\", "/").lstrip("/")
+    # Get category and entry names
+    splitted = normalized_name.split("/")
+    if len(splitted) < 2:
+        return None
+    category_name = splitted[0]
+    entry_name = splitted[1]
+    # Find matching config
+    entry_config = find_matching_config(category_name, entry_name, file_download_configs)
+    if entry_config is None:
+        # Try without extension name
+        # But directories should not have extensions
+        if len(splitted) > 2:
+            return None
+        entry_name = Path(entry_name).stem
+        entry_config = find_matching_config(category_name, entry_name, file_download_configs)
+
+    if entry_config is None:
+        return None
+
+    # Get configuration values
+    destination_path = entry_config.directory / normalized_name.split("/", 1)[1]
+    update_type = entry_config.update_type
+
+    # Check the file is to be ignored
+    if ignored_files and _check_ignored(destination_path, ignored_files):
+        return None
+
+    # Check if any FileConfig matches
+    file_config = _find_matching_file_config(destination_path, file_configs)
+    if file_config:
+        if file_config.ignore:
+            return None
+        # Override destination path if specified
+        if file_config.directory is not None:
+            if file_config.directory.is_absolute():
+                destination_path = file_config.directory / destination_path.name
+            else:
+                destination_path = destination_base / file_config.directory / destination_path.name
+        # Override update type if specified
+        if file_config.update_type is not None:
+            update_type = file_config.update_type
+
+    return FileRoute(category_name, entry_name, destination_path, update_type)
+
+
+def is_up_to_date(route: FileRoute, time_modified: float, index: FSIndex | None = None) -> bool:
+    '''Whether the local file (or its latest renamed version) is at least as new as the remote one.'''
+    if index:
+        return index.exists(route.destination_path) and index.latest_mtime(route.destination_path) >= time_modified
+    if not route.destination_path.exists():
+        return False
+    return _find_latest_modification_time(route.destination_path) >= time_modified
+
+
+def store_file(route: FileRoute,
+               time_modified: float,
+               write_func: Callable[[Path], None],
+               course_name: str,
+               summary_writer: SummaryWriter | None,
+               journal: Journal | None = None,
+               index: FSIndex | None = None,
+               versions: VersionStore | None = None):
+    '''
+    Store a file at its route according to the update type, write_func writes its content to the given path.
+    The file is written atomically, and recorded in the journal while in flight and in the index once stored.
+    Previous versions are kept in the version store if the update type is VERSION.
+    '''
+    if index:
+        index.make_dirs(route.destination_path.parent)
+    else:
+        route.destination_path.parent.mkdir(parents=True, exist_ok=True)
+
+    summary_entry_func = partial(_summary_entry, course_name=course_name,
+                                 category_name=route.category_name, entry_name=route.entry_name)
+    extract_func = partial(write_atomically, write_func=write_func, timestamp=time_modified, journal=journal)
+    process_func = None
+
+    if route.update_type == UpdateType.OVERWRITE:
+        process_func = _extract_overwrite
+    elif route.update_type == UpdateType.RENAME:
+        process_func = _extract_rename
+    elif route.update_type == UpdateType.SKIP:
+        process_func = _extract_skip
+    elif route.update_type == UpdateType.VERSION:
+        if versions is None:
+            raise ValueError("Update type 'version' requires a version store")
+        process_func = partial(_extract_version, versions=versions)
+    else:
+        raise ValueError(f"Unknown update type: {route.update_type}")
+
+    if process_func:
+        entry = process_func(destination=route.destination_path,
+                             entry_func=summary_entry_func,
+                             extract_func=extract_func,
+                             exists=index.exists if index else Path.exists)
+        if entry and index:
+            index.add(Path(entry.stored_path))
+        if entry:
+            metrics.FILES.inc(course=course_name, status=entry.status)
+        if entry and summary_writer:
+            summary_writer.add_entry(entry)
+
+
+def _iter_members(zip_ref: ZipFile,
+                  destination_base: Path,
+                  file_download_configs: list[EntryDownloadConfig],
+                  ignored_files: list[PatternMatcher],
+                  file_configs: list[FileConfig]) -> Iterator[tuple[ZipInfo, FileRoute]]:
+    '''Yield the archive members to be extracted one by one, along with where and how to store them.'''
+    for zip_info in zip_ref.infolist():
+        if zip_info.is_dir():
+            continue
+        route = route_file(zip_info.filename, destination_base, file_download_configs, ignored_files, file_configs)
+        if route:
+            yield zip_info, route
+
+
+def _split_batches(plan: list[tuple[ZipInfo, FileRoute, float]], workers: int) -> list[list[tuple[ZipInfo, FileRoute, float]]]:
+    '''Consecutive members in batches of similar count, split further where they hold a lot of data.'''
+    batch_members = max(1, -(-len(plan) // (workers * BATCHES_PER_WORKER)))
+    batches: list[list[tuple[ZipInfo, FileRoute, float]]] = []
+    batch: list[tuple[ZipInfo, FileRoute, float]] = []
+    batch_bytes = 0
+    for item in plan:
+        batch.append(item)
+        batch_bytes += item[0].file_size
+        if len(batch) >= batch_members or batch_bytes >= MAX_BATCH_BYTES:
+            batches.append(batch)
+            batch = []
+            batch_bytes = 0
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _extract_parallel(zip_path: Path,
+                      plan: list[tuple[ZipInfo, FileRoute, float]],
+                      options: ExtractOptions,
+                      store: Callable[[FileRoute, float, Callable[[Path], None]], None],
+                      journal: Journal | None,
+                      index: FSIndex | None):
+    '''
+    Extract the planned members in the extraction processes, each writing its batches to temporary files next
+    to their destinations. They are then stored in archive order as the batches complete, as if extracted here.
+    '''
+    pool = _get_process_pool(options.workers)
+    submitted: list[tuple[list[tuple[ZipInfo, FileRoute, float]], list[tuple[int, str]], Future]] = []
+    try:
+        for batch in _split_batches(plan, options.workers):
+            tasks = []
+            for zip_info, route, _ in batch:
+                if index:
+                    index.make_dirs(route.destination_path.parent)
+                else:
+                    route.destination_path.parent.mkdir(parents=True, exist_ok=True)
+                temp_path = temp_path_for(route.destination_path)
+                # Discarded on recovery should the run not get to storing it
+                if journal:
+                    journal.begin(temp_path, route.destination_path, False)
+                tasks.append((zip_info.header_offset, str(temp_path)))
+            submitted.append((batch, tasks, pool.submit(_extract_batch, str(zip_path), options.zero_copy, tasks)))
+
+        for batch, tasks, future in submitted:
+            for (zip_info, route, zip_mtime), (_, temp_path), error in zip(batch, tasks, future.result()):
+                if error is not None:
+                    raise error
+                store(route, zip_mtime, partial(os.replace, temp_path))
+    finally:
+        for _, tasks, future in submitted:
+            # Batches still being extracted are waited for, so that none of their files are left behind
+            try:
+                future.result()
+            except Exception:
+                pass
+            for _, temp_path in tasks:
+                # Not taken by the update type, or not stored due to an error
+                Path(temp_path).unlink(missing_ok=True)
+                if journal:
+                    journal.done(Path(temp_path))
+
+
 def extract_files(zip_path: Path,
                   course_name: str,
                   destination_base: Path,
                   file_download_configs: list[EntryDownloadConfig],
                   ignored_files: list[PatternMatcher],
                   file_configs: list[FileConfig],
-                  summary_writer: SummaryWriter | None):
-    temp_dir = create_temp_dir(prefix="autumoodle_zip_extract_")
-    try:
-        with ZipFile(zip_path, 'r') as zip_ref:
-            for zip_info in zip_ref.infolist():
-                normalized_name = zip_info.filename.replace("\\", "/").lstrip("/")
-                # Get category and entry names
-                splitted = normalized_name.split("/")
-                if len(splitted) < 2:
-                    continue
-                category_name = splitted[0]
-                entry_name = splitted[1]
-                # Find matching config
-                entry_config = _find_matching_config(category_name, entry_name, file_download_configs)
-                if entry_config is None:
-                    # Try without extension name
-                    # But directories should not have extensions
-                    if len(splitted) > 2:
-                        continue
-                    entry_name = Path(entry_name).stem
-                    entry_config = _find_matching_config(category_name, entry_name, file_download_configs)
-
-                if entry_config is None:
-                    continue
-
-                # Get configuration values
-                destination_path = entry_config.directory / normalized_name.split("/", 1)[1]
-                update_type = entry_config.update_type
-
-                # Check the file is to be ignored
-                if ignored_files and _check_ignored(destination_path, ignored_files):
-                    continue
-
-                # Check if any FileConfig matches
-                file_config = _find_matching_file_config(destination_path, file_configs)
-                if file_config:
-                    if file_config.ignore:
-                        continue
-                    # Override destination path if specified
-                    if file_config.directory is not None:
-                        if file_config.directory.is_absolute():
-                            destination_path = file_config.directory / destination_path.name
-                        else:
-                            destination_path = destination_base / file_config.directory / destination_path.name
-                    # Override update type if specified
-                    if file_config.update_type is not None:
-                        update_type = file_config.update_type
-
-                destination_path.parent.mkdir(parents=True, exist_ok=True)
-
-                # Extract to temp location
-                temp_path = Path(zip_ref.extract(zip_info, temp_dir))
-
-                # Check modification time
-                if destination_path.exists():
-                    local_date = _find_latest_modification_time(destination_path)
+                  summary_writer: SummaryWriter | None,
+                  journal: Journal | None = None,
+                  index: FSIndex | None = None,
+                  versions: VersionStore | None = None,
+                  options: ExtractOptions = ExtractOptions()):
+    with ZipFile(zip_path, 'r') as zip_ref:
+        planned: Iterator[tuple[ZipInfo, FileRoute, float]] = (
+            (zip_info, route, datetime(*zip_info.date_time).timestamp())
+            for zip_info, route in _iter_members(zip_ref, destination_base, file_download_configs, ignored_files, file_configs))
+        # Skip extraction if local file is up-to-date
+        planned = (item for item in planned if not is_up_to_date(item[1], item[2], index))
+
+        if options.workers > 1:
+            plan = list(planned)
+            if len(plan) >= PARALLEL_MIN_MEMBERS:
+                store = partial(store_file, course_name=course_name, summary_writer=summary_writer,
+                                journal=journal, index=index, versions=versions)
+                _extract_parallel(zip_path, plan, options, store, journal, index)
+                return
+            # Too few for the overhead of the processes
+            planned = iter(plan)
+
+        with _RawArchive(zip_path) if options.zero_copy and hasattr(os, "pread") else nullcontext() as raw_archive:
+            for zip_info, route, zip_mtime in planned:
+                if raw_archive and _RawArchive.supports(zip_info):
+                    write_func = partial(raw_archive.extract, zip_info)
                 else:
-                    local_date = 0
-                zip_mtime = datetime(*zip_info.date_time).timestamp()
-                # Skip extraction if local file is up-to-date
-                if local_date >= zip_mtime:
-                    continue
-
-                summary_entry_func = partial(_summary_entry, course_name=course_name,
-                                             category_name=category_name, entry_name=entry_name)
-                extract_func = partial(_copy_with_timestamp, src=temp_path, timestamp=zip_mtime)
-                process_func = None
-
-                if update_type == UpdateType.OVERWRITE:
-                    process_func = _extract_overwrite
-                elif update_type == UpdateType.RENAME:
-                    process_func = _extract_rename
-                elif update_type == UpdateType.SKIP:
-                    process_func = _extract_skip
-                else:
-                    raise ValueError(f"Unknown update type: {update_type}")
-
-                if process_func:
-                    entry = process_func(destination=destination_path,
-                                         entry_func=summary_entry_func,
-                                         extract_func=extract_func)
-                    if entry and summary_writer:
-                        summary_writer.add_entry(entry)
-    finally:
-        shutil.rmtree(temp_dir)
+                    write_func = partial(_extract_member, zip_ref, zip_info)
+                store_file(route, zip_mtime, write_func, course_name, summary_writer, journal, index, versions)
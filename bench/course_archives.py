@@ -0,0 +1,99 @@
+'''
+Author: Uyanide pywang0608@foxmail.com
+Date: 2026-10-19 02:27:53
+LastEditTime: 2026-10-19 02:27:53
+Description: Synthetic course archives like the ones built by the download center, shared by the extraction benchmarks
+'''
+
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterable, Iterator
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED, ZIP_STORED
+import os
+import random
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from autumoodle.summary import SummaryWriter, SummaryEntry  # noqa: E402
+
+
+# Timestamp of all members unless given otherwise
+DATE_TIME = (2025, 1, 1, 0, 0, 0)
+
+
+@dataclass(frozen=True, slots=True)
+class Member:
+    name: str
+    chunks: Iterable[bytes]  # written one after another, so that large members need not be held in memory
+    compress_type: int = ZIP_STORED
+    date_time: tuple[int, int, int, int, int, int] = DATE_TIME
+
+
+def write_archive(path: Path, members: Iterable[Member]) -> None:
+    with ZipFile(path, "w") as zip_ref:
+        for member in members:
+            zip_info = ZipInfo(member.name, member.date_time)
+            zip_info.compress_type = member.compress_type
+            with zip_ref.open(zip_info, "w") as f:
+                for chunk in member.chunks:
+                    f.write(chunk)
+
+
+def _course_file_name(i: int) -> str:
+    # Sections of 200 files, resources of 4 files each
+    return f"Thema {i // 200}/Ressource {i // 4}/Datei {i}.pdf"
+
+
+def small_files(files: int, modified: int = -1) -> Iterator[Member]:
+    '''Tiny files, the given one modified a day later than the others.'''
+    for i in range(files):
+        yield Member(_course_file_name(i), [b"%PDF" + str(i).encode()],
+                     date_time=(2025, 1, 2, 0, 0, 0) if i == modified else DATE_TIME)
+
+
+def random_files(files: int, seed: int = 0) -> Iterator[Member]:
+    '''Small, poorly compressible files of varying size, compressed.'''
+    rng = random.Random(seed)
+    for i in range(files):
+        yield Member(_course_file_name(i), [rng.randbytes(rng.randint(256, 4096))], ZIP_DEFLATED)
+
+
+def text_files(files: int, size: int, seed: int = 0) -> Iterator[Member]:
+    '''Compressible files of about size bytes, like the source code or text exports in a course, compressed.'''
+    rng = random.Random(seed)
+    words = [bytes(rng.choices(b"abcdefghijklmnopqrstuvwxyz", k=rng.randint(2, 10))) for _ in range(2000)]
+    for i in range(files):
+        yield Member(f"Übungen/Blatt {i // 20}/Datei {i}.txt", [b" ".join(rng.choices(words, k=size // 6))], ZIP_DEFLATED)
+
+
+def large_files(files: int, size_mib: int) -> Iterator[Member]:
+    '''Incompressible files stored as they are, like the videos in a course, plus a compressed text file.'''
+    block = os.urandom(1024 * 1024)
+    for i in range(files):
+        yield Member(f"Aufzeichnungen/Vorlesung {i}.mp4", (block for _ in range(size_mib)))
+    yield Member("Aufzeichnungen/Notizen.txt", [b"Notizen " * 10000], ZIP_DEFLATED)
+
+
+@dataclass
+class CollectingSummaryWriter(SummaryWriter):
+    '''Collects the summary entries in memory, in the order they are added.'''
+    entries: list[SummaryEntry] = field(default_factory=list)
+
+    def get_extname(self) -> str:
+        return ""
+
+    def get_filepath(self) -> Path:
+        return Path()
+
+    def open(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def add_entry(self, entry: SummaryEntry) -> None:
+        self.entries.append(entry)
+
+    def format_summary(self) -> str:
+        return ""
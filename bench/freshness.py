@@ -0,0 +1,66 @@
+'''
+Author: Uyanide pywang0608@foxmail.com
+Date: 2026-10-19 01:44:05
+LastEditTime: 2026-10-19 02:27:53
+Description: Measure the freshness checks of a synced course with and without the index of the destination
+'''
+
+from argparse import ArgumentParser
+from pathlib import Path
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from autumoodle.config_mgr import UpdateType  # noqa: E402
+from autumoodle.fs_index import FSIndex  # noqa: E402
+from autumoodle.zip_extract import EntryDownloadConfig, extract_files  # noqa: E402
+from course_archives import small_files, write_archive  # noqa: E402
+
+
+def _extract(archive: Path, destination: Path, index: FSIndex | None) -> float:
+    '''Returns the time taken in s, including the scan'''
+    configs = [EntryDownloadConfig(None, None, False, destination, UpdateType.RENAME)]
+    start = time.perf_counter()
+    if index:
+        index.scan([destination])
+    extract_files(archive, "Course", destination, configs, [], [], None, index=index)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = ArgumentParser(description="Measure the freshness checks of a synced course with and without the index")
+    parser.add_argument("--files", type=int, default=5000, help="Number of files in the course (default: 5000)")
+    parser.add_argument("--dir", type=Path, help="Directory to sync into, e.g. on a network share (default: a temporary one)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="autumoodle_bench_", dir=args.dir) as temp_dir:
+        archive = Path(temp_dir) / "course.zip"
+        destination = Path(temp_dir) / "course"
+        write_archive(archive, small_files(args.files))
+        start = time.perf_counter()
+        _extract(archive, destination, None)
+        print(f"initial sync of {args.files} files: {time.perf_counter() - start:.2f}s")
+
+        ok = True
+        for modified in [-1, args.files // 2]:
+            write_archive(archive, small_files(args.files, modified))
+            label = "unchanged" if modified < 0 else "1 modified"
+            results = {}
+            for name, index in [("stat", None), ("index", FSIndex())]:
+                elapsed = _extract(archive, destination, index)
+                # Renamed versions of the modified file, removed again so that both start from the same state
+                stored = sorted(path.name for path in destination.rglob("*_1.pdf"))
+                results[name] = stored
+                print(f"{label:<11} {name:<6} {elapsed * 1000:>9.1f} ms, stored: {stored}")
+                for path in destination.rglob("*_1.pdf"):
+                    path.unlink()
+            if results["stat"] != results["index"]:
+                ok = False
+                print(f"FAIL: stat and index disagree on the {label} course: {results}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
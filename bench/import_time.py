@@ -0,0 +1,79 @@
+'''
+Author: Uyanide pywang0608@foxmail.com
+Date: 2026-10-19 01:11:47
+LastEditTime: 2026-10-19 02:28:10
+Description: Check the import time budget of the CLI entry point with -X importtime
+'''
+
+from argparse import ArgumentParser
+from pathlib import Path
+import subprocess
+import sys
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Modules that must not be imported before the chosen code path needs them
+FORBIDDEN_MODULES = [
+    "autumoodle.downloader",
+    "autumoodle.session_requests",
+    "autumoodle.session_playwright",
+    "autumoodle.session_webservice",
+    "autumoodle.history",
+    "autumoodle.versions",
+    "httpx",
+    "bs4",
+    "playwright",
+    "sqlite3",
+]
+
+
+def measure(module: str) -> tuple[int, dict[str, int]]:
+    '''Import the module in a fresh interpreter, returns (its cumulative import time in us, {module: cumulative us})'''
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        if not cumulative.strip().isdigit():
+            continue  # header line
+        modules[name.strip()] = int(cumulative)
+    return modules.get(module, 0), modules
+
+
+def main():
+    parser = ArgumentParser(description="Check the import time budget of the CLI entry point")
+    parser.add_argument("--budget-ms", type=float, default=100.0, help="Import time budget of autumoodle.cli (default: 100ms)")
+    parser.add_argument("--runs", type=int, default=5, help="Number of runs, the fastest one is taken (default: 5)")
+    args = parser.parse_args()
+
+    best = None
+    modules = {}
+    for _ in range(args.runs):
+        total, modules = measure("autumoodle.cli")
+        best = total if best is None else min(best, total)
+    assert best is not None
+
+    ok = True
+    own = sorted(((name, t) for name, t in modules.items() if name.startswith("autumoodle")), key=lambda x: -x[1])
+    for name, t in own:
+        print(f"{t / 1000:8.2f} ms  {name}")
+
+    forbidden = [name for name in FORBIDDEN_MODULES if name in modules]
+    if forbidden:
+        ok = False
+        print(f"FAIL: heavy modules imported by autumoodle.cli: {', '.join(forbidden)}")
+
+    print(f"autumoodle.cli: {best / 1000:.2f} ms (budget: {args.budget_ms:.2f} ms)")
+    if best / 1000 > args.budget_ms:
+        ok = False
+        print("FAIL: import time budget exceeded")
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
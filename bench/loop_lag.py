@@ -0,0 +1,99 @@
+'''
+Author: Uyanide pywang0608@foxmail.com
+Date: 2026-10-19 01:51:00
+LastEditTime: 2026-10-19 01:51:00
+Description: Measure how long writing downloads to disk blocks the event loop, with and without the writer threads
+'''
+
+from argparse import ArgumentParser
+from pathlib import Path
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from autumoodle import aio_writer  # noqa: E402
+from autumoodle.aio_writer import AsyncFileWriter  # noqa: E402
+
+CHUNK_SIZE = 64 * 1024
+
+
+async def _watch(interval: float, lags: list[float], stop: asyncio.Event):
+    '''Records how late the loop wakes up a task sleeping for the given interval.'''
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def _receive(size: int, rate: float):
+    '''Chunks as received from the network at the given rate in MiB/s.'''
+    chunk = os.urandom(CHUNK_SIZE)
+    for _ in range(size // CHUNK_SIZE):
+        await asyncio.sleep(CHUNK_SIZE / (rate * 1024 * 1024))
+        yield chunk
+
+
+async def _download_blocking(path: Path, size: int, rate: float, fsync: bool):
+    with open(path, "wb") as f:
+        async for chunk in _receive(size, rate):
+            f.write(chunk)
+        if fsync:
+            os.fsync(f.fileno())
+
+
+def _fsync(path: Path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+async def _download_async(path: Path, size: int, rate: float, fsync: bool):
+    async with AsyncFileWriter(path, size_hint=size) as f:
+        async for chunk in _receive(size, rate):
+            await f.write(chunk)
+    if fsync:
+        await asyncio.to_thread(_fsync, path)
+
+
+async def _run(download, directory: Path, downloads: int, size: int, rate: float, fsync: bool) -> tuple[float, float, float]:
+    '''Returns (elapsed s, max loop lag ms, p99 loop lag ms)'''
+    lags: list[float] = []
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(_watch(0.005, lags, stop))
+    start = time.perf_counter()
+    await asyncio.gather(*[download(directory / f"file_{i}.bin", size, rate, fsync) for i in range(downloads)])
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await watcher
+    lags.sort()
+    return elapsed, lags[-1] * 1000, lags[int(len(lags) * 0.99)] * 1000
+
+
+def main():
+    parser = ArgumentParser(description="Measure how long writing downloads blocks the event loop")
+    parser.add_argument("--downloads", type=int, default=8, help="Number of concurrent downloads (default: 8)")
+    parser.add_argument("--size", type=int, default=32, help="Size of each download in MiB (default: 32)")
+    parser.add_argument("--rate", type=float, default=20, help="Network rate of each download in MiB/s (default: 20)")
+    parser.add_argument("--dir", type=Path, help="Directory to write to, e.g. on a network share (default: a temporary one)")
+    parser.add_argument("--fsync", action="store_true", help="Sync each file to disk once written")
+    parser.add_argument("--preallocate", action="store_true", help="Preallocate the files with the writer threads")
+    args = parser.parse_args()
+
+    aio_writer.configure(4, args.preallocate)
+    size = args.size * 1024 * 1024
+    for name, download in [("blocking", _download_blocking), ("writer", _download_async)]:
+        with tempfile.TemporaryDirectory(prefix="autumoodle_bench_", dir=args.dir) as temp_dir:
+            elapsed, max_lag, p99_lag = asyncio.run(_run(download, Path(temp_dir), args.downloads, size, args.rate, args.fsync))
+            aio_writer.shutdown()
+        print(f"{name:<9} {args.downloads * args.size / elapsed:>8.1f} MiB/s, "
+              f"loop lag max {max_lag:>7.1f} ms, p99 {p99_lag:>7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
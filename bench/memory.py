@@ -0,0 +1,107 @@
+'''
+Author: Uyanide pywang0608@foxmail.com
+Date: 2026-10-19 01:30:17
+LastEditTime: 2026-10-19 02:27:53
+Description: Check the peak RSS of parsing and extracting a synthetic course with many files
+'''
+
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from pathlib import Path
+import gc
+import io
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from moodle_pages import download_center_page  # noqa: E402
+from course_archives import random_files, write_archive  # noqa: E402
+
+
+def _peak_rss_mb() -> float:
+    # in KiB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def phase_parse(files: int) -> None:
+    from bs4 import Tag
+    from autumoodle.session_requests import parse_download_center
+    html = download_center_page(files).html
+    start = time.perf_counter()
+    form, categories = parse_download_center(html)
+    elapsed = time.perf_counter() - start
+    del html
+    gc.collect()
+    # Nothing of the tree may be kept alive by the parse result
+    live_tags = sum(1 for obj in gc.get_objects() if isinstance(obj, Tag))
+    entries = sum(len(category.entries) for category in categories)
+    print(f"parsed {entries} entries in {len(categories)} categories in {elapsed:.1f}s, {live_tags} tags alive")
+    if live_tags:
+        print("FAIL: the parse tree is still alive")
+        sys.exit(1)
+    assert form.action
+
+
+def phase_extract(archive: Path, files: int) -> None:
+    from autumoodle.config_mgr import UpdateType
+    from autumoodle.summary import SummaryManager
+    from autumoodle.zip_extract import EntryDownloadConfig, extract_files
+    with tempfile.TemporaryDirectory(prefix="autumoodle_bench_") as temp_dir:
+        destination = Path(temp_dir) / "course"
+        configs = [EntryDownloadConfig(None, None, False, destination, UpdateType.RENAME)]
+        start = time.perf_counter()
+        # The summary printed on exit is not of interest here
+        with redirect_stdout(io.StringIO()), SummaryManager(1, Path(temp_dir) / "summary") as summary_writer:
+            extract_files(archive, "Course", destination, configs, [], [], summary_writer)
+        elapsed = time.perf_counter() - start
+        extracted = sum(1 for path in destination.rglob("*") if path.is_file())
+    print(f"extracted {extracted} files in {elapsed:.1f}s")
+    if extracted != files:
+        print(f"FAIL: expected {files} files to be extracted")
+        sys.exit(1)
+
+
+def main():
+    parser = ArgumentParser(description="Check the peak RSS of parsing and extracting a synthetic course")
+    parser.add_argument("--files", type=int, default=20000, help="Number of files in the course (default: 20000)")
+    parser.add_argument("--budget-mb", type=float, default=256.0, help="Peak RSS budget of each phase (default: 256 MiB)")
+    parser.add_argument("--phase", choices=["parse", "extract"], help=None)  # internal, run in a fresh interpreter
+    parser.add_argument("--archive", type=Path, help=None)  # internal
+    args = parser.parse_args()
+
+    if args.phase == "parse":
+        phase_parse(args.files)
+        print(f"peak RSS: {_peak_rss_mb():.1f} MiB")
+        return
+    if args.phase == "extract":
+        phase_extract(args.archive, args.files)
+        print(f"peak RSS: {_peak_rss_mb():.1f} MiB")
+        return
+
+    ok = True
+    with tempfile.TemporaryDirectory(prefix="autumoodle_bench_") as temp_dir:
+        archive = Path(temp_dir) / "course.zip"
+        write_archive(archive, random_files(args.files))
+        for phase in ["parse", "extract"]:
+            # Each phase in a fresh interpreter, since the peak RSS of a process never goes down
+            result = subprocess.run([sys.executable, __file__, "--phase", phase, "--files", str(args.files),
+                                     "--archive", str(archive)], capture_output=True, text=True)
+            print(f"[{phase}] " + result.stdout.strip().replace("\n", f"\n[{phase}] "))
+            if result.returncode != 0:
+                ok = False
+                print(result.stderr.strip())
+                continue
+            peak = float(result.stdout.strip().splitlines()[-1].split()[2])
+            if peak > args.budget_mb:
+                ok = False
+                print(f"FAIL: peak RSS of {phase} exceeds the budget of {args.budget_mb:.0f} MiB")
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+'''
+Author: Uyanide pywang0608@foxmail.com
+Date: 2026-10-19 01:26:15
+LastEditTime: 2026-10-19 01:26:15
+Description: Synthetic, anonymised Moodle pages mirroring the DOM structure the session parsers rely on
+'''
+
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from html import escape
+from pathlib import Path
+import random
+
+# Number of resources in the generated download center pages
+SIZES = {
+    "small": 20,
+    "medium": 200,
+    "large": 1000,
+    "huge": 5000,
+}
+
+# Titles are made up, but contain the umlauts, entities and whitespace that real pages have
+_WORDS = ["Vorlesung", "Übung", "Tutorium", "Lösung", "Folien", "Blatt", "Klausur", "Q&A", "Zusammenfassung",
+          "Einführung", "Kapitel", "Hausaufgabe", "Projekt", "Ergänzung", "<Entwurf>", "Anhang"]
+_SEMESTERS = ["WiSe 2023/24", "SoSe 2024", "WiSe 2024/25", "SoSe 2025", "WiSe 2025/26"]
+
+
+@dataclass(frozen=True, slots=True)
+class Page:
+    name: str
+    html: str
+    # What the parsers are expected to extract:
+    # for download center pages [(category title, [(entry id, entry title)])],
+    # for course pages [(id, title, metainfo)]
+    expected: list
+
+
+def _title(rng: random.Random, index: int) -> str:
+    return f"{' '.join(rng.sample(_WORDS, rng.randint(1, 3)))} {index}"
+
+
+def download_center_page(entries: int, seed: int = 0) -> Page:
+    '''A download center page with the given number of resources spread over sections of varying size.'''
+    rng = random.Random(seed)
+    parts = [
+        '<!DOCTYPE html><html lang="de"><head><meta charset="utf-8"><title>Downloadcenter</title></head><body>',
+        '<div id="page"><div role="main">',
+        '<div class="card"><div class="card-body"><p>Wählen Sie die herunterzuladenden Materialien aus.</p></div></div>',
+        '<form action="https://moodle.example.org/local/downloadcenter/index.php" method="post" id="mform1">',
+        '<input type="hidden" name="courseid" value="1">',
+        '<input type="hidden" name="sesskey" value="0123456789">',
+        '<input type="hidden" name="_qf__local_downloadcenter_download_form" value="1">',
+        '<p><a id="downloadcenter-all-included" href="#">Alle</a> / '
+        '<a id="downloadcenter-none-included" href="#">Keine</a></p>',
+    ]
+    expected = []
+    section = 0
+    entry_id = 1000
+    remaining = entries
+    while remaining > 0:
+        section += 1
+        section_title = f"Thema {section}: {_title(rng, section)}"
+        count = min(remaining, rng.randint(1, 40))
+        remaining -= count
+        parts.append(f'<div class="card block mb-3"><div class="card-body">'
+                     f'<div class="form-check"><input type="checkbox" class="form-check-input" '
+                     f'name="item_topic_{section}" id="id_item_topic_{section}" value="1" checked>'
+                     f'<label class="form-check-label" for="id_item_topic_{section}">'
+                     f'<span class="sectiontitle">\n  {escape(section_title)}\n</span></label></div>')
+        category_entries = []
+        for _ in range(count):
+            entry_id += rng.randint(1, 7)
+            kind = rng.choice(["resource", "folder", "url", "page"])
+            entry_title = _title(rng, entry_id)
+            parts.append(f'<div class="form-check ml-4"><input type="checkbox" class="form-check-input" '
+                         f'name="item_{kind}_{entry_id}" id="id_item_{kind}_{entry_id}" value="1" checked>'
+                         f'<label class="form-check-label" for="id_item_{kind}_{entry_id}">'
+                         f'<span class="itemtitle"><img class="icon" src="icon.svg" alt="">'
+                         f'<span> {escape(entry_title)} </span></span></label></div>')
+            category_entries.append((str(entry_id), entry_title))
+        parts.append('</div></div>')
+        expected.append((section_title, category_entries))
+    # An empty section is skipped by the parsers
+    section += 1
+    parts.append(f'<div class="card block mb-3"><div class="card-body">'
+                 f'<div class="form-check"><input type="checkbox" name="item_topic_{section}" checked>'
+                 f'<label><span class="sectiontitle">Leerer Abschnitt</span></label></div></div></div>')
+    parts.extend([
+        '<input type="checkbox" name="filesrealnames" id="id_filesrealnames" value="1" checked>',
+        '<input type="checkbox" name="addnumbering" id="id_addnumbering" value="1" checked>',
+        '<input type="submit" name="submitbutton" id="id_submitbutton" value="ZIP-Archiv erstellen">',
+        '</form></div></div></body></html>',
+    ])
+    return Page(f"download_center_{entries}", "\n".join(parts), expected)
+
+
+def courses_page(courses: int, seed: int = 0) -> Page:
+    '''A "Meine Startseite" page with the given number of courses.'''
+    rng = random.Random(seed)
+    parts = [
+        '<!DOCTYPE html><html lang="de"><head><meta charset="utf-8"><title>Meine Startseite</title></head><body>',
+        '<div id="page"><div role="main"><div class="course_category_tree">',
+    ]
+    expected = []
+    for i in range(courses):
+        course_id = 10000 + i * rng.randint(1, 9)
+        title = f"Kurs {i}: {_title(rng, i)}"
+        metainfo = f"({rng.choice(_SEMESTERS)} | Lehrstuhl {rng.randint(1, 50)})"
+        parts.append(f'<div class="coursebox clearfix" data-courseid="{course_id}"><div class="info">'
+                     f'<h3 class="coursename"><a href="https://moodle.example.org/course/view.php?id={course_id}" '
+                     f'title="{escape(title)}">{escape(title)}<span class="coc-metainfo">{escape(metainfo)}</span></a>'
+                     f'</h3></div><div class="content"><div class="summary"><p>{escape(_title(rng, i))}</p></div></div></div>')
+        expected.append((str(course_id), title, metainfo))
+    parts.append('</div></div></div></body></html>')
+    return Page(f"courses_{courses}", "\n".join(parts), expected)
+
+
+def main():
+    parser = ArgumentParser(description="Write the synthetic Moodle pages to a directory")
+    parser.add_argument("output", type=Path, help="Directory to write the pages to")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    args = parser.parse_args()
+
+    args.output.mkdir(parents=True, exist_ok=True)
+    for size in SIZES.values():
+        for page in (download_center_page(size, args.seed), courses_page(max(1, size // 10), args.seed)):
+            path = args.output / f"{page.name}.html"
+            path.write_text(page.html, encoding="utf-8")
+            print(f"{path} ({len(page.html) / 1024:.1f} KiB)")
+
+
+if __name__ == "__main__":
+    main()
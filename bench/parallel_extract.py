@@ -0,0 +1,64 @@
+'''
+Author: Uyanide pywang0608@foxmail.com
+Date: 2026-10-19 01:56:07
+LastEditTime: 2026-10-19 02:27:53
+Description: Compare extracting an archive of many compressed files in one and in several processes
+'''
+
+from argparse import ArgumentParser
+from pathlib import Path
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from autumoodle.config_mgr import UpdateType  # noqa: E402
+from autumoodle.zip_extract import EntryDownloadConfig, ExtractOptions, extract_files, shutdown_process_pool  # noqa: E402
+from course_archives import CollectingSummaryWriter, text_files, write_archive  # noqa: E402
+
+
+def _extract(archive: Path, destination: Path, workers: int) -> tuple[float, list[str]]:
+    '''Returns (time taken in s, stored paths in summary order relative to the destination)'''
+    configs = [EntryDownloadConfig(None, None, False, destination, UpdateType.RENAME)]
+    entries = CollectingSummaryWriter()
+    start = time.perf_counter()
+    extract_files(archive, "Course", destination, configs, [], [], entries, options=ExtractOptions(True, workers))
+    elapsed = time.perf_counter() - start
+    return elapsed, [str(Path(entry.stored_path).relative_to(destination)) for entry in entries.entries]
+
+
+def main():
+    parser = ArgumentParser(description="Compare extracting an archive of many compressed files in one and in several processes")
+    parser.add_argument("--files", type=int, default=5000, help="Number of files in the archive (default: 5000)")
+    parser.add_argument("--size", type=int, default=64, help="Size of each file in KiB (default: 64)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Number of processes (default: one per core)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="autumoodle_bench_") as temp_dir:
+        archive = Path(temp_dir) / "course.zip"
+        write_archive(archive, text_files(args.files, args.size * 1024))
+        results = {}
+        for workers in sorted({1, args.workers}):
+            destination = Path(temp_dir) / f"workers_{workers}"
+            # The process pool is started by the first archive, which is not measured
+            if workers > 1:
+                _extract(archive, Path(temp_dir) / "warmup", workers)
+            elapsed, stored = _extract(archive, destination, workers)
+            results[workers] = (destination, stored)
+            print(f"{workers:>3} workers: {args.files / elapsed:>8.0f} files/s, {elapsed:.2f}s")
+        shutdown_process_pool()
+
+        (first, first_stored), (last, last_stored) = results[1], results[max(results)]
+        if first_stored != last_stored:
+            print("FAIL: files are not stored in the same order")
+            sys.exit(1)
+        for name in first_stored:
+            if (first / name).read_bytes() != (last / name).read_bytes():
+                print(f"FAIL: {name} differs")
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+'''
+Author: Uyanide pywang0608@foxmail.com
+Date: 2026-10-19 01:59:50
+LastEditTime: 2026-10-19 01:59:50
+Description: Compare parsing download center pages with looking them up in the parse cache, and check that both agree
+'''
+
+from argparse import ArgumentParser
+from pathlib import Path
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from autumoodle import session_requests  # noqa: E402
+from autumoodle.parse_cache import ParseCache  # noqa: E402
+from autumoodle.session_requests import DOWNLOAD_CENTER_PARSER_VERSION  # noqa: E402
+from moodle_pages import SIZES, download_center_page  # noqa: E402
+
+
+def _reload(html: str, sesskey: str) -> str:
+    '''The same page as fetched again, under another session key and with other generated ids.'''
+    return (html.replace('value="0123456789"', f'value="{sesskey}"')
+            .replace("</body>", f'<div id="yui_3_18_1_1_{time.time_ns() // 1000000}_42"></div></body>'))
+
+
+def _best(func, runs: int) -> tuple[float, object]:
+    best, result = None, None
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    assert best is not None
+    return best, result
+
+
+def _lookup(cache: ParseCache, html: str):
+    _, cached = cache.get(html)
+    return session_requests._load_download_center(html, cached) if cached else None
+
+
+def main():
+    parser = ArgumentParser(description="Compare parsing download center pages with looking them up in the parse cache")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=list(SIZES),
+                        help="Sizes of the synthetic pages (default: all)")
+    parser.add_argument("--runs", type=int, default=5, help="Number of runs, the fastest one is taken (default: 5)")
+    args = parser.parse_args()
+
+    ok = True
+    with tempfile.TemporaryDirectory(prefix="autumoodle_bench_") as temp_dir:
+        cache = ParseCache(Path(temp_dir), 64 * 1024 * 1024, DOWNLOAD_CENTER_PARSER_VERSION)
+        print(f"{'page':<28} {'size':>10} {'parse':>10} {'cached':>10}")
+        for size in args.sizes:
+            page = download_center_page(SIZES[size])
+            html = _reload(page.html, "0123456789")
+            parse_time, parsed = _best(lambda: session_requests.parse_download_center(html), args.runs)
+            key, _ = cache.get(html)
+            cache.put(key, session_requests._dump_download_center(*parsed))
+
+            reloaded = _reload(page.html, "abcdef9876")
+            cached_time, cached = _best(lambda: _lookup(cache, reloaded), args.runs)
+            print(f"{page.name:<28} {len(page.html) / 1024:>6.0f} KiB {parse_time * 1000:>7.1f} ms {cached_time * 1000:>7.1f} ms")
+
+            expected = session_requests.parse_download_center(reloaded)
+            if cached != expected:
+                ok = False
+                print(f"FAIL: cached results of {page.name} differ from parsing it")
+            # Any other change to the page has to be parsed again
+            if _lookup(cache, html.replace("</form>", '<input type="hidden" name="extra" value="1"></form>')):
+                ok = False
+                print(f"FAIL: changed {page.name} was taken from the cache")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+'''
+Author: Uyanide pywang0608@foxmail.com
+Date: 2026-10-19 01:26:15
+LastEditTime: 2026-10-19 01:26:15
+Description: Measure parse time and allocations of the session parsers and check that both backends agree
+'''
+
+from argparse import ArgumentParser
+from pathlib import Path
+import asyncio
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from autumoodle import session_requests  # noqa: E402
+from moodle_pages import SIZES, Page, courses_page, download_center_page  # noqa: E402
+
+
+def _normalize_categories(categories) -> list:
+    return [(category.title, [(entry.id, entry.title) for entry in category.entries]) for category in categories]
+
+
+def _normalize_courses(courses) -> list:
+    return [(course.id, course.title, course.metainfo) for course in courses]
+
+
+def _is_courses_page(page: Page) -> bool:
+    return page.name.startswith("courses")
+
+
+def _load_pages(directory: Path) -> list[Page]:
+    '''Load recorded (and anonymised) pages, named courses*.html or download_center*.html'''
+    pages = []
+    for path in sorted(directory.glob("*.html")):
+        if not path.name.startswith(("courses", "download_center")):
+            print(f"Skipping {path}, expected courses*.html or download_center*.html")
+            continue
+        # Nothing to compare with but the other backend
+        pages.append(Page(path.stem, path.read_text(encoding="utf-8"), []))
+    return pages
+
+
+class RequestsBackend:
+    name = "requests"
+
+    async def parse(self, page: Page) -> list:
+        if _is_courses_page(page):
+            return _normalize_courses(session_requests.parse_courses(page.html))
+        _, categories = session_requests.parse_download_center(page.html)
+        return _normalize_categories(categories)
+
+
+class PlaywrightBackend:
+    '''Parses the pages in a real browser, loaded via set_content so that no network access is needed.'''
+    name = "playwright"
+
+    def __init__(self, browser_name: str):
+        self._browser_name = browser_name
+
+    async def __aenter__(self):
+        from autumoodle import session_playwright
+        from playwright.async_api import async_playwright
+        self._module = session_playwright
+        self._playwright = await async_playwright().start()
+        self._browser = await getattr(self._playwright, self._browser_name).launch(headless=True)
+        self._page = await self._browser.new_page()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self._browser.close()
+        await self._playwright.stop()
+
+    async def load(self, page: Page):
+        await self._page.set_content(page.html)
+
+    async def parse(self, page: Page) -> list:
+        if _is_courses_page(page):
+            return _normalize_courses(await self._module.parse_courses(self._page))
+        return _normalize_categories(await self._module.parse_download_center(self._page))
+
+
+async def _measure(backend, page: Page, runs: int) -> tuple[float, int, list]:
+    '''Returns (fastest parse time in s, peak traced allocation in bytes, parse result)'''
+    best = None
+    result = []
+    for _ in range(runs):
+        if hasattr(backend, "load"):
+            await backend.load(page)
+        start = time.perf_counter()
+        result = await backend.parse(page)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    assert best is not None
+    # Traced separately since tracemalloc slows down allocations considerably
+    if hasattr(backend, "load"):
+        await backend.load(page)
+    tracemalloc.start()
+    await backend.parse(page)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, result
+
+
+async def run(pages: list[Page], backends: list, runs: int) -> bool:
+    ok = True
+    print(f"{'page':<28} {'backend':<11} {'size':>10} {'items':>6} {'time':>10} {'peak alloc':>11}")
+    for page in pages:
+        results = {}
+        for backend in backends:
+            elapsed, peak, result = await _measure(backend, page, runs)
+            results[backend.name] = result
+            items = sum(len(entries) for _, entries in result) if not _is_courses_page(page) else len(result)
+            print(f"{page.name:<28} {backend.name:<11} {len(page.html) / 1024:>6.0f} KiB {items:>6} "
+                  f"{elapsed * 1000:>7.1f} ms {peak / 1024 / 1024:>7.2f} MiB")
+            if page.expected and result != page.expected:
+                ok = False
+                print(f"FAIL: {backend.name} parsed {page.name} differently than expected")
+        if len(set(map(repr, results.values()))) > 1:
+            ok = False
+            print(f"FAIL: backends disagree on {page.name}")
+    return ok
+
+
+async def main():
+    parser = ArgumentParser(description="Measure parse time and allocations of the session parsers")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=list(SIZES),
+                        help="Sizes of the synthetic pages (default: all)")
+    parser.add_argument("--pages", type=Path, help="Directory of recorded pages to parse in addition")
+    parser.add_argument("--runs", type=int, default=5, help="Number of runs, the fastest one is taken (default: 5)")
+    parser.add_argument("--browser", choices=["chromium", "firefox", "webkit"], default="chromium",
+                        help="Browser for the playwright backend (default: chromium)")
+    parser.add_argument("--no-playwright", action="store_true", help="Only benchmark the requests backend")
+    args = parser.parse_args()
+
+    pages = []
+    for size in args.sizes:
+        pages.append(download_center_page(SIZES[size]))
+        pages.append(courses_page(max(1, SIZES[size] // 10)))
+    if args.pages:
+        pages.extend(_load_pages(args.pages))
+
+    backends: list = [RequestsBackend()]
+    if args.no_playwright:
+        sys.exit(0 if await run(pages, backends, args.runs) else 1)
+    try:
+        import playwright  # noqa: F401
+    except ImportError:
+        print("playwright is not installed, only benchmarking the requests backend")
+        sys.exit(0 if await run(pages, backends, args.runs) else 1)
+    async with PlaywrightBackend(args.browser) as playwright_backend:
+        backends.append(playwright_backend)
+        sys.exit(0 if await run(pages, backends, args.runs) else 1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,128 @@
+'''
+Author: Uyanide pywang0608@foxmail.com
+Date: 2026-10-19 02:01:21
+LastEditTime: 2026-10-19 02:01:21
+Description: Compare sanitize_filename with its former regex-based implementation, for speed and equal output
+'''
+
+from argparse import ArgumentParser
+from pathlib import Path
+import random
+import re
+import sys
+import time
+import unicodedata
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from autumoodle import utils  # noqa: E402
+from moodle_pages import SIZES, download_center_page  # noqa: E402
+
+# Titles as they appear on real course pages, including the characters the sanitizer has to deal with
+_TITLES = [
+    "Einführung in die Informatik (IN0001)",
+    "Analysis für Informatik [MA0902]",
+    "Grundlagen: Rechnerarchitektur / -organisation",
+    "Diskrete Strukturen (WiSe 2025/26)",
+    "Übungsblatt 3 - Lösungsvorschlag",
+    "Q&A: \"Wie funktioniert das?\"",
+    "Vorlesung 12 | Aufzeichnung",
+    "Folien*.pdf",
+    "<Entwurf> Projektbeschreibung",
+    "Ｆｕｌｌｗｉｄｔｈ　Ｔｉｔｅｌ／Ｔｅｉｌ１",
+    "ﬁnale Version ﬀ",
+    "Kapitel ½ – Grundlagen²",
+    "Tab\tund\nZeilenumbruch\r",
+    "  Leerzeichen am Rand  ",
+    "\x00\x1f\x7f Steuerzeichen",
+    "Backslash\\Pfad\\Datei",
+    "Café vs. Café",
+    "Ångström ℃ №",
+    "数学 (Mathematik) ？",
+    "Ελληνικά : Αρχεία",
+    " Enspace　Ideographic ",
+    "?",
+    "",
+]
+
+
+def _reference(filename: str | Path, allow_separators: bool = False) -> str:
+    '''sanitize_filename as it was before, with the regular expressions.'''
+    if not filename:
+        return "unnamed"
+
+    if not isinstance(filename, str):
+        filename = str(filename)
+
+    filename = unicodedata.normalize("NFKC", filename)
+    filename = re.sub(r"[\x00-\x1F\x7F]", "", filename)
+    filename = filename.strip()
+
+    if not allow_separators:
+        filename = filename.replace("/", "").replace("\\", "")
+
+    filename = re.sub(r'[<>:"|*]', "", filename)
+    filename = re.sub(r'[?]', "_", filename)
+
+    return filename
+
+
+def _corpus(size: int, seed: int = 0) -> list[str]:
+    '''The titles above, those of a synthetic download center page and random mixes of their characters.'''
+    rng = random.Random(seed)
+    titles = list(_TITLES)
+    for category_title, entries in download_center_page(size).expected:
+        titles.append(category_title)
+        titles.extend(entry_title for _, entry_title in entries)
+    alphabet = "".join(sorted(set("".join(titles)))) + "".join(map(chr, range(0x20))) + "\x7f  ﬁ／"
+    titles.extend("".join(rng.choices(alphabet, k=rng.randint(1, 40))) for _ in range(size))
+    return titles
+
+
+def _best(func, titles: list[str], runs: int) -> float:
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        for title in titles:
+            func(title)
+            func(title, allow_separators=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    assert best is not None
+    return best
+
+
+def main():
+    parser = ArgumentParser(description="Compare sanitize_filename with its former regex-based implementation")
+    parser.add_argument("--titles", type=Path, help="File of recorded titles, one per line, to check in addition")
+    parser.add_argument("--size", type=int, default=SIZES["large"], help="Number of generated titles (default: %(default)s)")
+    parser.add_argument("--runs", type=int, default=5, help="Number of runs, the fastest one is taken (default: 5)")
+    args = parser.parse_args()
+
+    titles = _corpus(args.size)
+    if args.titles:
+        titles.extend(args.titles.read_text(encoding="utf-8").splitlines())
+
+    ok = True
+    for title in titles:
+        for allow_separators in (False, True):
+            expected = _reference(title, allow_separators)
+            result = utils.sanitize_filename(title, allow_separators)
+            if result != expected:
+                ok = False
+                print(f"FAIL: {title!r} (allow_separators={allow_separators}): {result!r} != {expected!r}")
+
+    # Each title once, as a single run of a course sees most of them
+    unique = list(dict.fromkeys(titles))
+    reference_time = _best(_reference, unique, args.runs)
+    uncached = utils._sanitize_filename.__wrapped__
+    uncached_time = _best(lambda title, allow_separators=False: uncached(title, allow_separators), unique, args.runs)
+    warm_time = _best(utils.sanitize_filename, unique, args.runs)
+    calls = 2 * len(unique)
+    for name, elapsed in [("regex", reference_time), ("translate", uncached_time), ("cached", warm_time)]:
+        print(f"{name:<10} {elapsed / calls * 1e6:>6.2f} µs per call, {calls} calls")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+'''
+Author: Uyanide pywang0608@foxmail.com
+Date: 2026-10-19 01:35:21
+LastEditTime: 2026-10-19 01:35:21
+Description: Local stand-in for the Moodle web service, serving synthetic or recorded JSON and files
+'''
+
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, quote, urlsplit
+import hashlib
+import json
+import random
+import re
+import time
+
+# Recorded responses are read from files named after the web service function, e.g.
+#   core_webservice_get_site_info.json
+#   core_enrol_get_users_courses.json
+#   core_course_get_contents_<courseid>.json
+# which can be recorded with
+#   curl -d wstoken=$TOKEN -d moodlewsrestformat=json -d wsfunction=core_course_get_contents -d courseid=$ID \
+#        https://www.moodle.tum.de/webservice/rest/server.php
+
+
+class StandIn:
+    token: str
+    base_url: str
+    responses: dict[str, object]  # function name (with courseid) -> response
+    files: dict[str, int]         # path of the file URL -> size
+
+    def __init__(self, token: str, base_url: str):
+        self.token = token
+        self.base_url = base_url
+        self.responses = {}
+        self.files = {}
+
+    def _register_files(self, sections: list) -> None:
+        # File URLs are rewritten to point to the stand-in
+        for section in sections:
+            for module in section.get("modules", []):
+                for content in module.get("contents", []):
+                    if content.get("type") != "file" or "fileurl" not in content:
+                        continue
+                    path = urlsplit(content["fileurl"]).path
+                    query = urlsplit(content["fileurl"]).query
+                    content["fileurl"] = f"{self.base_url}{path}" + (f"?{query}" if query else "")
+                    self.files[path] = content.get("filesize", 0)
+
+    def load_recorded(self, directory: Path) -> None:
+        for path in directory.glob("*.json"):
+            data = json.loads(path.read_text(encoding="utf-8"))
+            if path.stem.startswith("core_course_get_contents"):
+                self._register_files(data)
+            self.responses[path.stem] = data
+
+    def generate(self, courses: int, files: int, seed: int = 0) -> None:
+        '''Synthetic courses with sections of resources and folders, files get modified over time.'''
+        rng = random.Random(seed)
+        self.responses["core_webservice_get_site_info"] = {"userid": 2, "sitename": "AuTUMoodle stand-in"}
+        course_list = []
+        now = int(time.time())
+        for c in range(courses):
+            course_id = 1000 + c
+            course_list.append({
+                "id": course_id,
+                "shortname": f"C{c}",
+                "fullname": f"Kurs {c} &amp; Übung",
+                "startdate": int(time.mktime((2025, 10 if c % 2 == 0 else 4, 1, 0, 0, 0, 0, 0, -1))),
+                "hidden": c == courses - 1 and courses > 1,
+                "visible": 1,
+            })
+            sections = []
+            module_id = course_id * 1000
+            remaining = files
+            section = 0
+            while remaining > 0:
+                modules = []
+                for _ in range(rng.randint(1, 8)):
+                    if remaining <= 0:
+                        break
+                    module_id += 1
+                    folder = rng.random() < 0.2
+                    count = min(remaining, rng.randint(2, 5)) if folder else 1
+                    remaining -= count
+                    contents = []
+                    for f in range(count):
+                        filename = f"Datei {module_id}_{f}.pdf"
+                        area = "mod_folder/content/0" if folder else "mod_resource/content/1"
+                        contents.append({
+                            "type": "file",
+                            "filename": filename,
+                            "filepath": "/Unterordner/" if folder and f % 2 else "/",
+                            "filesize": rng.randint(1024, 256 * 1024),
+                            "fileurl": f"{self.base_url}/webservice/pluginfile.php/{module_id}/{area}/{quote(filename)}?forcedownload=1",
+                            "timemodified": now - rng.randint(0, 180 * 86400),
+                        })
+                    modules.append({
+                        "id": module_id,
+                        "name": f"{'Ordner' if folder else 'Folien'} {module_id}",
+                        "modname": "folder" if folder else "resource",
+                        "uservisible": True,
+                        "contents": contents,
+                    })
+                # A forum without files, which is to be skipped
+                modules.append({"id": module_id + 500, "name": "Ankündigungen", "modname": "forum", "uservisible": True})
+                sections.append({"id": section, "name": f"Thema {section}", "visible": 1, "modules": modules})
+                section += 1
+            self._register_files(sections)
+            self.responses[f"core_course_get_contents_{course_id}"] = sections
+        self.responses["core_enrol_get_users_courses"] = course_list
+
+    def call(self, function: str, params: dict[str, str]) -> object:
+        if function == "core_course_get_contents":
+            function = f"core_course_get_contents_{params.get('courseid')}"
+        if function not in self.responses:
+            return {"exception": "invalid_parameter_exception", "errorcode": "invalidparameter",
+                    "message": f"No recorded response for {function}"}
+        return self.responses[function]
+
+    def file_content(self, path: str) -> bytes | None:
+        size = self.files.get(path)
+        if size is None:
+            return None
+        # Deterministic content, so that downloads can be compared across runs
+        return random.Random(hashlib.sha256(path.encode()).digest()).randbytes(size)
+
+
+def make_handler(standin: StandIn):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status: int, body: bytes, content_type: str):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_json(self, data: object):
+            self._send(200, json.dumps(data).encode(), "application/json; charset=utf-8")
+
+        def do_POST(self):
+            if urlsplit(self.path).path != "/webservice/rest/server.php":
+                self._send(404, b"Not Found", "text/plain")
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            params = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode()).items()}
+            if params.get("wstoken") != standin.token:
+                self._send_json({"exception": "moodle_exception", "errorcode": "invalidtoken", "message": "Invalid token"})
+                return
+            self._send_json(standin.call(params.get("wsfunction", ""), params))
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if not re.match(r"^/webservice/pluginfile\.php/", url.path):
+                self._send(404, b"Not Found", "text/plain")
+                return
+            if parse_qs(url.query).get("token", [""])[0] != standin.token:
+                self._send_json({"error": "Invalid token", "errorcode": "invalidtoken"})
+                return
+            content = standin.file_content(url.path)
+            if content is None:
+                self._send(404, b"Not Found", "text/plain")
+                return
+            self._send(200, content, "application/pdf")
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = ArgumentParser(description="Serve a local stand-in for the Moodle web service")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on (default: 8765)")
+    parser.add_argument("--token", default="standin", help="Token expected from clients (default: standin)")
+    parser.add_argument("--recorded", type=Path, help="Directory of recorded responses, synthetic ones are served if omitted")
+    parser.add_argument("--courses", type=int, default=3, help="Number of synthetic courses (default: 3)")
+    parser.add_argument("--files", type=int, default=50, help="Number of files per synthetic course (default: 50)")
+    args = parser.parse_args()
+
+    base_url = f"http://{args.host}:{args.port}"
+    standin = StandIn(args.token, base_url)
+    if args.recorded:
+        standin.load_recorded(args.recorded)
+    else:
+        standin.generate(args.courses, args.files)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(standin))
+    print(f"Serving {len(standin.files)} files on {base_url}, use \"webservice\": "
+          f"{{\"url\": \"{base_url}\", \"token\": \"{args.token}\"}} in the config")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+'''
+Author: Uyanide pywang0608@foxmail.com
+Date: 2026-10-19 01:53:32
+LastEditTime: 2026-10-19 02:27:53
+Description: Compare extracting large stored archive members through Python and within the kernel
+'''
+
+from argparse import ArgumentParser
+from pathlib import Path
+import filecmp
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from autumoodle.config_mgr import UpdateType  # noqa: E402
+from autumoodle.zip_extract import EntryDownloadConfig, ExtractOptions, extract_files  # noqa: E402
+from course_archives import large_files, write_archive  # noqa: E402
+
+
+def _extract(archive: Path, destination: Path, zero_copy: bool) -> tuple[float, float]:
+    '''Returns (wall time in s, CPU time of this process in s)'''
+    configs = [EntryDownloadConfig(None, None, False, destination, UpdateType.OVERWRITE)]
+    start, start_cpu = time.perf_counter(), time.process_time()
+    extract_files(archive, "Course", destination, configs, [], [], None, options=ExtractOptions(zero_copy))
+    return time.perf_counter() - start, time.process_time() - start_cpu
+
+
+def main():
+    parser = ArgumentParser(description="Compare extracting stored archive members through Python and within the kernel")
+    parser.add_argument("--files", type=int, default=4, help="Number of stored files (default: 4)")
+    parser.add_argument("--size", type=int, default=256, help="Size of each file in MiB (default: 256)")
+    parser.add_argument("--dir", type=Path, help="Directory to extract into (default: a temporary one)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="autumoodle_bench_", dir=args.dir) as temp_dir:
+        archive = Path(temp_dir) / "course.zip"
+        write_archive(archive, large_files(args.files, args.size))
+        total = args.files * args.size
+        results = {}
+        for name, zero_copy in [("python", False), ("kernel", True)]:
+            destination = Path(temp_dir) / name
+            elapsed, cpu = _extract(archive, destination, zero_copy)
+            results[name] = destination
+            print(f"{name:<7} {total / elapsed:>8.1f} MiB/s, CPU {cpu:.2f}s for {total} MiB")
+
+        match, mismatch, errors = filecmp.cmpfiles(
+            results["python"], results["kernel"],
+            [f"Vorlesung {i}.mp4" for i in range(args.files)] + ["Notizen.txt"], shallow=False)
+        if mismatch or errors:
+            print(f"FAIL: extracted files differ: {mismatch + errors}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,17 +9,19 @@
 
 set -euo pipefail
 
-# Check envs
-
-[ -z "$TUM_USERNAME" ] && {
-    echo "Error: TUM_USERNAME environment variable is not set." >&2
-    exit 1
-}
-
-[ -z "$TUM_PASSWORD" ] && {
-    echo "Error: TUM_PASSWORD environment variable is not set." >&2
-    exit 1
-}
+# Check envs (per-account credentials like TUM_USERNAME_ALICE are checked by the CLI itself)
+
+if ! env | grep -q '^TUM_USERNAME_'; then
+    [ -z "${TUM_USERNAME:-}" ] && {
+        echo "Error: TUM_USERNAME environment variable is not set." >&2
+        exit 1
+    }
+
+    [ -z "${TUM_PASSWORD:-}" ] && {
+        echo "Error: TUM_PASSWORD environment variable is not set." >&2
+        exit 1
+    }
+fi
 
 [ -z "$PUID" ] && {
     PUID=1000